@@ -0,0 +1,252 @@
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.signals import setting_changed
+from django.db import connections, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .achievements import engine
+from .models import AchievementQueueEntry, Statistic, UserFollowing
+
+logger = logging.getLogger(__name__)
+
+BACKEND_ALIASES = {
+    'sync': 'api.achievement_queue.SynchronousBackend',
+    'thread': 'api.achievement_queue.ThreadPoolBackend',
+    'database': 'api.achievement_queue.DatabaseBackend',
+}
+
+ALL_FIELDS = '*'
+
+
+def merge_fields(current, changed_fields):
+    if current is ALL_FIELDS or changed_fields is None:
+        return ALL_FIELDS
+    return current | frozenset(changed_fields)
+
+
+def evaluate(pending):
+    groups = {}
+    for user_id, fields in pending.items():
+        groups.setdefault(fields, []).append(user_id)
+
+    awarded = {}
+    for fields, user_ids in groups.items():
+        users = list(User.objects.filter(pk__in=user_ids).select_related('statistics'))
+        awarded.update(engine.grant_many(users, None if fields is ALL_FIELDS else fields))
+    return awarded
+
+
+def evaluate_isolated(pending):
+    try:
+        with transaction.atomic():
+            evaluate(pending)
+        return set()
+    except Exception:
+        logger.exception('Deferred achievement evaluation failed for users %s, retrying them one by one',
+                         sorted(pending))
+
+    failed = set()
+    for user_id, fields in pending.items():
+        try:
+            with transaction.atomic():
+                evaluate({user_id: fields})
+        except Exception:
+            logger.exception('Deferred achievement evaluation failed for user %s, dropping its queue entries',
+                             user_id)
+            failed.add(user_id)
+    return failed
+
+
+class SynchronousBackend(object):
+    def __init__(self, options):
+        self.options = options
+
+    def enqueue(self, user, changed_fields=None):
+        engine.grant(user, changed_fields)
+
+    def enqueue_many(self, users, changed_fields=None):
+        engine.grant_many(users, changed_fields)
+
+    def drain(self):
+        return 0
+
+
+class ThreadPoolBackend(object):
+    def __init__(self, options):
+        self.window = options.get('COALESCE_WINDOW', 1.0)
+        self.batch_size = options.get('BATCH_SIZE', 100)
+        self.executor = ThreadPoolExecutor(max_workers=options.get('WORKERS', 2))
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+        self._futures = set()
+
+    def enqueue(self, user, changed_fields=None):
+        transaction.on_commit(lambda: self._add(user.pk, changed_fields))
+
+    def enqueue_many(self, users, changed_fields=None):
+        for user in users:
+            self.enqueue(user, changed_fields)
+
+    def _add(self, user_id, changed_fields):
+        with self._lock:
+            self._pending[user_id] = merge_fields(self._pending.get(user_id, frozenset()), changed_fields)
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _take(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            pending, self._pending = self._pending, {}
+        items = list(pending.items())
+        return [dict(items[i:i + self.batch_size]) for i in range(0, len(items), self.batch_size)]
+
+    def _flush(self):
+        for batch in self._take():
+            future = self.executor.submit(self._run, batch)
+            self._futures.add(future)
+            future.add_done_callback(self._futures.discard)
+
+    def _run(self, batch):
+        try:
+            evaluate(batch)
+        except Exception:
+            logger.exception('Deferred achievement evaluation failed for users %s', sorted(batch))
+        finally:
+            connections.close_all()
+
+    def drain(self):
+        wait(list(self._futures))
+        batches = self._take()
+        for batch in batches:
+            evaluate(batch)
+        return sum(len(batch) for batch in batches)
+
+
+class DatabaseBackend(object):
+    def __init__(self, options):
+        self.window = options.get('COALESCE_WINDOW', 1.0)
+        self.batch_size = options.get('BATCH_SIZE', 100)
+
+    def enqueue(self, user, changed_fields=None):
+        self.enqueue_many([user], changed_fields)
+
+    def enqueue_many(self, users, changed_fields=None):
+        changed_fields = None if changed_fields is None else ','.join(sorted(changed_fields))
+        AchievementQueueEntry.objects.bulk_create([
+            AchievementQueueEntry(user_id=user.pk, changed_fields=changed_fields) for user in users])
+
+    def drain(self, window=None):
+        window = self.window if window is None else window
+        processed = 0
+        while True:
+            with transaction.atomic():
+                entries = AchievementQueueEntry.objects.filter(
+                    enqueued_at__lte=timezone.now() - timedelta(seconds=window)).order_by('pk')
+                if connections[entries.db].features.has_select_for_update_skip_locked:
+                    entries = entries.select_for_update(skip_locked=True)
+                entries = list(entries.values_list('pk', 'user_id', 'changed_fields')[:self.batch_size])
+                if not entries:
+                    return processed
+
+                pending = {}
+                for _, user_id, changed_fields in entries:
+                    fields = None if changed_fields is None else [f for f in changed_fields.split(',') if f]
+                    pending[user_id] = merge_fields(pending.get(user_id, frozenset()), fields)
+                failed = evaluate_isolated(pending)
+                AchievementQueueEntry.objects.filter(pk__in=[pk for pk, _, _ in entries]).delete()
+                processed += len(pending) - len(failed)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            options = dict(getattr(settings, 'ACHIEVEMENT_QUEUE', {}))
+            path = options.get('BACKEND', 'sync')
+            _backend = import_string(BACKEND_ALIASES.get(path, path))(options)
+        return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(setting, **kwargs):
+    global _backend
+    if setting == 'ACHIEVEMENT_QUEUE':
+        with _backend_lock:
+            _backend = None
+
+
+_deferred = threading.local()
+
+
+@contextmanager
+def deferred():
+    if getattr(_deferred, 'pending', None) is not None:
+        yield
+        return
+    _deferred.pending = {}
+    try:
+        yield
+        pending = _deferred.pending
+    finally:
+        _deferred.pending = None
+
+    groups = {}
+    for user, fields in pending.values():
+        groups.setdefault(fields, []).append(user)
+    for fields, users in groups.items():
+        get_backend().enqueue_many(users, None if fields is ALL_FIELDS else fields)
+
+
+def defer(users, changed_fields):
+    pending = getattr(_deferred, 'pending', None)
+    if pending is None:
+        return False
+    for user in users:
+        _, fields = pending.get(user.pk, (user, frozenset()))
+        pending[user.pk] = (user, merge_fields(fields, changed_fields))
+    return True
+
+
+def enqueue(user, changed_fields=None):
+    if not defer([user], changed_fields):
+        get_backend().enqueue(user, changed_fields)
+
+
+def enqueue_many(users, changed_fields=None):
+    if not defer(users, changed_fields):
+        get_backend().enqueue_many(users, changed_fields)
+
+
+def drain():
+    return get_backend().drain()
+
+
+@receiver(post_save, sender=Statistic)
+@receiver(post_save, sender=UserFollowing)
+@receiver(post_save, sender=User)
+def trigger_achievements_after_statistics_save(sender, instance=None, created=False, update_fields=None, **kwargs):
+    if isinstance(instance, User):
+        if not created:
+            enqueue(instance, changed_fields=())
+    elif isinstance(instance, Statistic):
+        enqueue(instance.user, changed_fields=None if created else update_fields)
+    else:
+        enqueue(instance.user, changed_fields=())
@@ -0,0 +1,185 @@
+import logging
+import threading
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .caching import bump_version, get_version
+from .conditions import STATISTICS, Condition, ConditionError
+from .models import Achievement
+
+logger = logging.getLogger(__name__)
+
+RULES = 'achievements:rules'
+
+
+class CompiledRule(object):
+    def __init__(self, achievement):
+        self.achievement = achievement
+        self.achievement_id = achievement.pk
+        self.condition = Condition(achievement.condition)
+        self.statistic_fields = self.condition.statistic_fields
+        self.dependencies = self.condition.dependencies
+        self.always_check = not self.statistic_fields or bool(self.dependencies - set(STATISTICS))
+
+    def matches(self, user):
+        try:
+            return bool(self.condition.evaluate(user))
+        except Exception:
+            logger.exception('Condition of achievement %s failed for user %s', self.achievement_id, user.pk)
+            return False
+
+
+class AchievementEngine(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rules = None
+        self._always_checked = None
+        self._by_field = None
+        self._version = None
+
+    def invalidate(self):
+        bump_version(RULES)
+        with self._lock:
+            self._rules = None
+
+    def _load(self):
+        version = get_version(RULES)
+        with self._lock:
+            if self._rules is not None and self._version == version:
+                return self._rules, self._always_checked, self._by_field
+
+            rules, always_checked, by_field = [], [], {}
+            for achievement in Achievement.objects.all().order_by('pk'):
+                try:
+                    rule = CompiledRule(achievement)
+                except ConditionError:
+                    logger.exception('Condition of achievement %s is invalid', achievement.pk)
+                    continue
+                rules.append(rule)
+                if rule.always_check:
+                    always_checked.append(rule)
+                for field in rule.dependencies:
+                    by_field.setdefault(field, []).append(rule)
+
+            self._rules, self._always_checked, self._by_field = rules, always_checked, by_field
+            self._version = version
+            return rules, always_checked, by_field
+
+    def compile(self, achievement):
+        rules, _, _ = self._load()
+        for rule in rules:
+            if rule.achievement_id == achievement.pk and rule.achievement.condition == achievement.condition:
+                return rule
+        return CompiledRule(achievement)
+
+    def rules_for(self, changed_fields=None):
+        rules, always_checked, by_field = self._load()
+        if changed_fields is None:
+            return rules
+
+        selected = {rule.achievement_id: rule for rule in always_checked}
+        for field in changed_fields:
+            for rule in by_field.get(field, ()):
+                selected[rule.achievement_id] = rule
+        return [rule for rule in rules if rule.achievement_id in selected]
+
+    def grant(self, user, changed_fields=None):
+        return self.grant_many([user], changed_fields).get(user.pk, [])
+
+    def grant_many(self, users, changed_fields=None):
+        rules = self.rules_for(changed_fields)
+        if not rules or not users:
+            return {}
+
+        through = Achievement.users.through
+        held = set(through.objects.filter(user_id__in=[user.pk for user in users])
+                   .values_list('user_id', 'achievement_id'))
+
+        awarded = {}
+        for user in users:
+            for rule in rules:
+                if (user.pk, rule.achievement_id) not in held and rule.matches(user):
+                    awarded.setdefault(user.pk, []).append(rule.achievement)
+
+        if awarded:
+            awarded = insert_awards(through, awarded)
+        if awarded:
+            from .leaderboard import add_scores
+            from .response_cache import invalidate_awards
+            from .sync import record_awards
+
+            add_scores({user_id: sum(achievement.score for achievement in achievements)
+                        for user_id, achievements in awarded.items()})
+            invalidate_awards()
+            record_awards({user_id: [achievement.pk for achievement in achievements]
+                           for user_id, achievements in awarded.items()})
+        return awarded
+
+
+def insert_awards(through, awarded, attempts=2):
+    while True:
+        try:
+            with transaction.atomic():
+                through.objects.bulk_create([through(user_id=user_id, achievement_id=achievement.pk)
+                                             for user_id, achievements in awarded.items()
+                                             for achievement in achievements])
+            return awarded
+        except IntegrityError:
+            attempts -= 1
+            if not attempts:
+                raise
+        # A concurrent grant won the race for some of these rows; only award the rest.
+        held = set(through.objects.filter(user_id__in=list(awarded)).values_list('user_id', 'achievement_id'))
+        remaining = {}
+        for user_id, achievements in awarded.items():
+            missing = [achievement for achievement in achievements if (user_id, achievement.pk) not in held]
+            if missing:
+                remaining[user_id] = missing
+        if not remaining:
+            return remaining
+        awarded = remaining
+
+
+engine = AchievementEngine()
+
+
+def newly_qualified(achievement):
+    holders = Achievement.users.through.objects.filter(achievement_id=achievement.pk).values('user_id')
+    return Condition(achievement.condition).filter(User.objects.exclude(pk__in=holders))
+
+
+def backfill(achievement, batch_size=500):
+    # The user set is fixed up front and insert_awards reports the rows it actually wrote, so users granted
+    # concurrently by grant_many are neither inserted twice nor counted twice in the scores.
+    from .leaderboard import shift_scores
+    from .response_cache import invalidate_awards
+    from .sync import record_awards
+
+    through = Achievement.users.through
+    candidates = list(newly_qualified(achievement).order_by('pk').values_list('pk', flat=True))
+    user_ids = []
+    for start in range(0, len(candidates), batch_size):
+        with transaction.atomic():
+            awarded = insert_awards(through, {user_id: [achievement]
+                                              for user_id in candidates[start:start + batch_size]})
+            if awarded:
+                shift_scores(list(awarded), achievement.score)
+                record_awards({user_id: [achievement.pk] for user_id in awarded})
+        user_ids.extend(awarded)
+    if user_ids:
+        invalidate_awards()
+    return user_ids
+
+
+def grant_achievements(user, changed_fields=None):
+    return engine.grant(user, changed_fields)
+
+
+@receiver(post_save, sender=Achievement)
+@receiver(post_delete, sender=Achievement)
+def invalidate_compiled_achievements(sender, **kwargs):
+    engine.invalidate()
+
@@ -1,8 +1,29 @@
+from django import forms
 from django.contrib import admin
+from .conditions import ConditionError, parse
 from .models import Language, Achievement, UserFollowing, Statistic, TabooCard
 
+
+class AchievementAdminForm(forms.ModelForm):
+    class Meta:
+        model = Achievement
+        fields = '__all__'
+
+    def clean_condition(self):
+        condition = self.cleaned_data['condition']
+        try:
+            parse(condition)
+        except ConditionError as error:
+            raise forms.ValidationError(str(error))
+        return condition
+
+
+class AchievementAdmin(admin.ModelAdmin):
+    form = AchievementAdminForm
+
+
 admin.site.register(Language)
-admin.site.register(Achievement)
+admin.site.register(Achievement, AchievementAdmin)
 admin.site.register(UserFollowing)
 admin.site.register(Statistic)
 admin.site.register(TabooCard)
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from . import (  # noqa: F401
+            achievements, achievement_queue, authentication, checks, db_connections, follows, languages, leaderboard,
+            response_cache, sampling, search, sync)
@@ -0,0 +1,142 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .caching import get_cache, is_shared
+
+
+def cache_options():
+    return dict({'MAX_SIZE': 10000, 'TTL': 300, 'SHARED_CACHE': None},
+                **getattr(settings, 'TOKEN_AUTH_CACHE', {}))
+
+
+def shared_cache(alias):
+    if alias:
+        return caches[alias]
+    cache = get_cache()
+    return cache if is_shared(cache) else None
+
+
+class TokenCache(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.configure()
+
+    def configure(self):
+        options = cache_options()
+        self.max_size = options['MAX_SIZE']
+        self.ttl = options['TTL']
+        self.shared = shared_cache(options['SHARED_CACHE'])
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def shared_key(self, key):
+        return 'auth-token:%s' % key
+
+    def get(self, key):
+        if self.shared is not None:
+            value = self.shared.get(self.shared_key(key))
+        else:
+            value = self._get_local(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def _get_local(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, token):
+        value = (token.user_id, token.created)
+        if self.shared is not None:
+            self.shared.set(self.shared_key(token.key), value, self.ttl)
+            return
+        with self._lock:
+            self._entries[token.key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(token.key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate_key(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.shared is not None:
+            self.shared.delete(self.shared_key(key))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+            }
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        value = token_cache.get(key)
+        if value is None:
+            try:
+                token = Token.objects.select_related('user').get(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            token_cache.set(token)
+        else:
+            user_id, created = value
+            try:
+                user = User.objects.get(pk=user_id)
+            except User.DoesNotExist:
+                token_cache.invalidate_key(key)
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            token = Token(key=key, user=user, created=created)
+            token._state.adding = False
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (token.user, token)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance=None, **kwargs):
+    token_cache.invalidate_key(instance.key)
+
+
+@receiver(setting_changed)
+def reconfigure_token_cache(setting, **kwargs):
+    if setting in ('TOKEN_AUTH_CACHE', 'CACHES', 'API_CACHE'):
+        token_cache.configure()
@@ -0,0 +1,7 @@
+from django.db.backends.postgresql import base
+
+from ...db_connections import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    pass
@@ -0,0 +1,114 @@
+import json
+from contextlib import ExitStack
+from io import BytesIO
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import transaction
+from django.urls import Resolver404, resolve
+
+from . import achievement_queue
+from .pagination import StreamingListMixin
+
+METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+DROPPED_HEADERS = ('CONTENT_TYPE', 'CONTENT_LENGTH', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE')
+STREAM_QUERY_PARAM = StreamingListMixin.stream_query_param
+STREAMING_UNSUPPORTED = {'detail': 'Streamed responses cannot be batched; request the list directly.'}
+
+
+def batch_options():
+    return dict({'MAX_OPERATIONS': 20, 'PATH_PREFIX': '/api/'},
+                **getattr(settings, 'BATCH', {}))
+
+
+class RolledBack(Exception):
+    pass
+
+
+def validate(data):
+    options = batch_options()
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return {'operations': ['Expected a non-empty list of operations.']}
+    if len(operations) > options['MAX_OPERATIONS']:
+        return {'operations': ['Ensure this list has no more than %d operations.' % options['MAX_OPERATIONS']]}
+
+    errors = {}
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            errors[index] = ['Expected an object.']
+            continue
+        method = str(operation.get('method', 'GET')).upper()
+        path = operation.get('path')
+        if method not in METHODS:
+            errors[index] = ['Unsupported method: %s.' % method]
+        elif not isinstance(path, str) or not path.startswith(options['PATH_PREFIX']):
+            errors[index] = ['The path must start with %s.' % options['PATH_PREFIX']]
+    return {'operations': errors} if errors else None
+
+
+def build_request(request, method, path, body):
+    url = urlsplit(path)
+    content = b'' if body is None else json.dumps(body).encode('utf-8')
+    environ = {key: value for key, value in request.META.items() if key not in DROPPED_HEADERS}
+    environ.update({
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'wsgi.input': BytesIO(content),
+    })
+    if body is not None:
+        environ.update({'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(content))})
+
+    sub_request = WSGIRequest(environ)
+    sub_request.user = request.user
+    sub_request._force_auth_user = request.user
+    sub_request._force_auth_token = request.auth
+    return sub_request
+
+
+def response_body(response):
+    if hasattr(response, 'data'):
+        return response.data
+    content = response.content
+    if response.get('Content-Type', '').startswith('application/json'):
+        return json.loads(content.decode('utf-8')) if content else None
+    return content.decode(response.charset)
+
+
+def dispatch(request, operation):
+    method = str(operation.get('method', 'GET')).upper()
+    path = operation['path']
+    try:
+        match = resolve(urlsplit(path).path)
+    except Resolver404:
+        return {'status': 404, 'body': None}
+    if match.url_name == 'batch':
+        return {'status': 400, 'body': {'detail': 'Batches cannot be nested.'}}
+    if STREAM_QUERY_PARAM in parse_qs(urlsplit(path).query):
+        return {'status': 400, 'body': STREAMING_UNSUPPORTED}
+
+    response = match.func(build_request(request, method, path, operation.get('body')), *match.args, **match.kwargs)
+    if response.streaming:
+        response.close()
+        return {'status': 400, 'body': STREAMING_UNSUPPORTED}
+    return {'status': response.status_code, 'body': response_body(response)}
+
+
+def run(request, operations, atomic=False):
+    results = []
+    try:
+        with ExitStack() as stack:
+            stack.enter_context(achievement_queue.deferred())
+            if atomic:
+                stack.enter_context(transaction.atomic())
+            for operation in operations:
+                result = dispatch(request, operation)
+                results.append(result)
+                if atomic and result['status'] >= 400:
+                    raise RolledBack
+    except RolledBack:
+        return {'committed': False, 'results': results}
+    return {'committed': True, 'results': results}
@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+
+# A file-based cache lives on one machine's disk, so it is not shared between dynos or hosts either.
+PROCESS_LOCAL_BACKENDS = (LocMemCache, DummyCache, FileBasedCache)
+
+
+def get_cache():
+    return caches[getattr(settings, 'API_CACHE', 'default')]
+
+
+def is_shared(cache=None):
+    return not isinstance(cache if cache is not None else get_cache(), PROCESS_LOCAL_BACKENDS)
+
+
+def version_key(namespace):
+    return 'version:%s' % namespace
+
+
+def initial_version():
+    return int(time.time() * 1000)
+
+
+def get_version(namespace):
+    cache = get_cache()
+    key = version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        version = initial_version()
+        cache.add(key, version, None)
+        version = cache.get(key, version)
+    return version
+
+
+def bump_version(namespace):
+    cache = get_cache()
+    key = version_key(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = initial_version()
+        cache.set(key, version, None)
+        return version
+
+
+def versioned_key(key, *namespaces):
+    return '%s:%s' % (key, ':'.join('%s' % get_version(namespace) for namespace in namespaces))
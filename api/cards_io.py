@@ -0,0 +1,214 @@
+import csv
+import io
+import json
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from . import response_cache, snapshot
+from .models import BlackListWord, ChangeLogEntry, Language, TabooCard
+from .sampling import sampler
+from .search import words_for
+from .sync import record
+from .text import normalize
+
+EXPORT_FIELDS = ('id', 'key_word', 'black_list', 'language', 'times_shown', 'answered_correctly')
+TEXT_TYPES = (str, int, float)
+
+
+def import_batch_size():
+    return getattr(settings, 'CARD_IMPORT_BATCH_SIZE', 500)
+
+
+def read_csv(stream):
+    reader = csv.DictReader(stream)
+    for line, row in enumerate(reader, start=2):
+        yield line, row
+
+
+def read_ndjson(stream):
+    for line, text in enumerate(stream, start=1):
+        text = text.strip()
+        if not text:
+            continue
+        try:
+            yield line, json.loads(text)
+        except ValueError as error:
+            yield line, error
+
+
+def read_rows(stream, input_format):
+    if input_format == 'csv':
+        return read_csv(stream)
+    elif input_format == 'ndjson':
+        return read_ndjson(stream)
+    raise ValueError('Unsupported format: %s' % input_format)
+
+
+class LanguageResolver(object):
+    def __init__(self):
+        self.by_code = {}
+        self.ids = set()
+        for pk, language_code in Language.objects.values_list('pk', 'language_code'):
+            self.ids.add(pk)
+            if language_code:
+                self.by_code[language_code] = pk
+
+    def resolve(self, value):
+        if not isinstance(value, TEXT_TYPES) or isinstance(value, bool):
+            return None
+        if value in self.by_code:
+            return self.by_code[value]
+        try:
+            pk = int(value)
+        except (TypeError, ValueError):
+            return None
+        return pk if pk in self.ids else None
+
+
+def is_text(value):
+    return isinstance(value, TEXT_TYPES) and not isinstance(value, bool)
+
+
+def build_card(row, owner, languages):
+    if not isinstance(row, dict):
+        return None, {'row': ['Expected an object, got: %s' % row]}
+
+    errors = {}
+    key_word = row.get('key_word') or ''
+    if not is_text(key_word):
+        errors['key_word'] = ['Not a valid string.']
+    else:
+        key_word = str(key_word).strip()
+        if not key_word:
+            errors['key_word'] = ['This field is required.']
+        elif len(key_word) > 128:
+            errors['key_word'] = ['Ensure this field has no more than 128 characters.']
+
+    black_list = row.get('black_list') or ''
+    if isinstance(black_list, (list, tuple)) and all(is_text(word) for word in black_list):
+        black_list = ';'.join(str(word).strip() for word in black_list)
+    if not is_text(black_list):
+        errors['black_list'] = ['Expected a string or a list of strings.']
+    else:
+        black_list = str(black_list)
+        if len(black_list) > 2048:
+            errors['black_list'] = ['Ensure this field has no more than 2048 characters.']
+
+    language_id = languages.resolve(row.get('language', row.get('language_code')))
+    if language_id is None:
+        errors['language'] = ['Unknown language.']
+
+    if errors:
+        return None, errors
+    return TabooCard(owner=owner, key_word=key_word, black_list=black_list, language_id=language_id,
+                     normalized_key_word=normalize(key_word)[:128]), None
+
+
+def without_duplicates(cards):
+    existing = set(TabooCard.objects.filter(language_id__in={card.language_id for card in cards},
+                                            normalized_key_word__in={card.normalized_key_word for card in cards})
+                   .values_list('language_id', 'normalized_key_word'))
+    unique = []
+    for card in cards:
+        key = (card.language_id, card.normalized_key_word)
+        if key not in existing:
+            existing.add(key)
+            unique.append(card)
+    return unique
+
+
+def assign_created_pks(chunk, owner, last_pk):
+    # Backends that do not return ids from bulk_create; match the new rows on their keys so that rows inserted
+    # concurrently by another import for the same owner are never attributed to this chunk.
+    created = (TabooCard.objects
+               .filter(owner=owner, pk__gt=last_pk, language_id__in={card.language_id for card in chunk},
+                       key_word__in={card.key_word for card in chunk})
+               .order_by('pk').values_list('language_id', 'key_word', 'pk'))
+    pks = {}
+    for language_id, key_word, pk in created:
+        pks.setdefault((language_id, key_word), []).append(pk)
+    pks = {key: iter(values) for key, values in pks.items()}
+    for card in chunk:
+        card.pk = next(pks[(card.language_id, card.key_word)])
+
+
+def import_cards(rows, owner, batch_size=None, skip_duplicates=False):
+    batch_size = batch_size or import_batch_size()
+    languages = LanguageResolver()
+    created, skipped, errors, chunk = 0, 0, [], []
+
+    def flush():
+        nonlocal chunk, skipped
+        if skip_duplicates:
+            unique = without_duplicates(chunk)
+            skipped += len(chunk) - len(unique)
+            chunk = unique
+            if not chunk:
+                return 0
+        fields = [field for field in TabooCard._meta.concrete_fields if not field.primary_key]
+        insert_size = min(batch_size, connections[TabooCard.objects.db].ops.bulk_batch_size(fields, chunk))
+        with transaction.atomic():
+            last_pk = TabooCard.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+            TabooCard.objects.bulk_create(chunk, batch_size=max(insert_size, 1))
+            if chunk[0].pk is None:
+                assign_created_pks(chunk, owner, last_pk)
+            BlackListWord.objects.bulk_create(words_for(chunk), batch_size=max(insert_size, 1))
+            record(ChangeLogEntry.CARD, [card.pk for card in chunk], owner.pk)
+        for language_id in {card.language_id for card in chunk}:
+            sampler.invalidate(language_id)
+        response_cache.invalidate_cards()
+        snapshot.rebuild_on_commit()
+        return len(chunk)
+
+    for line, row in rows:
+        if isinstance(row, Exception):
+            card, row_errors = None, {'row': [str(row)]}
+        else:
+            card, row_errors = build_card(row, owner, languages)
+        if row_errors:
+            errors.append({'row': line, 'errors': row_errors})
+            continue
+        chunk.append(card)
+        if len(chunk) >= batch_size:
+            created += flush()
+            chunk = []
+    if chunk:
+        created += flush()
+
+    result = {'created': created, 'errors': errors}
+    if skip_duplicates:
+        result['skipped'] = skipped
+    return result
+
+
+def export_rows(queryset, chunk_size=2000):
+    for card in queryset.select_related('language').order_by('pk').iterator(chunk_size=chunk_size):
+        yield {
+            'id': card.pk,
+            'key_word': card.key_word,
+            'black_list': card.black_list,
+            'language': card.language.language_code or card.language_id,
+            'times_shown': card.times_shown,
+            'answered_correctly': card.answered_correctly,
+        }
+
+
+def export_cards(queryset, output_format, chunk_size=2000):
+    if output_format == 'ndjson':
+        for row in export_rows(queryset, chunk_size):
+            yield json.dumps(row) + '\n'
+    elif output_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        for row in export_rows(queryset, chunk_size):
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    else:
+        raise ValueError('Unsupported format: %s' % output_format)
@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.checks import Error, Warning, register
+from django.db import DatabaseError
+
+from .caching import get_cache, is_shared
+from .conditions import ConditionError, parse
+from .models import Achievement
+from .routers import replica_alias
+
+
+@register('caches', deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    if is_shared(get_cache()):
+        return []
+    return [Warning(
+        'The API cache (%s) is local to each worker process.' % getattr(settings, 'API_CACHE', 'default'),
+        hint='This is fine for a single worker. With several workers a change handled by one of them does not '
+             'invalidate the cached responses of the others until they expire. Set CACHE_BACKEND and '
+             'CACHE_LOCATION to a memcached server, or to django.core.cache.backends.db.DatabaseCache after '
+             'running "python manage.py createcachetable".',
+        id='api.W001',
+    )]
+
+
+@register('caches', deploy=True)
+def check_replica_pinning(app_configs, **kwargs):
+    if replica_alias() is None or is_shared(get_cache()):
+        return []
+    return [Error(
+        'Replica reads are enabled but the API cache is process-local.',
+        hint='Callers are pinned to the primary after a write with a signed cookie and, for clients that do not '
+             'keep cookies, through the API cache. Configure a memcached or database cache (see api.W001) or set '
+             'DB_REPLICA_READS=0.',
+        id='api.E002',
+    )]
+
+
+@register('achievements', deploy=True)
+def check_achievement_conditions(app_configs, **kwargs):
+    try:
+        achievements = list(Achievement.objects.order_by('pk').values_list('pk', 'name', 'condition'))
+    except DatabaseError:
+        return []
+    errors = []
+    for pk, name, condition in achievements:
+        try:
+            parse(condition)
+        except ConditionError as error:
+            errors.append(Error(
+                'Achievement %s (%s) has a condition that cannot be parsed: %s' % (pk, name, error),
+                hint='The achievement engine skips it, so nobody can earn it. Rewrite the condition in the admin.',
+                id='api.E003',
+            ))
+    return errors
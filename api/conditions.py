@@ -0,0 +1,319 @@
+import ast
+import itertools
+import operator
+
+from django.db.models import Count, Exists, ExpressionWrapper, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Achievement, Language, Statistic, UserFollowing
+
+STATISTICS = tuple(field.name for field in Statistic._meta.concrete_fields
+                   if isinstance(field, IntegerField) and not field.primary_key)
+COUNTS = {
+    'following': (lambda user: user.following, UserFollowing, 'user'),
+    'followers': (lambda user: user.followed_by, UserFollowing, 'following'),
+    'languages': (lambda user: user.selected_languages, Language.users.through, 'user'),
+    'achievements': (lambda user: user.achievements, Achievement.users.through, 'user'),
+}
+LEGACY_COUNTS = {
+    'following': 'following',
+    'followed_by': 'followers',
+    'selected_languages': 'languages',
+    'achievements': 'achievements',
+}
+COMPARISONS = {
+    ast.Eq: (operator.eq, 'exact'),
+    ast.NotEq: (operator.ne, None),
+    ast.Lt: (operator.lt, 'lt'),
+    ast.LtE: (operator.le, 'lte'),
+    ast.Gt: (operator.gt, 'gt'),
+    ast.GtE: (operator.ge, 'gte'),
+}
+ARITHMETIC = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+}
+MAX_NODES = 64
+
+
+class ConditionError(ValueError):
+    pass
+
+
+class Constant(object):
+    def __init__(self, value):
+        self.value = value
+        self.boolean = isinstance(value, bool)
+
+    def dependencies(self):
+        return set()
+
+    def python(self):
+        return lambda user: self.value
+
+    def sql(self, annotations):
+        if self.boolean:
+            return Q() if self.value else Q(pk__in=[])
+        return Value(self.value, output_field=IntegerField())
+
+
+class StatisticValue(object):
+    boolean = False
+
+    def __init__(self, field):
+        self.field = field
+
+    def dependencies(self):
+        return {self.field}
+
+    def python(self):
+        field = self.field
+        return lambda user: getattr(user.statistics, field)
+
+    def sql(self, annotations):
+        return F('statistics__%s' % self.field)
+
+
+class CountValue(object):
+    boolean = False
+
+    def __init__(self, name):
+        self.name = name
+
+    def dependencies(self):
+        return {self.name}
+
+    def python(self):
+        manager = COUNTS[self.name][0]
+        return lambda user: manager(user).count()
+
+    def sql(self, annotations):
+        _, model, key = COUNTS[self.name]
+        counts = (model.objects.filter(**{key: OuterRef('pk')}).order_by().values(key)
+                  .annotate(total=Count('pk')).values('total'))
+        return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+class HeldAchievement(object):
+    boolean = True
+
+    def __init__(self, achievement_id):
+        self.achievement_id = achievement_id
+
+    def dependencies(self):
+        return {'achievements'}
+
+    def python(self):
+        achievement_id = self.achievement_id
+        return lambda user: user.achievements.filter(pk=achievement_id).exists()
+
+    def sql(self, annotations):
+        name = annotate(annotations, Exists(Achievement.users.through.objects.filter(
+            user_id=OuterRef('pk'), achievement_id=self.achievement_id)))
+        return Q(**{name: True})
+
+
+class Arithmetic(object):
+    boolean = False
+
+    def __init__(self, op, left, right):
+        self.op, self.left, self.right = op, left, right
+
+    def dependencies(self):
+        return self.left.dependencies() | self.right.dependencies()
+
+    def python(self):
+        op, left, right = ARITHMETIC[self.op], self.left.python(), self.right.python()
+        return lambda user: op(left(user), right(user))
+
+    def sql(self, annotations):
+        return ARITHMETIC[self.op](self.left.sql(annotations), self.right.sql(annotations))
+
+
+class Comparison(object):
+    boolean = True
+
+    def __init__(self, op, left, right):
+        self.op, self.left, self.right = op, left, right
+
+    def dependencies(self):
+        return self.left.dependencies() | self.right.dependencies()
+
+    def python(self):
+        op, left, right = COMPARISONS[self.op][0], self.left.python(), self.right.python()
+        return lambda user: op(left(user), right(user))
+
+    def sql(self, annotations):
+        difference = ExpressionWrapper(self.left.sql(annotations) - self.right.sql(annotations),
+                                       output_field=IntegerField())
+        name = annotate(annotations, difference)
+        lookup = COMPARISONS[self.op][1]
+        if lookup is None:
+            return ~Q(**{name: 0})
+        return Q(**{'%s__%s' % (name, lookup): 0})
+
+
+class BooleanOperation(object):
+    boolean = True
+
+    def __init__(self, op, operands):
+        self.op, self.operands = op, operands
+
+    def dependencies(self):
+        return set().union(*[operand.dependencies() for operand in self.operands])
+
+    def python(self):
+        combine = all if isinstance(self.op, ast.And) else any
+        operands = [operand.python() for operand in self.operands]
+        return lambda user: combine(operand(user) for operand in operands)
+
+    def sql(self, annotations):
+        combine = operator.and_ if isinstance(self.op, ast.And) else operator.or_
+        conditions = [operand.sql(annotations) for operand in self.operands]
+        result = conditions[0]
+        for condition in conditions[1:]:
+            result = combine(result, condition)
+        return result
+
+
+class Negation(object):
+    boolean = True
+
+    def __init__(self, operand):
+        self.operand = operand
+
+    def dependencies(self):
+        return self.operand.dependencies()
+
+    def python(self):
+        operand = self.operand.python()
+        return lambda user: not operand(user)
+
+    def sql(self, annotations):
+        return ~self.operand.sql(annotations)
+
+
+def annotate(annotations, expression):
+    name = 'condition_%d' % len(annotations)
+    annotations[name] = expression
+    return name
+
+
+def literal(node):
+    if type(node).__name__ in ('Constant', 'Num', 'NameConstant'):
+        value = getattr(node, 'value', getattr(node, 'n', None))
+        if isinstance(value, (bool, int)):
+            return Constant(value)
+    raise ConditionError('Unsupported literal: %s.' % ast.dump(node))
+
+
+def attribute_path(node):
+    path = []
+    while isinstance(node, ast.Attribute):
+        path.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    path.append(node.id)
+    return list(reversed(path))
+
+
+def statistic(field):
+    if field not in STATISTICS:
+        raise ConditionError('Unknown statistic: %s. Expected one of %s.' % (field, ', '.join(STATISTICS)))
+    return StatisticValue(field)
+
+
+def value(node):
+    path = attribute_path(node)
+    if path is None:
+        raise ConditionError('Unsupported expression.')
+    if path[0] == 'user':
+        path = path[1:]
+    if len(path) == 2 and path[0] == 'statistics':
+        return statistic(path[1])
+    if len(path) == 1 and path[0] in COUNTS:
+        return CountValue(path[0])
+    raise ConditionError('Unknown name: %s.' % '.'.join(path))
+
+
+def call(node):
+    if node.keywords:
+        raise ConditionError('Keyword arguments are not supported.')
+    if isinstance(node.func, ast.Name) and node.func.id == 'has_achievement':
+        if len(node.args) != 1:
+            raise ConditionError('has_achievement() takes exactly one achievement id.')
+        achievement_id = literal(node.args[0])
+        if achievement_id.boolean:
+            raise ConditionError('has_achievement() takes an achievement id.')
+        return HeldAchievement(achievement_id.value)
+
+    path = attribute_path(node.func)
+    if path and path[0] == 'user' and len(path) == 3 and path[1] in LEGACY_COUNTS and path[2] == 'count':
+        if node.args:
+            raise ConditionError('count() takes no arguments.')
+        return CountValue(LEGACY_COUNTS[path[1]])
+    raise ConditionError('Unsupported call.')
+
+
+def convert(node):
+    if isinstance(node, ast.BoolOp):
+        return BooleanOperation(node.op, [expect(convert(value), True) for value in node.values])
+    if isinstance(node, ast.UnaryOp):
+        operand = convert(node.operand)
+        if isinstance(node.op, ast.Not):
+            return Negation(expect(operand, True))
+        if isinstance(node.op, ast.USub) and isinstance(operand, Constant) and not operand.boolean:
+            return Constant(-operand.value)
+        raise ConditionError('Unsupported unary operator.')
+    if isinstance(node, ast.BinOp):
+        if type(node.op) not in ARITHMETIC:
+            raise ConditionError('Only +, - and * are supported.')
+        return Arithmetic(type(node.op), expect(convert(node.left), False), expect(convert(node.right), False))
+    if isinstance(node, ast.Compare):
+        operands = [expect(convert(operand), False) for operand in [node.left] + node.comparators]
+        comparisons = []
+        for op, left, right in zip(node.ops, operands, operands[1:]):
+            if type(op) not in COMPARISONS:
+                raise ConditionError('Unsupported comparison.')
+            comparisons.append(Comparison(type(op), left, right))
+        return comparisons[0] if len(comparisons) == 1 else BooleanOperation(ast.And(), comparisons)
+    if isinstance(node, ast.Call):
+        return call(node)
+    if isinstance(node, (ast.Attribute, ast.Name)):
+        return value(node)
+    return literal(node)
+
+
+def expect(node, boolean):
+    if node.boolean != boolean:
+        raise ConditionError('Expected a %s.' % ('condition' if boolean else 'number'))
+    return node
+
+
+def parse(text):
+    try:
+        tree = ast.parse(str(text).strip(), mode='eval')
+    except SyntaxError as error:
+        raise ConditionError('Invalid syntax: %s.' % error.msg)
+    if sum(1 for _ in itertools.islice(ast.walk(tree), MAX_NODES + 1)) > MAX_NODES:
+        raise ConditionError('Conditions are limited to %d nodes.' % MAX_NODES)
+    return expect(convert(tree.body), True)
+
+
+class Condition(object):
+    def __init__(self, text):
+        self.text = text
+        self.tree = parse(text)
+        self.dependencies = self.tree.dependencies()
+        self.statistic_fields = {name for name in self.dependencies if name in STATISTICS}
+        self.evaluate = self.tree.python()
+
+    def as_q(self):
+        annotations = {}
+        return annotations, self.tree.sql(annotations)
+
+    def filter(self, users):
+        annotations, condition = self.as_q()
+        return users.annotate(**annotations).filter(condition)
@@ -0,0 +1,331 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.signals import setting_changed
+from django.db import connections, transaction
+from django.db.models import Case, F, Sum, When
+from django.dispatch import receiver
+from django.http import Http404
+from django.utils.module_loading import import_string
+
+from . import achievement_queue, scheduler
+from .models import CounterDelta, Statistic, TabooCard, difficulty_expression
+
+logger = logging.getLogger(__name__)
+
+STATISTIC_FIELDS = ('correctly_swiped_taboo_cards', 'swiped_taboo_cards',
+                    'correctly_ans_flashcards', 'ans_flashcards', 'translated_words')
+
+BACKEND_ALIASES = {
+    'direct': 'api.counters.DirectBackend',
+    'memory': 'api.counters.MemoryBackend',
+    'database': 'api.counters.DatabaseBackend',
+}
+
+
+def statistic_deltas(data):
+    correctly_swiped_cards = data.get('correctly_swiped_cards', [])
+    incorrectly_swiped_cards = data.get('incorrectly_swiped_cards', [])
+    correctly_ans_flashcards = data.get('correctly_ans_flashcards', [])
+    incorrectly_ans_flashcards = data.get('incorrectly_ans_flashcards', [])
+
+    return {
+        'correctly_swiped_taboo_cards': len(correctly_swiped_cards),
+        'swiped_taboo_cards': len(correctly_swiped_cards) + len(incorrectly_swiped_cards),
+        'correctly_ans_flashcards': len(correctly_ans_flashcards),
+        'ans_flashcards': len(correctly_ans_flashcards) + len(incorrectly_ans_flashcards),
+        'translated_words': data.get('translated_words', 0),
+    }
+
+
+def card_deltas(data):
+    correctly_swiped_cards = set(data.get('correctly_swiped_cards', []))
+    swiped_cards = correctly_swiped_cards | set(data.get('incorrectly_swiped_cards', []))
+    return {pk: (1, 1 if pk in correctly_swiped_cards else 0) for pk in swiped_cards}
+
+
+def increment_case(field, groups, key='pk'):
+    whens = [When(**{key + '__in': ids, 'then': F(field) + delta}) for delta, ids in groups.items()]
+    return Case(*whens, default=F(field)) if whens else F(field)
+
+
+def apply_statistic_deltas(user_id, deltas):
+    changes = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if not changes:
+        return Statistic.objects.filter(user_id=user_id).exists()
+    return Statistic.objects.filter(user_id=user_id).update(**changes) > 0
+
+
+def apply_many_statistic_deltas(deltas_by_user):
+    groups = {}
+    for user_id, deltas in deltas_by_user.items():
+        for field, delta in deltas.items():
+            if delta:
+                groups.setdefault(field, {}).setdefault(delta, []).append(user_id)
+    if groups:
+        Statistic.objects.filter(user_id__in=list(deltas_by_user)).update(
+            **{field: increment_case(field, field_groups, key='user_id') for field, field_groups in groups.items()})
+
+
+def apply_card_deltas(deltas):
+    if not deltas:
+        return
+    shown_groups, answered_groups = {}, {}
+    for pk, (shown, answered) in deltas.items():
+        shown_groups.setdefault(shown, []).append(pk)
+        if answered:
+            answered_groups.setdefault(answered, []).append(pk)
+    cards = TabooCard.objects.filter(pk__in=list(deltas))
+    cards.update(times_shown=increment_case('times_shown', shown_groups),
+                 answered_correctly=increment_case('answered_correctly', answered_groups))
+    cards.update(difficulty_bucket=difficulty_expression())
+
+
+def fold(deltas_by_user, deltas_by_card):
+    with transaction.atomic():
+        apply_many_statistic_deltas(deltas_by_user)
+        apply_card_deltas(deltas_by_card)
+        changed_fields = {field for deltas in deltas_by_user.values() for field, delta in deltas.items() if delta}
+        if changed_fields:
+            users = list(User.objects.filter(pk__in=list(deltas_by_user)).select_related('statistics'))
+            achievement_queue.enqueue_many(users, changed_fields=changed_fields)
+    return len(deltas_by_user) + len(deltas_by_card)
+
+
+class DirectBackend(object):
+    buffered = False
+
+    def __init__(self, options):
+        self.options = options
+
+    def add(self, user_id, statistic_deltas, card_deltas):
+        if not apply_statistic_deltas(user_id, statistic_deltas):
+            raise Http404
+        apply_card_deltas(card_deltas)
+
+    def pending_statistics(self, user_id):
+        return {}
+
+    def pending_cards(self, pks):
+        return {}
+
+    def flush(self):
+        return 0
+
+
+class MemoryBackend(object):
+    buffered = True
+
+    def __init__(self, options):
+        self.flush_interval = options.get('FLUSH_INTERVAL', 5.0)
+        self.max_buffered_deltas = options.get('MAX_BUFFERED_DELTAS', 10000)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._statistics = {}
+        self._cards = {}
+        self._buffered = 0
+        self._flushing = ({}, {})
+        self._flusher = None
+
+    def add(self, user_id, statistic_deltas, card_deltas):
+        transaction.on_commit(lambda: self._add(user_id, statistic_deltas, card_deltas))
+
+    def _add(self, user_id, statistic_deltas, card_deltas):
+        with self._lock:
+            pending = self._statistics.setdefault(user_id, {})
+            for field, delta in statistic_deltas.items():
+                if delta:
+                    pending[field] = pending.get(field, 0) + delta
+            for pk, (shown, answered) in card_deltas.items():
+                current = self._cards.get(pk, (0, 0))
+                self._cards[pk] = (current[0] + shown, current[1] + answered)
+            self._buffered += 1 + len(card_deltas)
+            overflowing = self._buffered >= self.max_buffered_deltas
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run_flusher, daemon=True)
+                self._flusher.start()
+        if overflowing:
+            self.flush()
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing buffered counters failed')
+            finally:
+                connections.close_all()
+
+    def pending_statistics(self, user_id):
+        with self._lock:
+            pending = {}
+            for statistics in (self._flushing[0], self._statistics):
+                for field, delta in statistics.get(user_id, {}).items():
+                    pending[field] = pending.get(field, 0) + delta
+            return pending
+
+    def pending_cards(self, pks):
+        with self._lock:
+            pending = {}
+            for cards in (self._flushing[1], self._cards):
+                for pk in pks:
+                    if pk in cards:
+                        current = pending.get(pk, (0, 0))
+                        pending[pk] = (current[0] + cards[pk][0], current[1] + cards[pk][1])
+            return pending
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                statistics, cards = self._statistics, self._cards
+                self._statistics, self._cards, self._buffered = {}, {}, 0
+                self._flushing = (statistics, cards)
+            if not statistics and not cards:
+                return 0
+            try:
+                flushed = fold(statistics, cards)
+                with self._lock:
+                    self._flushing = ({}, {})
+                return flushed
+            except Exception:
+                with self._lock:
+                    self._flushing = ({}, {})
+                    for user_id, deltas in statistics.items():
+                        pending = self._statistics.setdefault(user_id, {})
+                        for field, delta in deltas.items():
+                            pending[field] = pending.get(field, 0) + delta
+                    for pk, (shown, answered) in cards.items():
+                        current = self._cards.get(pk, (0, 0))
+                        self._cards[pk] = (current[0] + shown, current[1] + answered)
+                raise
+
+
+class DatabaseBackend(object):
+    buffered = True
+
+    def __init__(self, options):
+        self.batch_size = options.get('FLUSH_BATCH_SIZE', 500)
+
+    def add(self, user_id, statistic_deltas, card_deltas):
+        rows = [CounterDelta(kind=CounterDelta.STATISTIC, object_id=user_id, field=field, delta=delta)
+                for field, delta in statistic_deltas.items() if delta]
+        for pk, (shown, answered) in card_deltas.items():
+            rows.append(CounterDelta(kind=CounterDelta.CARD, object_id=pk, field='times_shown', delta=shown))
+            if answered:
+                rows.append(CounterDelta(kind=CounterDelta.CARD, object_id=pk, field='answered_correctly',
+                                         delta=answered))
+        CounterDelta.objects.bulk_create(rows)
+
+    def pending_statistics(self, user_id):
+        totals = (CounterDelta.objects.filter(kind=CounterDelta.STATISTIC, object_id=user_id)
+                  .values('field').annotate(total=Sum('delta')))
+        return {row['field']: row['total'] for row in totals}
+
+    def pending_cards(self, pks):
+        totals = (CounterDelta.objects.filter(kind=CounterDelta.CARD, object_id__in=list(pks))
+                  .values('object_id', 'field').annotate(total=Sum('delta')))
+        pending = {}
+        for row in totals:
+            shown, answered = pending.get(row['object_id'], (0, 0))
+            if row['field'] == 'times_shown':
+                shown += row['total']
+            else:
+                answered += row['total']
+            pending[row['object_id']] = (shown, answered)
+        return pending
+
+    def flush(self):
+        flushed = 0
+        while True:
+            with transaction.atomic():
+                pks = CounterDelta.objects.order_by('pk')
+                if connections[pks.db].features.has_select_for_update_skip_locked:
+                    pks = pks.select_for_update(skip_locked=True)
+                pks = list(pks.values_list('pk', flat=True)[:self.batch_size])
+                if not pks:
+                    return flushed
+                batch = CounterDelta.objects.filter(pk__in=pks)
+
+                statistics, cards = {}, {}
+                for row in batch.values('kind', 'object_id', 'field').annotate(total=Sum('delta')):
+                    if row['kind'] == CounterDelta.STATISTIC:
+                        statistics.setdefault(row['object_id'], {})[row['field']] = row['total']
+                    else:
+                        shown, answered = cards.get(row['object_id'], (0, 0))
+                        if row['field'] == 'times_shown':
+                            shown += row['total']
+                        else:
+                            answered += row['total']
+                        cards[row['object_id']] = (shown, answered)
+                flushed += fold(statistics, cards)
+                batch.delete()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            options = dict(getattr(settings, 'COUNTER_BUFFER', {}))
+            path = options.get('BACKEND', 'direct')
+            _backend = import_string(BACKEND_ALIASES.get(path, path))(options)
+        return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(setting, **kwargs):
+    global _backend
+    if setting == 'COUNTER_BUFFER':
+        with _backend_lock:
+            _backend = None
+
+
+@atexit.register
+def flush_on_exit():
+    if isinstance(_backend, MemoryBackend):
+        try:
+            _backend.flush()
+        except Exception:
+            logger.exception('Flushing buffered counters at exit failed')
+
+
+def pending_statistics(user_id):
+    return get_backend().pending_statistics(user_id)
+
+
+def pending_cards(pks):
+    return get_backend().pending_cards(pks)
+
+
+def flush():
+    return get_backend().flush()
+
+
+def push_statistics(user, data):
+    push_many(user, [data])
+
+
+def push_many(user, pushes):
+    backend = get_backend()
+    deltas = dict.fromkeys(STATISTIC_FIELDS, 0)
+    cards = {}
+    for data in pushes:
+        for field, delta in statistic_deltas(data).items():
+            deltas[field] += delta
+        for pk, (shown, answered) in card_deltas(data).items():
+            total_shown, total_answered = cards.get(pk, (0, 0))
+            cards[pk] = (total_shown + shown, total_answered + answered)
+    with transaction.atomic():
+        backend.add(user.pk, deltas, cards)
+        for data in pushes:
+            scheduler.record_reviews(user, data)
+        if not backend.buffered:
+            achievement_queue.enqueue(user, changed_fields=[field for field, delta in deltas.items() if delta])
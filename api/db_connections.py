@@ -0,0 +1,135 @@
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.core.signals import request_started, setting_changed
+from django.db import connections
+from django.dispatch import receiver
+
+POOL_SIZE = 10
+POOL_TIMEOUT = 10.0
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def connection_options():
+    return dict({'HEALTH_CHECKS': True, 'REPLICA': 'replica', 'REPLICA_READS': False, 'PIN_SECONDS': 5},
+                **getattr(settings, 'DATABASE_CONNECTIONS', {}))
+
+
+def ping(connection):
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    finally:
+        cursor.close()
+
+
+def close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool(object):
+    def __init__(self, size=POOL_SIZE, timeout=POOL_TIMEOUT, health_checks=True):
+        self.size = size
+        self.timeout = timeout
+        self.health_checks = health_checks
+        self.idle = deque()
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def acquire(self, connect, error_class):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise error_class('No database connection became available within %.1f seconds '
+                              '(pool size %d).' % (self.timeout, self.size))
+        try:
+            while True:
+                with self.lock:
+                    connection = self.idle.pop() if self.idle else None
+                if connection is None:
+                    return connect()
+                if not self.health_checks:
+                    return connection
+                try:
+                    ping(connection)
+                except Exception:
+                    close_quietly(connection)
+                else:
+                    return connection
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, connection, discard=False):
+        try:
+            if discard:
+                close_quietly(connection)
+            else:
+                with self.lock:
+                    self.idle.append(connection)
+        finally:
+            self.slots.release()
+
+    def close_idle(self):
+        with self.lock:
+            idle, self.idle = list(self.idle), deque()
+        for connection in idle:
+            close_quietly(connection)
+        return len(idle)
+
+
+def get_pool(alias, settings_dict):
+    key = (alias, settings_dict['NAME'])
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            options = dict({'SIZE': POOL_SIZE, 'TIMEOUT': POOL_TIMEOUT}, **settings_dict.get('POOL', {}))
+            pool = _pools[key] = ConnectionPool(options['SIZE'], options['TIMEOUT'],
+                                                connection_options()['HEALTH_CHECKS'])
+        return pool
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_idle()
+
+
+class PooledDatabaseWrapperMixin(object):
+    connection_pool = None
+
+    def get_new_connection(self, conn_params):
+        connect = super().get_new_connection
+        self.connection_pool = get_pool(self.alias, self.settings_dict)
+        return self.connection_pool.acquire(lambda: connect(conn_params), self.Database.OperationalError)
+
+    def _close(self):
+        if self.connection is None:
+            return
+        discard = False
+        try:
+            self.connection.rollback()
+        except self.Database.Error:
+            discard = True
+        self.connection_pool.release(self.connection, discard)
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    if not connection_options()['HEALTH_CHECKS']:
+        return
+    for connection in connections.all():
+        if connection.connection is not None and not connection.in_atomic_block and not connection.is_usable():
+            connection.close()
+
+
+@receiver(setting_changed)
+def reset_pools(setting=None, **kwargs):
+    if setting in ('DATABASES', 'DATABASE_CONNECTIONS'):
+        close_pools()
@@ -0,0 +1,101 @@
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Q, Value, When
+
+from .counters import increment_case
+from .models import CardReview, CounterDelta, TabooCard, difficulty_expression
+from .text import normalize
+
+MERGE_BATCH_SIZE = 200
+KEY_WORD_LENGTH = TabooCard._meta.get_field('normalized_key_word').max_length
+
+
+def normalized_key_word(key_word):
+    return normalize(key_word)[:KEY_WORD_LENGTH]
+
+
+def find_duplicate(language_id, key_word):
+    return (TabooCard.objects.filter(language_id=language_id, normalized_key_word=normalized_key_word(key_word))
+            .order_by('pk').first())
+
+
+def duplicate_groups(batch_size=MERGE_BATCH_SIZE):
+    groups = (TabooCard.objects.order_by().values('language_id', 'normalized_key_word')
+              .annotate(cards=Count('pk')).filter(cards__gt=1))
+    last = None
+    while True:
+        page = groups
+        if last is not None:
+            page = page.filter(Q(language_id__gt=last[0]) |
+                               Q(language_id=last[0], normalized_key_word__gt=last[1]))
+        rows = [(row['language_id'], row['normalized_key_word'])
+                for row in page.order_by('language_id', 'normalized_key_word')[:batch_size]]
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]
+
+
+def retarget(queryset, field, targets):
+    by_target = {}
+    for pk, target in targets.items():
+        by_target.setdefault(target, []).append(pk)
+    queryset.filter(pk__in=list(targets)).update(**{field: Case(
+        *[When(pk__in=pks, then=Value(target)) for target, pks in by_target.items()],
+        output_field=IntegerField())})
+
+
+def merge_groups(groups):
+    condition = Q()
+    for language_id, key_word in groups:
+        condition |= Q(language_id=language_id, normalized_key_word=key_word)
+
+    with transaction.atomic():
+        cards = (TabooCard.objects.select_for_update().filter(condition).order_by('pk')
+                 .values_list('pk', 'language_id', 'normalized_key_word', 'times_shown', 'answered_correctly'))
+        survivors, survivor_of, totals = {}, {}, {}
+        for pk, language_id, key_word, shown, answered in cards:
+            survivor = survivors.setdefault((language_id, key_word), pk)
+            if survivor == pk:
+                continue
+            survivor_of[pk] = survivor
+            total = totals.setdefault(survivor, [0, 0])
+            total[0] += shown
+            total[1] += answered
+        if not survivor_of:
+            return 0
+
+        shown_groups, answered_groups = {}, {}
+        for pk, (shown, answered) in totals.items():
+            shown_groups.setdefault(shown, []).append(pk)
+            answered_groups.setdefault(answered, []).append(pk)
+        merged = TabooCard.objects.filter(pk__in=list(totals))
+        merged.update(times_shown=increment_case('times_shown', shown_groups),
+                      answered_correctly=increment_case('answered_correctly', answered_groups))
+        merged.update(difficulty_bucket=difficulty_expression())
+
+        pending = dict(CounterDelta.objects.filter(kind=CounterDelta.CARD, object_id__in=list(survivor_of))
+                       .values_list('pk', 'object_id'))
+        if pending:
+            retarget(CounterDelta.objects, 'object_id', {pk: survivor_of[card] for pk, card in pending.items()})
+
+        reviewed = set(CardReview.objects.filter(card_id__in=list(totals)).values_list('user_id', 'card_id'))
+        moves = {}
+        for pk, user_id, card_id in (CardReview.objects.filter(card_id__in=list(survivor_of))
+                                     .order_by('-last_reviewed_at', 'pk').values_list('pk', 'user_id', 'card_id')):
+            target = survivor_of[card_id]
+            if (user_id, target) not in reviewed:
+                reviewed.add((user_id, target))
+                moves[pk] = target
+        if moves:
+            retarget(CardReview.objects, 'card_id', moves)
+
+        TabooCard.objects.filter(pk__in=list(survivor_of)).delete()
+    return len(survivor_of)
+
+
+def merge_duplicates(batch_size=MERGE_BATCH_SIZE):
+    groups, merged = 0, 0
+    for batch in duplicate_groups(batch_size):
+        groups += len(batch)
+        merged += merge_groups(batch)
+    return groups, merged
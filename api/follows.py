@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .caching import bump_version, get_cache, is_shared, versioned_key
+from .models import UserFollowing
+
+
+def following_namespace(user_id):
+    return 'follows:user:%s' % user_id
+
+
+def follow(user, target):
+    try:
+        with transaction.atomic():
+            return UserFollowing.objects.get_or_create(user=user, following=target)
+    except IntegrityError:
+        return UserFollowing.objects.get(user=user, following=target), False
+
+
+def unfollow(user, target):
+    deleted, _ = UserFollowing.objects.filter(user=user, following=target).delete()
+    return deleted > 0
+
+
+def following_ids(user):
+    if not user.is_authenticated:
+        return set()
+    cache = get_cache()
+    if not is_shared(cache):
+        return set(UserFollowing.objects.filter(user=user).values_list('following_id', flat=True))
+    key = versioned_key('follows:following-ids:%s' % user.pk, following_namespace(user.pk))
+    ids = cache.get(key)
+    if ids is None:
+        ids = set(UserFollowing.objects.filter(user=user).values_list('following_id', flat=True))
+        cache.set(key, ids, getattr(settings, 'FOLLOWING_IDS_CACHE_TIMEOUT', 300))
+    return ids
+
+
+def followings(user):
+    return UserFollowing.objects.filter(user=user).select_related('following')
+
+
+def followers(user):
+    return UserFollowing.objects.filter(following=user).select_related('user')
+
+
+def mutuals(user):
+    return User.objects.filter(followed_by__user=user, following__following=user)
+
+
+@receiver(post_save, sender=UserFollowing)
+@receiver(post_delete, sender=UserFollowing)
+def invalidate_following_ids(sender, instance=None, **kwargs):
+    bump_version(following_namespace(instance.user_id))
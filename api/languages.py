@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.db.models import Count
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+
+from .caching import bump_version, get_cache, versioned_key
+from .models import Language
+
+LANGUAGES_NAMESPACE = 'languages'
+
+
+def subscriber_namespace(user_id):
+    return 'languages:user:%s' % user_id
+
+
+def user_namespace(user):
+    return subscriber_namespace(user.pk)
+
+
+def languages_with_counts():
+    return Language.objects.annotate(subscriber_count=Count('users')).order_by('name')
+
+
+def cached_language_rows(serialize):
+    cache = get_cache()
+    key = versioned_key('languages:list', LANGUAGES_NAMESPACE)
+    rows = cache.get(key)
+    if rows is None:
+        rows = serialize(languages_with_counts())
+        cache.set(key, rows, getattr(settings, 'LANGUAGE_LIST_CACHE_TIMEOUT', 60))
+    return rows
+
+
+def subscribed_language_ids(user):
+    if not user.is_authenticated:
+        return set()
+    cache = get_cache()
+    key = versioned_key('languages:subscribed:%s' % user.pk, user_namespace(user))
+    language_ids = cache.get(key)
+    if language_ids is None:
+        language_ids = set(user.selected_languages.values_list('pk', flat=True))
+        cache.set(key, language_ids, getattr(settings, 'LANGUAGE_LIST_CACHE_TIMEOUT', 60))
+    return language_ids
+
+
+def subscriber_ids(sender, instance, action, reverse, pk_set):
+    if reverse:
+        return [instance.pk] if action.startswith('post_') else []
+    if action == 'pre_clear':
+        instance._cleared_subscriber_ids = list(sender.objects.filter(language_id=instance.pk)
+                                                .values_list('user_id', flat=True))
+        return []
+    if action == 'post_clear':
+        return getattr(instance, '_cleared_subscriber_ids', [])
+    return list(pk_set or ())
+
+
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Language)
+def invalidate_language_list(sender, **kwargs):
+    bump_version(LANGUAGES_NAMESPACE)
+
+
+@receiver(m2m_changed, sender=Language.users.through)
+def invalidate_subscriber_namespaces(sender, instance=None, action=None, reverse=False, pk_set=None, **kwargs):
+    if action not in ('pre_clear', 'post_add', 'post_remove', 'post_clear'):
+        return
+    for user_id in subscriber_ids(sender, instance, action, reverse, pk_set):
+        bump_version(subscriber_namespace(user_id))
@@ -0,0 +1,228 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .counters import increment_case
+from .models import Achievement, Language, LanguageScore, ScoreBucket, Statistic
+
+REBUILD_CHUNK_SIZE = 5000
+
+
+def leaderboard_limit(limit=None):
+    maximum = getattr(settings, 'LEADERBOARD_MAX_LIMIT', 100)
+    try:
+        limit = int(limit or getattr(settings, 'LEADERBOARD_DEFAULT_LIMIT', 20))
+    except ValueError:
+        limit = getattr(settings, 'LEADERBOARD_DEFAULT_LIMIT', 20)
+    return max(1, min(limit, maximum))
+
+
+def ranked_statistics():
+    return Statistic.objects.select_related('user').order_by('-score', 'user_id')
+
+
+def with_ranks(statistics, first_rank=1):
+    ranked, rank, previous = [], first_rank, None
+    for position, statistic in enumerate(statistics):
+        if previous is not None and statistic.score != previous:
+            rank = first_rank + position
+        statistic.rank = rank
+        previous = statistic.score
+        ranked.append(statistic)
+    return ranked
+
+
+def top(limit=None, language_id=None):
+    if language_id:
+        scores = (LanguageScore.objects.filter(language_id=language_id).select_related('user')
+                  .order_by('-score', 'user_id'))
+        return with_ranks(scores[:leaderboard_limit(limit)])
+    return with_ranks(ranked_statistics()[:leaderboard_limit(limit)])
+
+
+def friends(user, following_ids, limit=None):
+    statistics = ranked_statistics().filter(user_id__in=set(following_ids) | {user.pk})
+    return with_ranks(statistics[:leaderboard_limit(limit)])
+
+
+def rank_of(user):
+    score = Statistic.objects.filter(user=user).values_list('score', flat=True).first()
+    if score is None:
+        return None, None
+    above = ScoreBucket.objects.filter(score__gt=score).aggregate(users=Sum('users'))['users'] or 0
+    return above + 1, score
+
+
+def shift_buckets(moves):
+    groups = {}
+    for score, users in moves.items():
+        if users:
+            groups.setdefault(users, []).append(score)
+    if not groups:
+        return
+    scores = [score for ids in groups.values() for score in ids]
+    updated = ScoreBucket.objects.filter(score__in=scores).update(users=increment_case('users', groups, key='score'))
+    if updated == len(scores):
+        return
+    existing = set(ScoreBucket.objects.filter(score__in=scores).values_list('score', flat=True))
+    missing = {score: moves[score] for score in scores if score not in existing}
+    try:
+        with transaction.atomic():
+            ScoreBucket.objects.bulk_create([ScoreBucket(score=score, users=users)
+                                             for score, users in missing.items()])
+    except IntegrityError:
+        shift_buckets(missing)
+
+
+def move_users(moves, old_scores, delta):
+    for score, users in old_scores.items():
+        moves[score] -= users
+        moves[score + delta] += users
+
+
+def add_scores(scores_by_user):
+    groups = {}
+    for user_id, delta in scores_by_user.items():
+        if delta:
+            groups.setdefault(delta, []).append(user_id)
+    if not groups:
+        return 0
+    user_ids = [user_id for ids in groups.values() for user_id in ids]
+    deltas = {user_id: delta for delta, ids in groups.items() for user_id in ids}
+    with transaction.atomic():
+        statistics = Statistic.objects.filter(user_id__in=user_ids)
+        old_scores = statistics.select_for_update().values_list('user_id', 'score')
+        moves = Counter()
+        for user_id, score in old_scores:
+            move_users(moves, {score: 1}, deltas[user_id])
+        updated = statistics.update(score=increment_case('score', groups, key='user_id'))
+        LanguageScore.objects.filter(user_id__in=user_ids).update(
+            score=increment_case('score', groups, key='user_id'))
+        shift_buckets(moves)
+    return updated
+
+
+def shift_scores(user_ids, delta):
+    if not delta:
+        return 0
+    with transaction.atomic():
+        statistics = Statistic.objects.filter(user_id__in=user_ids)
+        moves = Counter()
+        move_users(moves, Counter(statistics.select_for_update().values_list('score', flat=True)), delta)
+        updated = statistics.update(score=F('score') + delta)
+        LanguageScore.objects.filter(user_id__in=user_ids).update(score=F('score') + delta)
+        shift_buckets(moves)
+    return updated
+
+
+def expected_score():
+    through = Achievement.users.through
+    scores = (through.objects.filter(user_id=OuterRef('user_id'))
+              .order_by().values('user_id')
+              .annotate(total=Sum('achievement__score')).values('total'))
+    return Coalesce(Subquery(scores, output_field=IntegerField()), 0)
+
+
+def rebuild_scores(user_ids=None, chunk_size=REBUILD_CHUNK_SIZE):
+    statistics = Statistic.objects.annotate(expected=expected_score()).exclude(score=F('expected'))
+    if user_ids is not None:
+        statistics = statistics.filter(user_id__in=user_ids)
+
+    repaired, last_pk = 0, 0
+    while True:
+        drifted = list(statistics.filter(pk__gt=last_pk).order_by('pk')
+                       .values_list('pk', 'user_id', 'score', 'expected')[:chunk_size])
+        if not drifted:
+            return repaired
+        repaired += add_scores({user_id: expected - score for _, user_id, score, expected in drifted})
+        last_pk = drifted[-1][0]
+
+
+def rebuild_buckets():
+    counts = (Statistic.objects.order_by().values('score').annotate(users=Count('pk'))
+              .values_list('score', 'users'))
+    with transaction.atomic():
+        ScoreBucket.objects.all().delete()
+        ScoreBucket.objects.bulk_create([ScoreBucket(score=score, users=users) for score, users in counts])
+
+
+def rebuild_language_scores(chunk_size=REBUILD_CHUNK_SIZE):
+    through = Language.users.through
+    current = Subquery(Statistic.objects.filter(user_id=OuterRef('user_id')).values('score')[:1],
+                       output_field=IntegerField())
+    subscribed = through.objects.filter(language_id=OuterRef('language_id'), user_id=OuterRef('user_id'))
+    tracked = LanguageScore.objects.filter(language_id=OuterRef('language_id'), user_id=OuterRef('user_id'))
+
+    stale = (LanguageScore.objects.annotate(subscribed=Exists(subscribed)).filter(subscribed=False)
+             .values_list('pk', flat=True))
+    LanguageScore.objects.filter(pk__in=list(stale)).delete()
+    missing = (through.objects.annotate(tracked=Exists(tracked), score=Coalesce(current, 0)).filter(tracked=False)
+               .values_list('language_id', 'user_id', 'score'))
+    LanguageScore.objects.bulk_create([LanguageScore(language_id=language_id, user_id=user_id, score=score)
+                                       for language_id, user_id, score in missing], batch_size=chunk_size)
+    LanguageScore.objects.exclude(score=current).update(score=current)
+
+
+@receiver(m2m_changed, sender=Achievement.users.through)
+def maintain_scores(sender, instance=None, action=None, reverse=False, pk_set=None, **kwargs):
+    if action in ('post_add', 'post_remove') and pk_set:
+        sign = 1 if action == 'post_add' else -1
+        if reverse:
+            score = Achievement.objects.filter(pk__in=pk_set).aggregate(total=Sum('score'))['total'] or 0
+            add_scores({instance.pk: sign * score})
+        else:
+            add_scores({user_id: sign * instance.score for user_id in pk_set})
+    elif action == 'pre_clear' and not reverse:
+        holders = sender.objects.filter(achievement=instance).values_list('user_id', flat=True)
+        instance._cleared_user_ids = list(holders)
+    elif action == 'post_clear':
+        rebuild_scores(user_ids=[instance.pk] if reverse else getattr(instance, '_cleared_user_ids', None))
+
+
+@receiver(pre_delete, sender=Achievement)
+def unscore_holders(sender, instance=None, **kwargs):
+    # Cascading deletes of the auto-created through rows never send m2m_changed or delete signals.
+    score = sender.objects.filter(pk=instance.pk).values_list('score', flat=True).first()
+    if score:
+        shift_scores(sender.users.through.objects.filter(achievement_id=instance.pk).values('user_id'), -score)
+
+
+@receiver(post_save, sender=Statistic)
+def count_new_statistic(sender, instance=None, created=False, **kwargs):
+    if created:
+        shift_buckets({instance.score: 1})
+
+
+@receiver(post_delete, sender=Statistic)
+def uncount_statistic(sender, instance=None, **kwargs):
+    shift_buckets({instance.score: -1})
+
+
+@receiver(m2m_changed, sender=Language.users.through)
+def maintain_language_scores(sender, instance=None, action=None, reverse=False, pk_set=None, **kwargs):
+    if action == 'post_add' and pk_set:
+        pairs = [(language_id, instance.pk) for language_id in pk_set] if reverse else \
+            [(instance.pk, user_id) for user_id in pk_set]
+        scores = dict(Statistic.objects.filter(user_id__in={user_id for _, user_id in pairs})
+                      .values_list('user_id', 'score'))
+        LanguageScore.objects.bulk_create([LanguageScore(language_id=language_id, user_id=user_id,
+                                                         score=scores.get(user_id, 0))
+                                           for language_id, user_id in pairs])
+    elif action == 'post_remove' and pk_set:
+        if reverse:
+            LanguageScore.objects.filter(user_id=instance.pk, language_id__in=pk_set).delete()
+        else:
+            LanguageScore.objects.filter(language_id=instance.pk, user_id__in=pk_set).delete()
+    elif action == 'post_clear':
+        LanguageScore.objects.filter(**{'user_id' if reverse else 'language_id': instance.pk}).delete()
+
+
+@receiver(post_save, sender=Achievement)
+def rescore_holders(sender, instance=None, created=False, **kwargs):
+    if not created:
+        rebuild_scores(user_ids=sender.users.through.objects.filter(achievement=instance).values('user_id'))
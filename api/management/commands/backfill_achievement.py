@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import achievements, counters
+from api.conditions import ConditionError
+from api.models import Achievement
+
+
+class Command(BaseCommand):
+    help = ('Awards an achievement to every user that already satisfies its condition, '
+            'in batched bulk inserts.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('achievement_id', type=int)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the users that would be awarded.')
+
+    def handle(self, *args, **options):
+        try:
+            achievement = Achievement.objects.get(pk=options['achievement_id'])
+        except Achievement.DoesNotExist:
+            raise CommandError('Achievement %s does not exist' % options['achievement_id'])
+
+        counters.flush()
+        try:
+            if options['dry_run']:
+                self.stdout.write('%d users qualify for %s' % (achievements.newly_qualified(achievement).count(),
+                                                                achievement))
+                return
+            user_ids = achievements.backfill(achievement)
+        except ConditionError as error:
+            raise CommandError('The condition of %s is invalid: %s' % (achievement, error))
+        self.stdout.write('Awarded %s to %d users' % (achievement, len(user_ids)))
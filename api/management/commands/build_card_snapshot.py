@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import snapshot
+
+
+class Command(BaseCommand):
+    help = 'Writes the packed per-language card snapshot and atomically swaps it into place.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Snapshot file; defaults to CARD_SNAPSHOT["PATH"].')
+        parser.add_argument('--loop', action='store_true', help='Keep rebuilding every --interval seconds.')
+        parser.add_argument('--interval', type=float, default=60.0)
+
+    def handle(self, *args, **options):
+        path = options['path'] or snapshot.snapshot_options()['PATH']
+        while True:
+            started = time.monotonic()
+            count = snapshot.build(path)
+            self.stdout.write('Wrote %d cards to %s in %.2fs' % (count, path, time.monotonic() - started))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import achievement_queue
+
+
+class Command(BaseCommand):
+    help = 'Evaluates achievements for users queued by the deferred achievement backend.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep draining the queue instead of exiting once it is empty.')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to sleep between drains in --loop mode.')
+
+    def handle(self, *args, **options):
+        backend = achievement_queue.get_backend()
+        if options['loop'] and not isinstance(backend, achievement_queue.DatabaseBackend):
+            raise CommandError('%s evaluates achievements in-process, so there is no queue to drain; set '
+                               'ACHIEVEMENT_QUEUE["BACKEND"] to "database" to run a worker.' % type(backend).__name__)
+        while True:
+            processed = achievement_queue.drain()
+            if processed:
+                self.stdout.write('Evaluated achievements for %d users' % processed)
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from api import cards_io
+from api.models import TabooCard
+
+
+class Command(BaseCommand):
+    help = 'Streams taboo cards out as CSV or NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=('csv', 'ndjson'), default='ndjson')
+        parser.add_argument('--language', help='Only export cards of this language code.')
+        parser.add_argument('--output', default='-', help='File to write, or - for stdout.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        cards = TabooCard.objects.all()
+        if options['language']:
+            cards = cards.filter(language__language_code=options['language'])
+
+        chunks = cards_io.export_cards(cards, options['format'], options['chunk_size'])
+        if options['output'] == '-':
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            for chunk in chunks:
+                output.write(chunk)
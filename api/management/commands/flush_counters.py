@@ -0,0 +1,24 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import counters
+
+
+class Command(BaseCommand):
+    help = 'Folds buffered card and statistic counter deltas into their rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep flushing every FLUSH_INTERVAL seconds instead of exiting.')
+
+    def handle(self, *args, **options):
+        interval = getattr(settings, 'COUNTER_BUFFER', {}).get('FLUSH_INTERVAL', 5.0)
+        while True:
+            flushed = counters.flush()
+            if flushed:
+                self.stdout.write('Flushed counters of %d rows' % flushed)
+            if not options['loop']:
+                return
+            time.sleep(interval)
@@ -0,0 +1,47 @@
+import sys
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api import cards_io
+
+
+class Command(BaseCommand):
+    help = 'Bulk imports taboo cards from a CSV or NDJSON file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - to read from stdin.')
+        parser.add_argument('--owner', required=True, help='Username that will own the imported cards.')
+        parser.add_argument('--format', choices=('csv', 'ndjson'),
+                            help='Input format. Guessed from the file extension when omitted.')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Rows per bulk INSERT. Defaults to settings.CARD_IMPORT_BATCH_SIZE.')
+        parser.add_argument('--skip-duplicates', action='store_true',
+                            help='Skip rows whose key word already exists in the same language.')
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(username=options['owner'])
+        except User.DoesNotExist:
+            raise CommandError('User "%s" does not exist' % options['owner'])
+
+        path = options['path']
+        input_format = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        stream = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+
+        started = time.monotonic()
+        try:
+            result = cards_io.import_cards(cards_io.read_rows(stream, input_format), owner, options['batch_size'],
+                                           skip_duplicates=options['skip_duplicates'])
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        elapsed = time.monotonic() - started
+
+        for error in result['errors']:
+            self.stderr.write('Row %s: %s' % (error['row'], error['errors']))
+        self.stdout.write('Imported %d cards in %.2fs (%.0f rows/sec), %d rows rejected' % (
+            result['created'], elapsed, result['created'] / elapsed if elapsed else 0, len(result['errors'])))
+        if options['skip_duplicates']:
+            self.stdout.write('Skipped %d duplicate cards' % result['skipped'])
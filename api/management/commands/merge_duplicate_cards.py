@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api import counters, duplicates
+
+
+class Command(BaseCommand):
+    help = ('Merges taboo cards that share a normalized key word within a language into the oldest card, '
+            'summing their counters.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=duplicates.MERGE_BATCH_SIZE,
+                            help='Number of duplicate groups merged per transaction.')
+
+    def handle(self, *args, **options):
+        counters.flush()
+        groups, merged = duplicates.merge_duplicates(batch_size=options['batch_size'])
+        self.stdout.write('Merged %d duplicate cards into %d cards' % (merged, groups))
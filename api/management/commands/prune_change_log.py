@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api import sync
+
+
+class Command(BaseCommand):
+    help = 'Deletes sync change log entries that a newer entry for the same object supersedes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=sync.PRUNE_CHUNK_SIZE,
+                            help='Range of change log ids scanned per DELETE.')
+
+    def handle(self, *args, **options):
+        pruned = sync.prune(chunk_size=options['chunk_size'])
+        self.stdout.write('Pruned %d superseded change log entries' % pruned)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api import leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the denormalized leaderboard scores, rank buckets and per-language boards and repairs drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=leaderboard.REBUILD_CHUNK_SIZE,
+                            help='Number of drifted statistics repaired per UPDATE.')
+
+    def handle(self, *args, **options):
+        repaired = leaderboard.rebuild_scores(chunk_size=options['chunk_size'])
+        leaderboard.rebuild_buckets()
+        leaderboard.rebuild_language_scores(chunk_size=options['chunk_size'])
+        self.stdout.write('Repaired scores of %d users' % repaired)
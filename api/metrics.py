@@ -0,0 +1,236 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def instrumentation_options():
+    return dict({'ENABLED': True, 'QUERY_BUDGET': 20, 'QUERY_BUDGETS': {},
+                 'LATENCY_BUCKETS': DEFAULT_LATENCY_BUCKETS, 'MULTIPROCESS_DIR': None, 'FLUSH_SECONDS': 1.0},
+                **getattr(settings, 'INSTRUMENTATION', {}))
+
+
+class RouteMetrics(object):
+    def __init__(self, buckets):
+        self.requests = 0
+        self.latency_buckets = [0] * len(buckets)
+        self.latency_sum = 0.0
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.response_bytes = 0
+        self.over_budget = 0
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._configure()
+        atexit.register(self.flush)
+
+    def _configure(self):
+        options = instrumentation_options()
+        self.buckets = tuple(options['LATENCY_BUCKETS'])
+        self.directory = options['MULTIPROCESS_DIR']
+        self.flush_seconds = options['FLUSH_SECONDS']
+        self._flushed_at = 0.0
+        self._path = self._path_pid = None
+
+    def reset(self):
+        with self._lock:
+            path = self._path
+            self._routes = {}
+            self._configure()
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def _route(self, route, method):
+        metrics = self._routes.get((route, method))
+        if metrics is None:
+            metrics = self._routes[(route, method)] = RouteMetrics(self.buckets)
+        return metrics
+
+    def observe(self, route, method, seconds, queries, db_seconds, serializer_seconds, response_bytes,
+                over_budget):
+        with self._lock:
+            metrics = self._route(route, method)
+            metrics.requests += 1
+            metrics.latency_sum += seconds
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    metrics.latency_buckets[index] += 1
+            metrics.queries += queries
+            metrics.db_seconds += db_seconds
+            metrics.serializer_seconds += serializer_seconds
+            metrics.response_bytes += response_bytes
+            metrics.over_budget += int(over_budget)
+        self.flush(force=False)
+
+    def add_stream(self, route, method, response_bytes, queries, db_seconds, over_budget):
+        with self._lock:
+            metrics = self._route(route, method)
+            metrics.response_bytes += response_bytes
+            metrics.queries += queries
+            metrics.db_seconds += db_seconds
+            metrics.over_budget += int(over_budget)
+        self.flush(force=False)
+
+    def snapshot(self):
+        with self._lock:
+            return self.buckets, {key: dict(vars(metrics), latency_buckets=list(metrics.latency_buckets))
+                                  for key, metrics in self._routes.items()}
+
+    def process_path(self):
+        # Keyed by pid and start time so a recycled pid never overwrites the totals of a dead worker.
+        pid = os.getpid()
+        if self._path is None or self._path_pid != pid:
+            self._path_pid = pid
+            self._path = os.path.join(self.directory, 'metrics-%d-%d.json' % (pid, time.time() * 1000))
+        return self._path
+
+    def flush(self, force=True):
+        if not self.directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._flushed_at < self.flush_seconds:
+            return
+        self._flushed_at = now
+        buckets, routes = self.snapshot()
+        path = self.process_path()
+        temporary = '%s.%d.tmp' % (path, threading.get_ident())
+        try:
+            with open(temporary, 'w') as stream:
+                json.dump({'buckets': buckets, 'routes': [[route, method, metrics]
+                                                          for (route, method), metrics in routes.items()]}, stream)
+            os.replace(temporary, path)
+        except OSError:
+            logger.exception('Could not write metrics to %s', path)
+
+    def collect(self):
+        if not self.directory:
+            return self.snapshot()
+        self.flush()
+        merged = {}
+        for path in sorted(glob.glob(os.path.join(self.directory, 'metrics-*.json'))):
+            try:
+                with open(path) as stream:
+                    data = json.load(stream)
+            except (OSError, ValueError):
+                continue
+            if tuple(data['buckets']) != self.buckets:
+                continue
+            for route, method, metrics in data['routes']:
+                total = merged.get((route, method))
+                if total is None:
+                    merged[(route, method)] = metrics
+                    continue
+                for field, value in metrics.items():
+                    if field == 'latency_buckets':
+                        total[field] = [left + right for left, right in zip(total[field], value)]
+                    else:
+                        total[field] += value
+        return self.buckets, merged
+
+
+registry = MetricsRegistry()
+
+
+@receiver(setting_changed)
+def reconfigure_registry(setting, **kwargs):
+    if setting == 'INSTRUMENTATION':
+        registry.reset()
+
+
+class RequestState(threading.local):
+    active = False
+    queries = 0
+    db_seconds = 0.0
+    serializer_seconds = 0.0
+    serializer_depth = 0
+
+
+state = RequestState()
+
+
+class TimedSerializerMixin(object):
+    @property
+    def data(self):
+        if not state.active or state.serializer_depth:
+            return super().data
+        state.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().data
+        finally:
+            state.serializer_seconds += time.perf_counter() - started
+            state.serializer_depth -= 1
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_serializer = super().many_init(*args, **kwargs)
+        if type(list_serializer) is serializers.ListSerializer:
+            list_serializer.__class__ = TimedListSerializer
+        return list_serializer
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    pass
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(extra_metrics=()):
+    buckets, routes = registry.collect()
+    lines = []
+
+    def family(name, kind, description):
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, kind))
+
+    def labels(route, method, **extra):
+        pairs = [('route', route), ('method', method)] + sorted(extra.items())
+        return '{%s}' % ','.join('%s="%s"' % (key, escape(value)) for key, value in pairs)
+
+    counters = (
+        ('api_requests_total', 'requests', 'Requests served.'),
+        ('api_db_queries_total', 'queries', 'SQL queries executed.'),
+        ('api_db_seconds_total', 'db_seconds', 'Time spent executing SQL.'),
+        ('api_serializer_seconds_total', 'serializer_seconds', 'Time spent in serializers.'),
+        ('api_response_bytes_total', 'response_bytes', 'Response body bytes.'),
+        ('api_query_budget_exceeded_total', 'over_budget', 'Requests that exceeded the query budget.'),
+    )
+    for name, field, description in counters:
+        family(name, 'counter', description)
+        for (route, method), metrics in sorted(routes.items()):
+            lines.append('%s%s %s' % (name, labels(route, method), metrics[field]))
+
+    family('api_request_duration_seconds', 'histogram', 'Request latency.')
+    for (route, method), metrics in sorted(routes.items()):
+        for bound, count in zip(buckets, metrics['latency_buckets']):
+            lines.append('api_request_duration_seconds_bucket%s %s'
+                         % (labels(route, method, le=repr(float(bound))), count))
+        lines.append('api_request_duration_seconds_bucket%s %s'
+                     % (labels(route, method, le='+Inf'), metrics['requests']))
+        lines.append('api_request_duration_seconds_sum%s %s' % (labels(route, method), metrics['latency_sum']))
+        lines.append('api_request_duration_seconds_count%s %s' % (labels(route, method), metrics['requests']))
+
+    for name, kind, description, value in extra_metrics:
+        family(name, kind, description)
+        lines.append('%s %s' % (name, value))
+
+    return '\n'.join(lines) + '\n'
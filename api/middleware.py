@@ -0,0 +1,119 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from . import metrics, routers
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.url_name or 'unnamed'
+
+
+class InstrumentationMiddleware(object):
+    def __init__(self, get_response):
+        self.get_response = get_response
+        options = metrics.instrumentation_options()
+        self.enabled = options['ENABLED']
+        self.query_budget = options['QUERY_BUDGET']
+        self.query_budgets = options['QUERY_BUDGETS']
+
+    def __call__(self, request):
+        if not self.enabled or metrics.state.active:
+            return self.get_response(request)
+
+        state = metrics.state
+        state.active = True
+        state.queries = 0
+        state.db_seconds = 0.0
+        state.serializer_seconds = 0.0
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(self.time_query))
+                response = self.get_response(request)
+        finally:
+            state.active = False
+        elapsed = time.perf_counter() - started
+
+        route, method = route_name(request), request.method
+        if response.streaming:
+            # The body has not run yet; its queries, and so the budget check, are settled once it is closed.
+            response.streaming_content = self.count_stream(response.streaming_content, route, method, state.queries)
+            response_bytes, over_budget = 0, False
+        else:
+            response_bytes = len(response.content)
+            over_budget = self.check_budget(route, method, state.queries)
+        metrics.registry.observe(route, method, elapsed, state.queries, state.db_seconds,
+                                 state.serializer_seconds, response_bytes, over_budget)
+        return response
+
+    def time_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            metrics.state.queries += 1
+            metrics.state.db_seconds += time.perf_counter() - started
+
+    def check_budget(self, route, method, queries):
+        budget = self.query_budgets.get(route, self.query_budget)
+        over_budget = budget is not None and queries > budget
+        if over_budget:
+            logger.warning('%s %s ran %d queries, over its budget of %d', method, route, queries, budget)
+        return over_budget
+
+    def count_stream(self, content, route, method, view_queries):
+        totals = {'queries': 0, 'db_seconds': 0.0}
+
+        def time_query(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                totals['queries'] += 1
+                totals['db_seconds'] += time.perf_counter() - started
+
+        total = 0
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(time_query))
+                for chunk in content:
+                    total += len(chunk)
+                    yield chunk
+        finally:
+            over_budget = self.check_budget(route, method, view_queries + totals['queries'])
+            metrics.registry.add_stream(route, method, total, totals['queries'], totals['db_seconds'], over_budget)
+
+
+class ReplicaRoutingMiddleware(object):
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routers.begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = routers.end()
+        if (wrote or request.method not in SAFE_METHODS) and routers.replica_alias() is not None:
+            routers.pin(request, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in ('GET', 'HEAD') or view_func.__module__ != 'api.views':
+            return None
+        alias = routers.replica_alias()
+        if alias is not None and not routers.is_pinned(request):
+            routers.begin(alias)
+        return None
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0005_auto_20190117_2313'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AchievementQueueEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('changed_fields', models.TextField(blank=True, null=True)),
+                ('enqueued_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
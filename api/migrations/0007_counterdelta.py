@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_achievementqueueentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CounterDelta',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('statistic', 'Statistic'), ('card', 'Taboo card')], max_length=16)),
+                ('object_id', models.IntegerField()),
+                ('field', models.CharField(max_length=64)),
+                ('delta', models.IntegerField()),
+            ],
+            options={
+                'index_together': {('kind', 'object_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:29
+
+from django.db import migrations, models
+
+
+def backfill_difficulty_bucket(apps, schema_editor):
+    TabooCard = apps.get_model('api', 'TabooCard')
+    TabooCard.objects.update(difficulty_bucket=models.Case(
+        models.When(times_shown=0, then=models.Value("NOT ENOUGH STATS")),
+        models.When(answered_correctly__lt=models.F('times_shown') * 0.25, then=models.Value("INSANE")),
+        models.When(answered_correctly__lt=models.F('times_shown') * 0.5, then=models.Value("HARD")),
+        models.When(answered_correctly__lt=models.F('times_shown') * 0.75, then=models.Value("MEDIUM")),
+        default=models.Value("EASY"),
+        output_field=models.CharField(),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_counterdelta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taboocard',
+            name='difficulty_bucket',
+            field=models.CharField(choices=[('NOT ENOUGH STATS', 'Not enough stats'), ('INSANE', 'Insane'), ('HARD', 'Hard'), ('MEDIUM', 'Medium'), ('EASY', 'Easy')], default='NOT ENOUGH STATS', max_length=16),
+        ),
+        migrations.AlterIndexTogether(
+            name='taboocard',
+            index_together={('language', 'difficulty_bucket')},
+        ),
+        migrations.RunPython(backfill_difficulty_bucket, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:32
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0008_taboocard_difficulty_bucket'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='taboocard',
+            index_together={('owner', 'language', 'key_word'), ('language', 'difficulty_bucket')},
+        ),
+    ]
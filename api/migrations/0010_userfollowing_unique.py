@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:35
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def remove_duplicate_followings(apps, schema_editor):
+    UserFollowing = apps.get_model('api', 'UserFollowing')
+    duplicates = (UserFollowing.objects.values('user', 'following')
+                  .annotate(keep=Min('id'), edges=Count('id')).filter(edges__gt=1))
+    for duplicate in duplicates.iterator():
+        (UserFollowing.objects.filter(user=duplicate['user'], following=duplicate['following'])
+         .exclude(pk=duplicate['keep']).delete())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0009_taboocard_owner_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_followings, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='userfollowing',
+            unique_together={('user', 'following')},
+        ),
+    ]
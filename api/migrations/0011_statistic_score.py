@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:37
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_score(apps, schema_editor):
+    Statistic = apps.get_model('api', 'Statistic')
+    Achievement = apps.get_model('api', 'Achievement')
+    scores = (Achievement.users.through.objects.filter(user_id=models.OuterRef('user_id'))
+              .order_by().values('user_id')
+              .annotate(total=models.Sum('achievement__score')).values('total'))
+    Statistic.objects.update(score=Coalesce(models.Subquery(scores, output_field=models.IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0010_userfollowing_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='statistic',
+            name='score',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterIndexTogether(
+            name='statistic',
+            index_together={('score', 'user')},
+        ),
+        migrations.RunPython(backfill_score, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0011_statistic_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardReview',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ease_factor', models.FloatField(default=2.5)),
+                ('interval', models.IntegerField(default=0)),
+                ('repetitions', models.IntegerField(default=0)),
+                ('lapses', models.IntegerField(default=0)),
+                ('due_at', models.DateTimeField()),
+                ('last_reviewed_at', models.DateTimeField(blank=True, null=True)),
+                ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reviews', to='api.TabooCard')),
+                ('language', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.Language')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='card_reviews', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'card')},
+                'index_together': {('user', 'language', 'due_at'), ('user', 'due_at')},
+            },
+        ),
+    ]
@@ -0,0 +1,129 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:49
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+SQLITE_FTS_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS api_taboocard_fts USING fts5("
+    "key_word, black_list, content='api_taboocard', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS api_taboocard_fts_insert AFTER INSERT ON api_taboocard BEGIN "
+    "INSERT INTO api_taboocard_fts(rowid, key_word, black_list) VALUES (new.id, new.key_word, new.black_list); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS api_taboocard_fts_delete AFTER DELETE ON api_taboocard BEGIN "
+    "INSERT INTO api_taboocard_fts(api_taboocard_fts, rowid, key_word, black_list) "
+    "VALUES ('delete', old.id, old.key_word, old.black_list); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS api_taboocard_fts_update AFTER UPDATE OF key_word, black_list ON api_taboocard "
+    "BEGIN "
+    "INSERT INTO api_taboocard_fts(api_taboocard_fts, rowid, key_word, black_list) "
+    "VALUES ('delete', old.id, old.key_word, old.black_list); "
+    "INSERT INTO api_taboocard_fts(rowid, key_word, black_list) VALUES (new.id, new.key_word, new.black_list); "
+    "END",
+    "INSERT INTO api_taboocard_fts(api_taboocard_fts) VALUES ('rebuild')",
+)
+
+SQLITE_DROP_FTS_SQL = (
+    "DROP TRIGGER IF EXISTS api_taboocard_fts_insert",
+    "DROP TRIGGER IF EXISTS api_taboocard_fts_delete",
+    "DROP TRIGGER IF EXISTS api_taboocard_fts_update",
+    "DROP TABLE IF EXISTS api_taboocard_fts",
+)
+
+POSTGRES_TRIGRAM_SQL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS api_taboocard_key_word_trgm "
+    "ON api_taboocard USING gin (UPPER(key_word) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS api_blacklistword_normalized_trgm "
+    "ON api_blacklistword USING gin (normalized gin_trgm_ops)",
+)
+
+POSTGRES_DROP_TRIGRAM_SQL = (
+    "DROP INDEX IF EXISTS api_taboocard_key_word_trgm",
+    "DROP INDEX IF EXISTS api_blacklistword_normalized_trgm",
+)
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', str(text or ''))
+    text = ''.join(character for character in text if not unicodedata.combining(character))
+    return re.sub(r'\s+', ' ', text).strip().casefold()
+
+
+def split_black_lists(apps, schema_editor):
+    TabooCard = apps.get_model('api', 'TabooCard')
+    BlackListWord = apps.get_model('api', 'BlackListWord')
+    words = []
+    for pk, black_list in TabooCard.objects.order_by('pk').values_list('pk', 'black_list').iterator(chunk_size=2000):
+        for position, word in enumerate(word.strip() for word in str(black_list or '').split(';') if word.strip()):
+            words.append(BlackListWord(card_id=pk, position=position, word=word[:128],
+                                       normalized=normalize(word)[:128]))
+        if len(words) >= 2000:
+            BlackListWord.objects.bulk_create(words, batch_size=500)
+            words = []
+    BlackListWord.objects.bulk_create(words, batch_size=500)
+
+
+def fts5_available(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.api_fts5_probe USING fts5(value)")
+            cursor.execute("DROP TABLE temp.api_fts5_probe")
+        except Exception:
+            return False
+    return True
+
+
+def trigram_available(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite' and fts5_available(schema_editor):
+        statements = SQLITE_FTS_SQL
+    elif vendor == 'postgresql' and trigram_available(schema_editor):
+        statements = POSTGRES_TRIGRAM_SQL
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    statements = {'sqlite': SQLITE_DROP_FTS_SQL, 'postgresql': POSTGRES_DROP_TRIGRAM_SQL}.get(vendor, ())
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_cardreview'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlackListWord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.SmallIntegerField()),
+                ('word', models.CharField(max_length=128)),
+                ('normalized', models.CharField(max_length=128)),
+                ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='forbidden_words', to='api.TabooCard')),
+            ],
+            options={
+                'ordering': ('card', 'position'),
+                'unique_together': {('card', 'position')},
+                'index_together': {('normalized', 'card')},
+            },
+        ),
+        migrations.RunPython(split_black_lists, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:52
+
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import migrations, models
+
+WHITESPACE = re.compile(r'\s+')
+
+SQLITE_FTS_TRIGGERS_SQL = (
+    "CREATE TRIGGER IF NOT EXISTS api_taboocard_fts_insert AFTER INSERT ON api_taboocard BEGIN "
+    "INSERT INTO api_taboocard_fts(rowid, key_word, black_list) VALUES (new.id, new.key_word, new.black_list); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS api_taboocard_fts_delete AFTER DELETE ON api_taboocard BEGIN "
+    "INSERT INTO api_taboocard_fts(api_taboocard_fts, rowid, key_word, black_list) "
+    "VALUES ('delete', old.id, old.key_word, old.black_list); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS api_taboocard_fts_update AFTER UPDATE OF key_word, black_list ON api_taboocard "
+    "BEGIN "
+    "INSERT INTO api_taboocard_fts(api_taboocard_fts, rowid, key_word, black_list) "
+    "VALUES ('delete', old.id, old.key_word, old.black_list); "
+    "INSERT INTO api_taboocard_fts(rowid, key_word, black_list) VALUES (new.id, new.key_word, new.black_list); "
+    "END",
+)
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', str(text or ''))
+    text = ''.join(character for character in text if not unicodedata.combining(character))
+    return WHITESPACE.sub(' ', text).strip().casefold()
+
+
+def restore_search_triggers(apps, schema_editor):
+    # SQLite rebuilds api_taboocard to alter it, which drops the full-text triggers added in 0013.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'api_taboocard_fts'")
+        if cursor.fetchone() is None:
+            return
+    for statement in SQLITE_FTS_TRIGGERS_SQL:
+        schema_editor.execute(statement)
+
+
+def backfill_normalized_key_words(apps, schema_editor):
+    TabooCard = apps.get_model('api', 'TabooCard')
+    last_pk = 0
+    while True:
+        rows = list(TabooCard.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'key_word')[:500])
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+        TabooCard.objects.filter(pk__in=[pk for pk, _ in rows]).update(normalized_key_word=models.Case(
+            *[models.When(pk=pk, then=models.Value(normalize(key_word)[:128])) for pk, key_word in rows],
+            default=models.F('normalized_key_word'), output_field=models.CharField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0013_blacklistword'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_search_triggers),
+        migrations.AddField(
+            model_name='taboocard',
+            name='normalized_key_word',
+            field=models.CharField(default='', editable=False, max_length=128),
+        ),
+        migrations.AlterIndexTogether(
+            name='taboocard',
+            index_together={('language', 'normalized_key_word'), ('owner', 'language', 'key_word'), ('language', 'difficulty_bucket')},
+        ),
+        migrations.RunPython(restore_search_triggers, migrations.RunPython.noop),
+        migrations.RunPython(backfill_normalized_key_words, migrations.RunPython.noop),
+    ]
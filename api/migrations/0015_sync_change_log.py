@@ -0,0 +1,81 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+SQLITE_FTS_TRIGGERS_SQL = (
+    "CREATE TRIGGER IF NOT EXISTS api_taboocard_fts_insert AFTER INSERT ON api_taboocard BEGIN "
+    "INSERT INTO api_taboocard_fts(rowid, key_word, black_list) VALUES (new.id, new.key_word, new.black_list); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS api_taboocard_fts_delete AFTER DELETE ON api_taboocard BEGIN "
+    "INSERT INTO api_taboocard_fts(api_taboocard_fts, rowid, key_word, black_list) "
+    "VALUES ('delete', old.id, old.key_word, old.black_list); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS api_taboocard_fts_update AFTER UPDATE OF key_word, black_list ON api_taboocard "
+    "BEGIN "
+    "INSERT INTO api_taboocard_fts(api_taboocard_fts, rowid, key_word, black_list) "
+    "VALUES ('delete', old.id, old.key_word, old.black_list); "
+    "INSERT INTO api_taboocard_fts(rowid, key_word, black_list) VALUES (new.id, new.key_word, new.black_list); "
+    "END",
+)
+
+
+def restore_search_triggers(apps, schema_editor):
+    # SQLite rebuilds api_taboocard to alter it, which drops the full-text triggers added in 0013.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'api_taboocard_fts'")
+        if cursor.fetchone() is None:
+            return
+    for statement in SQLITE_FTS_TRIGGERS_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0014_taboocard_normalized_key_word'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_search_triggers),
+        migrations.AddField(
+            model_name='achievement',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='language',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='taboocard',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(restore_search_triggers, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='userfollowing',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.CreateModel(
+            name='ChangeLogEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('card', 'Taboo card'), ('language', 'Language'), ('achievement', 'Achievement'), ('follow', 'Followed user')], max_length=16)),
+                ('object_id', models.IntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('changed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'index_together': {('kind', 'user', 'object_id')},
+            },
+        ),
+    ]
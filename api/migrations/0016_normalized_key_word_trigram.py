@@ -0,0 +1,39 @@
+from django.db import migrations
+
+POSTGRES_TRIGRAM_SQL = (
+    "DROP INDEX IF EXISTS api_taboocard_key_word_trgm",
+    "CREATE INDEX IF NOT EXISTS api_taboocard_normalized_key_word_trgm "
+    "ON api_taboocard USING gin (normalized_key_word gin_trgm_ops)",
+)
+
+POSTGRES_DROP_TRIGRAM_SQL = (
+    "DROP INDEX IF EXISTS api_taboocard_normalized_key_word_trgm",
+    "CREATE INDEX IF NOT EXISTS api_taboocard_key_word_trgm "
+    "ON api_taboocard USING gin (UPPER(key_word) gin_trgm_ops)",
+)
+
+
+def trigram_installed(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql' or not trigram_installed(schema_editor):
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_sync_change_log'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(POSTGRES_TRIGRAM_SQL), run(POSTGRES_DROP_TRIGRAM_SQL)),
+    ]
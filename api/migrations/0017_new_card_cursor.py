@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0016_normalized_key_word_trigram'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='taboocard',
+            index_together={('language', 'normalized_key_word'), ('owner', 'language', 'key_word'), ('language', 'id'), ('language', 'difficulty_bucket')},
+        ),
+        migrations.CreateModel(
+            name='NewCardCursor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('language_scope', models.IntegerField(default=0)),
+                ('last_card_id', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'language_scope')},
+            },
+        ),
+    ]
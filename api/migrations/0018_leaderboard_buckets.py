@@ -0,0 +1,55 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:27
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def populate(apps, schema_editor):
+    Statistic = apps.get_model('api', 'Statistic')
+    Language = apps.get_model('api', 'Language')
+    ScoreBucket = apps.get_model('api', 'ScoreBucket')
+    LanguageScore = apps.get_model('api', 'LanguageScore')
+    counts = (Statistic.objects.order_by().values('score').annotate(users=models.Count('pk'))
+              .values_list('score', 'users'))
+    ScoreBucket.objects.bulk_create([ScoreBucket(score=score, users=users) for score, users in counts])
+    scores = models.Subquery(Statistic.objects.filter(user_id=models.OuterRef('user_id')).values('score')[:1],
+                             output_field=models.IntegerField())
+    subscriptions = (Language.users.through.objects.annotate(score=Coalesce(scores, 0))
+                     .values_list('language_id', 'user_id', 'score'))
+    LanguageScore.objects.bulk_create([LanguageScore(language_id=language_id, user_id=user_id, score=score)
+                                       for language_id, user_id, score in subscriptions], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0017_new_card_cursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoreBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.IntegerField(unique=True)),
+                ('users', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LanguageScore',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.IntegerField(default=0)),
+                ('language', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.Language')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('language', 'user')},
+                'index_together': {('language', 'score', 'user')},
+            },
+        ),
+        migrations.RunPython(populate, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:31
+
+from django.conf import settings
+from django.db import migrations
+
+SQLITE_FTS_TRIGGERS_SQL = (
+    "CREATE TRIGGER IF NOT EXISTS api_taboocard_fts_insert AFTER INSERT ON api_taboocard BEGIN "
+    "INSERT INTO api_taboocard_fts(rowid, key_word, black_list) VALUES (new.id, new.key_word, new.black_list); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS api_taboocard_fts_delete AFTER DELETE ON api_taboocard BEGIN "
+    "INSERT INTO api_taboocard_fts(api_taboocard_fts, rowid, key_word, black_list) "
+    "VALUES ('delete', old.id, old.key_word, old.black_list); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS api_taboocard_fts_update AFTER UPDATE OF key_word, black_list ON api_taboocard "
+    "BEGIN "
+    "INSERT INTO api_taboocard_fts(api_taboocard_fts, rowid, key_word, black_list) "
+    "VALUES ('delete', old.id, old.key_word, old.black_list); "
+    "INSERT INTO api_taboocard_fts(rowid, key_word, black_list) VALUES (new.id, new.key_word, new.black_list); "
+    "END",
+)
+
+
+def restore_search_triggers(apps, schema_editor):
+    # SQLite rebuilds api_taboocard to alter it, which drops the full-text triggers added in 0013.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'api_taboocard_fts'")
+        if cursor.fetchone() is None:
+            return
+    for statement in SQLITE_FTS_TRIGGERS_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0018_leaderboard_buckets'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='achievement',
+            name='updated_at',
+        ),
+        migrations.RemoveField(
+            model_name='language',
+            name='updated_at',
+        ),
+        migrations.RunPython(migrations.RunPython.noop, restore_search_triggers),
+        migrations.RemoveField(
+            model_name='taboocard',
+            name='updated_at',
+        ),
+        migrations.RunPython(restore_search_triggers, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='userfollowing',
+            name='updated_at',
+        ),
+        migrations.AlterIndexTogether(
+            name='changelogentry',
+            index_together={('kind', 'user', 'object_id'), ('user', 'id')},
+        ),
+    ]
@@ -4,6 +4,9 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.dispatch import receiver
 from django.db.models.signals import post_save
+from django.utils import timezone
+
+from .text import normalize
 
 
 @receiver(post_save, sender=User)
@@ -46,11 +49,11 @@ class Achievement(models.Model):
         return str(self.name)
 
     def try_award_to(self, user):
-        has_achievement = self in user.achievements.all()
-        if has_achievement:
+        from .achievements import engine
+
+        if user.achievements.filter(pk=self.pk).exists():
             return False
-        condition_result = eval(str(self.condition))
-        if condition_result:
+        if engine.compile(self).matches(user):
             user.achievements.add(self)
             return True
         else:
@@ -61,6 +64,9 @@ class UserFollowing(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following')
     following = models.ForeignKey(User, on_delete=models.CASCADE, related_name='followed_by')
 
+    class Meta:
+        unique_together = (('user', 'following'),)
+
 
 class Statistic(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='statistics')
@@ -69,6 +75,10 @@ class Statistic(models.Model):
     correctly_ans_flashcards = models.IntegerField(default=0)
     ans_flashcards = models.IntegerField(default=0)
     translated_words = models.IntegerField(default=0)
+    score = models.IntegerField(default=0)
+
+    class Meta:
+        index_together = (('score', 'user'),)
 
     @property
     def taboo_efficiency(self):
@@ -78,13 +88,53 @@ class Statistic(models.Model):
             return 0
 
 
+class ScoreBucket(models.Model):
+    score = models.IntegerField(unique=True)
+    users = models.IntegerField(default=0)
+
+
+class LanguageScore(models.Model):
+    language = models.ForeignKey(Language, on_delete=models.CASCADE, related_name='+')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    score = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('language', 'user'),)
+        index_together = (('language', 'score', 'user'),)
+
+
+def difficulty_expression():
+    return models.Case(
+        models.When(times_shown=0, then=models.Value("NOT ENOUGH STATS")),
+        models.When(answered_correctly__lt=models.F('times_shown') * 0.25, then=models.Value("INSANE")),
+        models.When(answered_correctly__lt=models.F('times_shown') * 0.5, then=models.Value("HARD")),
+        models.When(answered_correctly__lt=models.F('times_shown') * 0.75, then=models.Value("MEDIUM")),
+        default=models.Value("EASY"),
+        output_field=models.CharField(),
+    )
+
+
 class TabooCard(models.Model):
+    DIFFICULTY_CHOICES = (
+        ("NOT ENOUGH STATS", "Not enough stats"),
+        ("INSANE", "Insane"),
+        ("HARD", "Hard"),
+        ("MEDIUM", "Medium"),
+        ("EASY", "Easy"),
+    )
+
     key_word = models.CharField(max_length=128)
     black_list = models.CharField(max_length=2048)
     owner = models.ForeignKey(User, on_delete=models.DO_NOTHING, related_name='cards')
     language = models.ForeignKey(Language, on_delete=models.DO_NOTHING, related_name='cards')
     times_shown = models.IntegerField(default=0)
     answered_correctly = models.IntegerField(default=0)
+    difficulty_bucket = models.CharField(max_length=16, choices=DIFFICULTY_CHOICES, default="NOT ENOUGH STATS")
+    normalized_key_word = models.CharField(max_length=128, default='', editable=False)
+
+    class Meta:
+        index_together = (('language', 'difficulty_bucket'), ('owner', 'language', 'key_word'),
+                          ('language', 'normalized_key_word'), ('language', 'id'))
 
     @property
     def difficulty(self):
@@ -107,21 +157,101 @@ class TabooCard(models.Model):
         else:
             return 0
 
+    def save(self, *args, **kwargs):
+        self.difficulty_bucket = self.difficulty
+        self.normalized_key_word = normalize(self.key_word)[:128]
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'difficulty_bucket', 'normalized_key_word'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return str(self.pk) + ' | ' + str(self.key_word) + ' | ' + str(self.language.language_code)
 
 
-@receiver(post_save, sender=Statistic)
-@receiver(post_save, sender=UserFollowing)
-@receiver(post_save, sender=User)
-def trigger_achievements_after_statistics_save(sender, instance=None, created=False, **kwargs):
-    if isinstance(instance, User):
-        if not created:
-            grant_achievements(instance)
-    else:
-        grant_achievements(instance.user)
+class BlackListWord(models.Model):
+    card = models.ForeignKey(TabooCard, on_delete=models.CASCADE, related_name='forbidden_words')
+    position = models.SmallIntegerField()
+    word = models.CharField(max_length=128)
+    normalized = models.CharField(max_length=128)
+
+    class Meta:
+        ordering = ('card', 'position')
+        unique_together = (('card', 'position'),)
+        index_together = (('normalized', 'card'),)
+
+    def __str__(self):
+        return str(self.word)
+
+
+class AchievementQueueEntry(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    changed_fields = models.TextField(null=True, blank=True)
+    enqueued_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class CounterDelta(models.Model):
+    STATISTIC = 'statistic'
+    CARD = 'card'
+    KIND_CHOICES = (
+        (STATISTIC, "Statistic"),
+        (CARD, "Taboo card"),
+    )
+
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    field = models.CharField(max_length=64)
+    delta = models.IntegerField()
+
+    class Meta:
+        index_together = (('kind', 'object_id'),)
+
+
+class CardReview(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='card_reviews')
+    card = models.ForeignKey(TabooCard, on_delete=models.CASCADE, related_name='reviews')
+    language = models.ForeignKey(Language, on_delete=models.CASCADE, related_name='+')
+    ease_factor = models.FloatField(default=2.5)
+    interval = models.IntegerField(default=0)
+    repetitions = models.IntegerField(default=0)
+    lapses = models.IntegerField(default=0)
+    due_at = models.DateTimeField()
+    last_reviewed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = (('user', 'card'),)
+        index_together = (('user', 'due_at'), ('user', 'language', 'due_at'))
+
+
+class NewCardCursor(models.Model):
+    ALL_LANGUAGES = 0
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    language_scope = models.IntegerField(default=ALL_LANGUAGES)
+    last_card_id = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('user', 'language_scope'),)
+
+
+class ChangeLogEntry(models.Model):
+    CARD = 'card'
+    LANGUAGE = 'language'
+    ACHIEVEMENT = 'achievement'
+    FOLLOW = 'follow'
+    KIND_CHOICES = (
+        (CARD, "Taboo card"),
+        (LANGUAGE, "Language"),
+        (ACHIEVEMENT, "Achievement"),
+        (FOLLOW, "Followed user"),
+    )
 
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    deleted = models.BooleanField(default=False)
+    changed_at = models.DateTimeField(default=timezone.now, db_index=True)
 
-def grant_achievements(user):
-    for achievement in Achievement.objects.all():
-        achievement.try_award_to(user)
+    class Meta:
+        index_together = (('kind', 'user', 'object_id'), ('user', 'id'))
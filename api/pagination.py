@@ -0,0 +1,154 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import replace_query_param
+
+DEFAULT_ORDERING = ('id',)
+
+
+def keyset_ordering(view):
+    return getattr(view, 'keyset_ordering', DEFAULT_ORDERING)
+
+
+def keyset_filter(ordering, position):
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, position):
+        name = field.lstrip('-')
+        lookup = '%s__lt' % name if field.startswith('-') else '%s__gt' % name
+        condition |= equal & Q(**{lookup: value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def keyset_position(obj, ordering):
+    return [getattr(obj, field.lstrip('-')) for field in ordering]
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(json.dumps(position, cls=JSONEncoder).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError):
+        raise NotFound('Invalid cursor')
+
+
+class KeysetPagination(BasePagination):
+    page_size = 50
+    max_page_size = 500
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+
+    def is_requested(self, request):
+        return (self.cursor_query_param in request.query_params
+                or self.page_size_query_param in request.query_params)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            page_size = self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+
+        self.request = request
+        self.ordering = keyset_ordering(view)
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            position = decode_cursor(cursor)
+            if len(position) != len(self.ordering):
+                raise NotFound('Invalid cursor')
+            queryset = queryset.filter(keyset_filter(self.ordering, position))
+
+        rows = list(queryset[:page_size + 1])
+        page = rows[:page_size]
+        self.next_position = keyset_position(page[-1], self.ordering) if len(rows) > page_size else None
+        return page
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+
+def iterate_chunks(queryset, ordering, chunk_size):
+    queryset = queryset.order_by(*ordering)
+    if not queryset._prefetch_related_lookups:
+        chunk = []
+        for obj in queryset.iterator(chunk_size=chunk_size):
+            chunk.append(obj)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+        return
+
+    position = None
+    while True:
+        page = queryset if position is None else queryset.filter(keyset_filter(ordering, position))
+        chunk = list(page[:chunk_size])
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            return
+        position = keyset_position(chunk[-1], ordering)
+
+
+class StreamingListMixin(object):
+    stream_query_param = 'stream'
+    stream_chunk_size = 500
+
+    def list(self, request, *args, **kwargs):
+        stream_format = request.query_params.get(self.stream_query_param)
+        if stream_format in ('json', 'ndjson'):
+            return self.stream_list(stream_format)
+        return super().list(request, *args, **kwargs)
+
+    def stream_list(self, stream_format):
+        queryset = self.filter_queryset(self.get_queryset())
+        chunks = iterate_chunks(queryset, keyset_ordering(self), self.stream_chunk_size)
+        encoder = JSONEncoder()
+
+        def serialized_rows():
+            for chunk in chunks:
+                for row in self.get_serializer(chunk, many=True).data:
+                    yield encoder.encode(row)
+
+        def ndjson():
+            for row in serialized_rows():
+                yield row + '\n'
+
+        def json_array():
+            separator = '['
+            for row in serialized_rows():
+                yield separator + row
+                separator = ','
+            yield ']' if separator == ',' else '[]'
+
+        if stream_format == 'ndjson':
+            return StreamingHttpResponse(ndjson(), content_type='application/x-ndjson')
+        return StreamingHttpResponse(json_array(), content_type='application/json')
@@ -0,0 +1,198 @@
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+from django.utils.cache import patch_vary_headers
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .caching import bump_version, get_version
+from .follows import following_namespace
+from .languages import LANGUAGES_NAMESPACE, user_namespace
+from .models import Achievement, Language, TabooCard
+
+BACKEND_ALIASES = {
+    'lru': 'api.response_cache.LRUBackend',
+    'django': 'api.response_cache.DjangoCacheBackend',
+}
+
+LANGUAGES = LANGUAGES_NAMESPACE
+ACHIEVEMENTS = 'responses:achievements'
+AWARDS = 'responses:awards'
+CARDS = 'responses:cards'
+USERS = 'responses:users'
+
+
+def follows_of_requester(request):
+    return following_namespace(request.user.pk)
+
+
+def languages_of_requester(request):
+    return user_namespace(request.user)
+
+
+class LRUBackend(object):
+    def __init__(self, options):
+        self.max_entries = options.get('MAX_ENTRIES', 1000)
+        self.timeout = options.get('TIMEOUT', 300)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DjangoCacheBackend(object):
+    def __init__(self, options):
+        self.cache = caches[options.get('CACHE', 'default')]
+        self.timeout = options.get('TIMEOUT', 300)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            options = dict(getattr(settings, 'RESPONSE_CACHE', {}))
+            path = options.get('BACKEND', 'lru')
+            _backend = import_string(BACKEND_ALIASES.get(path, path))(options)
+        return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(setting, **kwargs):
+    global _backend
+    if setting == 'RESPONSE_CACHE':
+        with _backend_lock:
+            _backend = None
+
+
+def response_key(request, namespaces):
+    parts = [request.method, request.path]
+    parts += ['%s=%s' % (name, value) for name, value in sorted(request.query_params.lists())]
+    parts.append('user=%s' % (request.user.pk if request.user.is_authenticated else ''))
+    parts += ['%s@%s' % (namespace, get_version(namespace)) for namespace in namespaces]
+    return 'response:%s' % hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def entity_tag(data):
+    content = JSONEncoder(sort_keys=True).encode(data).encode('utf-8')
+    return '"%s"' % hashlib.sha1(content).hexdigest()
+
+
+def matches_etag(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+
+
+def cache_response(*namespaces, condition=None):
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            if condition is not None and not condition(request):
+                return handler(view, request, *args, **kwargs)
+
+            resolved = [namespace(request) if callable(namespace) else namespace for namespace in namespaces]
+            key = response_key(request, resolved)
+            backend = get_backend()
+            entry = backend.get(key)
+            if entry is None:
+                response = handler(view, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                entry = (entity_tag(response.data), response.data)
+                backend.set(key, entry)
+            else:
+                response = None
+
+            etag, data = entry
+            if matches_etag(request, etag):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            elif response is None:
+                response = Response(data)
+            response['ETag'] = etag
+            patch_vary_headers(response, ('Authorization', 'Cookie'))
+            return response
+        return wrapper
+    return decorator
+
+
+@receiver(post_save, sender=Achievement)
+@receiver(post_delete, sender=Achievement)
+def invalidate_achievement_responses(sender, **kwargs):
+    bump_version(ACHIEVEMENTS)
+
+
+def invalidate_awards():
+    bump_version(AWARDS)
+
+
+@receiver(m2m_changed, sender=Achievement.users.through)
+def invalidate_award_responses(sender, action=None, **kwargs):
+    if action.startswith('post_'):
+        invalidate_awards()
+
+
+def invalidate_cards():
+    bump_version(CARDS)
+
+
+@receiver(post_save, sender=TabooCard)
+@receiver(post_delete, sender=TabooCard)
+def invalidate_card_responses(sender, **kwargs):
+    invalidate_cards()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_responses(sender, **kwargs):
+    bump_version(USERS)
+
+
+@receiver(m2m_changed, sender=Language.users.through)
+def invalidate_subscription_responses(sender, action=None, **kwargs):
+    if action.startswith('post_'):
+        bump_version(USERS)
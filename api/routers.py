@@ -0,0 +1,81 @@
+import hashlib
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .caching import get_cache, is_shared
+from .db_connections import connection_options
+
+state = threading.local()
+
+
+def replica_alias():
+    options = connection_options()
+    if options['REPLICA_READS'] and options['REPLICA'] in settings.DATABASES:
+        return options['REPLICA']
+    return None
+
+
+PIN_COOKIE = 'db_pinned'
+PIN_SALT = 'api.routers.pin'
+
+
+def caller(request):
+    identity = (request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME) or
+                request.META.get('REMOTE_ADDR', ''))
+    return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+
+def pin_key(request):
+    return 'db-pin:%s' % caller(request)
+
+
+def pin(request, response):
+    seconds = connection_options()['PIN_SECONDS']
+    response.set_signed_cookie(PIN_COOKIE, caller(request), salt=PIN_SALT, max_age=seconds, httponly=True)
+    cache = get_cache()
+    if is_shared(cache):
+        cache.set(pin_key(request), True, seconds)
+
+
+def is_pinned(request):
+    pinned_caller = request.get_signed_cookie(PIN_COOKIE, default=None, salt=PIN_SALT,
+                                              max_age=connection_options()['PIN_SECONDS'])
+    if pinned_caller == caller(request):
+        return True
+    cache = get_cache()
+    return is_shared(cache) and bool(cache.get(pin_key(request)))
+
+
+def begin(alias=None):
+    state.replica = alias
+    state.wrote = False
+
+
+def end():
+    wrote = getattr(state, 'wrote', False)
+    begin()
+    return wrote
+
+
+class PrimaryReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        return getattr(state, 'replica', None) or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if getattr(state, 'replica', None):
+            state.replica = None
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, connection_options()['REPLICA']}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == connection_options()['REPLICA']:
+            return False
+        return None
@@ -0,0 +1,176 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import snapshot
+from .models import Language, TabooCard
+
+ALL_LANGUAGES = None
+BUCKETS = frozenset(bucket for bucket, _ in TabooCard.DIFFICULTY_CHOICES)
+
+
+class DenseIndex(object):
+    def __init__(self, ids):
+        self.ids = list(ids)
+        self.positions = {pk: position for position, pk in enumerate(self.ids)}
+        self.built_at = time.monotonic()
+
+    def __contains__(self, pk):
+        return pk in self.positions
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, pk):
+        if pk not in self.positions:
+            self.positions[pk] = len(self.ids)
+            self.ids.append(pk)
+
+    def remove(self, pk):
+        position = self.positions.pop(pk, None)
+        if position is None:
+            return
+        last = self.ids.pop()
+        if position < len(self.ids):
+            self.ids[position] = last
+            self.positions[last] = position
+
+    def sample(self, k, rng, exclude=frozenset()):
+        k = min(k, len(self.ids))
+        if not exclude:
+            return rng.sample(self.ids, k)
+
+        picked, seen = [], set()
+        attempts = 4 * k + 32
+        while len(picked) < k and attempts:
+            attempts -= 1
+            pk = self.ids[rng.randrange(len(self.ids))]
+            if pk not in exclude and pk not in seen:
+                seen.add(pk)
+                picked.append(pk)
+        if len(picked) < k:
+            remaining = [pk for pk in self.ids if pk not in exclude and pk not in seen]
+            picked.extend(rng.sample(remaining, min(k - len(picked), len(remaining))))
+        return picked
+
+
+class CardSampler(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+
+    @property
+    def refresh_seconds(self):
+        return getattr(settings, 'CARD_SAMPLER_REFRESH_SECONDS', 300)
+
+    @property
+    def max_indexes(self):
+        return getattr(settings, 'CARD_SAMPLER_MAX_INDEXES', 256)
+
+    @staticmethod
+    def _covers(key, card):
+        language_id, bucket = key if isinstance(key, tuple) else (key, None)
+        return ((language_id is ALL_LANGUAGES or language_id == card.language_id)
+                and (bucket is None or bucket == card.difficulty_bucket))
+
+    def _index(self, language_id, bucket=None):
+        if bucket is not None and bucket not in BUCKETS:
+            return DenseIndex(())
+        key = language_id if bucket is None else (language_id, bucket)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None and time.monotonic() - index.built_at < self.refresh_seconds:
+                self._indexes.move_to_end(key)
+                return index
+
+        cards = TabooCard.objects.order_by('pk')
+        if language_id is not ALL_LANGUAGES:
+            cards = cards.filter(language_id=language_id)
+        if bucket is not None:
+            cards = cards.filter(difficulty_bucket=bucket)
+        index = DenseIndex(cards.values_list('pk', flat=True))
+        if not index and language_id is not ALL_LANGUAGES and not Language.objects.filter(pk=language_id).exists():
+            return index
+        with self._lock:
+            self._indexes[key] = index
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+        return index
+
+    def invalidate(self, language_id=ALL_LANGUAGES):
+        with self._lock:
+            if language_id is ALL_LANGUAGES:
+                self._indexes.clear()
+                return
+            for key in list(self._indexes):
+                scope = key[0] if isinstance(key, tuple) else key
+                if scope is ALL_LANGUAGES or scope == language_id:
+                    del self._indexes[key]
+
+    def add(self, card):
+        with self._lock:
+            for key, index in self._indexes.items():
+                if self._covers(key, card):
+                    index.add(card.pk)
+                else:
+                    index.remove(card.pk)
+
+    def remove(self, card):
+        with self._lock:
+            for index in self._indexes.values():
+                index.remove(card.pk)
+
+    def sample_ids(self, language_id, k, seed=None, exclude=frozenset(), bucket=None):
+        rng = random.Random(seed) if seed is not None else random
+        index = self._index(language_id, bucket)
+        with self._lock:
+            return index.sample(k, rng, exclude)
+
+    def sample(self, language_id, k, seed=None, exclude=frozenset(), bucket=None):
+        ids = self.sample_ids(language_id, k, seed, exclude, bucket)
+        cards = TabooCard.objects.filter(pk__in=ids).select_related('language', 'owner').in_bulk()
+        return [cards[pk] for pk in ids if pk in cards]
+
+
+sampler = CardSampler()
+
+
+def card_source():
+    return snapshot.current() or sampler
+
+
+def seen_cache():
+    return caches[getattr(settings, 'CARD_SAMPLER_CACHE', 'default')]
+
+
+def seen_key(user, session):
+    return 'card-sampler:seen:%s:%s' % (user.pk, session)
+
+
+def sample_cards(user, language_id, k, seed=None, exclude=(), session=None):
+    exclude = set(exclude)
+    if session:
+        exclude.update(seen_cache().get(seen_key(user, session), ()))
+    cards = card_source().sample(language_id, k, seed=seed, exclude=exclude)
+    if session:
+        seen = exclude | {card.pk for card in cards}
+        seen_cache().set(seen_key(user, session), seen,
+                         getattr(settings, 'CARD_SAMPLER_SESSION_TIMEOUT', 3600))
+    return cards
+
+
+@receiver(post_save, sender=TabooCard)
+def add_card_to_sampler(sender, instance=None, **kwargs):
+    sampler.add(instance)
+
+
+@receiver(post_delete, sender=TabooCard)
+def remove_card_from_sampler(sender, instance=None, **kwargs):
+    sampler.remove(instance)
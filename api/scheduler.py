@@ -0,0 +1,155 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Exists, F, OuterRef, Value, When
+from django.db.models import DateTimeField, FloatField, IntegerField
+from django.utils import timezone
+
+from .models import CardReview, NewCardCursor, TabooCard
+
+CORRECT_QUALITY = 4
+INCORRECT_QUALITY = 2
+MINIMUM_EASE_FACTOR = 1.3
+
+
+def scheduler_options():
+    return dict({'MAX_DUE_CARDS': 50, 'DEFAULT_DUE_CARDS': 15},
+                **getattr(settings, 'FLASHCARD_SCHEDULER', {}))
+
+
+def schedule(ease_factor, interval, repetitions, lapses, correct, now):
+    quality = CORRECT_QUALITY if correct else INCORRECT_QUALITY
+    if correct:
+        if repetitions == 0:
+            interval = 1
+        elif repetitions == 1:
+            interval = 6
+        else:
+            interval = int(round(interval * ease_factor))
+        repetitions += 1
+    else:
+        interval = 1
+        repetitions = 0
+        lapses += 1
+    ease_factor = max(MINIMUM_EASE_FACTOR,
+                      ease_factor + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return {
+        'ease_factor': ease_factor,
+        'interval': interval,
+        'repetitions': repetitions,
+        'lapses': lapses,
+        'due_at': now + timedelta(days=interval),
+        'last_reviewed_at': now,
+    }
+
+
+FIELD_TYPES = {
+    'ease_factor': FloatField(),
+    'interval': IntegerField(),
+    'repetitions': IntegerField(),
+    'lapses': IntegerField(),
+    'due_at': DateTimeField(),
+    'last_reviewed_at': DateTimeField(),
+}
+
+
+def outcomes(data):
+    results = {pk: True for pk in data.get('correctly_ans_flashcards', [])}
+    results.update({pk: False for pk in data.get('incorrectly_ans_flashcards', [])})
+    return results
+
+
+def _record(user, results, now):
+    reviews = {review.card_id: review for review in
+               CardReview.objects.filter(user=user, card_id__in=list(results))}
+    missing = [pk for pk in results if pk not in reviews]
+    languages = dict(TabooCard.objects.filter(pk__in=missing).values_list('pk', 'language_id')) if missing else {}
+
+    changes = {}
+    for card_id, review in reviews.items():
+        changes[review.pk] = schedule(review.ease_factor, review.interval, review.repetitions, review.lapses,
+                                      results[card_id], now)
+    if changes:
+        CardReview.objects.filter(pk__in=list(changes)).update(**{
+            field: Case(*[When(pk=pk, then=Value(values[field], output_field=output_field))
+                          for pk, values in changes.items()],
+                        default=F(field), output_field=output_field)
+            for field, output_field in FIELD_TYPES.items()})
+
+    created = [CardReview(user=user, card_id=card_id, language_id=language_id,
+                          **schedule(2.5, 0, 0, 0, results[card_id], now))
+               for card_id, language_id in languages.items()]
+    if created:
+        CardReview.objects.bulk_create(created)
+    return len(changes) + len(created)
+
+
+def record_reviews(user, data, now=None):
+    results = outcomes(data)
+    if not results:
+        return 0
+    now = now or timezone.now()
+    try:
+        with transaction.atomic():
+            return _record(user, results, now)
+    except IntegrityError:
+        with transaction.atomic():
+            return _record(user, results, now)
+
+
+def due_count(count=None):
+    options = scheduler_options()
+    try:
+        count = int(count or options['DEFAULT_DUE_CARDS'])
+    except ValueError:
+        count = options['DEFAULT_DUE_CARDS']
+    return max(1, min(count, options['MAX_DUE_CARDS']))
+
+
+def advance_cursor(user, scope, cursor, last_card_id):
+    if cursor is None:
+        try:
+            with transaction.atomic():
+                NewCardCursor.objects.create(user=user, language_scope=scope, last_card_id=last_card_id)
+            return
+        except IntegrityError:
+            pass
+    NewCardCursor.objects.filter(user=user, language_scope=scope, last_card_id__lt=last_card_id) \
+        .update(last_card_id=last_card_id)
+
+
+def new_cards(user, count, language_id=None):
+    scope = language_id or NewCardCursor.ALL_LANGUAGES
+    cursor = (NewCardCursor.objects.filter(user=user, language_scope=scope)
+              .values_list('last_card_id', flat=True).first())
+    start = cursor or 0
+
+    candidates = TabooCard.objects.filter(pk__gt=start)
+    if language_id:
+        candidates = candidates.filter(language_id=language_id)
+    unseen = list(candidates.annotate(reviewed=Exists(CardReview.objects.filter(user=user, card=OuterRef('pk'))))
+                  .filter(reviewed=False).select_related('language').order_by('pk')[:count])
+
+    # Every card between the cursor and the first unseen one has been reviewed, so the next call can seek past them.
+    if unseen:
+        reached = unseen[0].pk - 1
+    else:
+        reached = candidates.order_by('-pk').values_list('pk', flat=True).first() or start
+    if reached > start:
+        advance_cursor(user, scope, cursor, reached)
+    return unseen
+
+
+def due_cards(user, count=None, language_id=None, include_new=True, now=None):
+    count = due_count(count)
+    now = now or timezone.now()
+
+    reviews = CardReview.objects.filter(user=user, due_at__lte=now)
+    if language_id:
+        reviews = reviews.filter(language_id=language_id)
+    cards = [review.card for review in reviews.select_related('card__language').order_by('due_at')[:count]]
+
+    if include_new and len(cards) < count:
+        cards += new_cards(user, count - len(cards), language_id)
+    return cards
@@ -0,0 +1,86 @@
+import threading
+
+from django.db import connections
+from django.db.models import BooleanField, Exists, OuterRef, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import BlackListWord, TabooCard
+from .text import normalize, split_black_list
+
+FTS_TABLE = 'api_taboocard_fts'
+WORD_LENGTH = BlackListWord._meta.get_field('word').max_length
+
+
+def words_for(cards):
+    return [BlackListWord(card_id=card.pk, position=position, word=word[:WORD_LENGTH],
+                          normalized=normalize(word)[:WORD_LENGTH])
+            for card in cards
+            for position, word in enumerate(split_black_list(card.black_list))]
+
+
+def replace_words(cards):
+    cards = [card for card in cards if card.pk is not None]
+    BlackListWord.objects.filter(card_id__in=[card.pk for card in cards]).delete()
+    BlackListWord.objects.bulk_create(words_for(cards))
+
+
+@receiver(post_save, sender=TabooCard)
+def index_black_list(sender, instance=None, created=False, update_fields=None, **kwargs):
+    if update_fields is not None and 'black_list' not in update_fields:
+        return
+    if created:
+        BlackListWord.objects.bulk_create(words_for([instance]))
+    else:
+        replace_words([instance])
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def search_backend(alias):
+    with _backends_lock:
+        if alias in _backends:
+            return _backends[alias]
+
+    connection = connections[alias]
+    backend = 'words'
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            if cursor.fetchone() is not None:
+                backend = 'fts5'
+        elif connection.vendor == 'postgresql':
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            if cursor.fetchone() is not None:
+                backend = 'trigram'
+
+    with _backends_lock:
+        _backends[alias] = backend
+    return backend
+
+
+def fts_query(term):
+    return ' '.join('"%s"*' % token.replace('"', '""') for token in term.split())
+
+
+def search_cards(queryset, term):
+    term = normalize(term)
+    if not term:
+        return queryset
+
+    backend = search_backend(queryset.db)
+    if backend == 'fts5':
+        match = RawSQL('"%s"."id" IN (SELECT rowid FROM %s WHERE %s MATCH %%s)'
+                       % (TabooCard._meta.db_table, FTS_TABLE, FTS_TABLE),
+                       [fts_query(term)], output_field=BooleanField())
+        return queryset.annotate(search_match=match).filter(search_match=True)
+
+    if backend == 'trigram':
+        words = BlackListWord.objects.filter(card=OuterRef('pk'), normalized__contains=term)
+    else:
+        words = BlackListWord.objects.filter(card=OuterRef('pk'), normalized__startswith=term)
+    return (queryset.annotate(forbidden_word_match=Exists(words))
+            .filter(Q(normalized_key_word__contains=term) | Q(forbidden_word_match=True)))
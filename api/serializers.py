@@ -1,22 +1,28 @@
 from django.contrib.auth.models import User
-from django.db.models import Sum
+from django.db import models
 from rest_framework import serializers
+from . import counters
+from .metrics import TimedListSerializer, TimedSerializerMixin
 from .models import Language, Achievement, Statistic, TabooCard
 
 
-class AchievementBaseSerializer(serializers.ModelSerializer):
+class TimedModelSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    pass
+
+
+class AchievementBaseSerializer(TimedModelSerializer):
     class Meta:
         model = Achievement
         fields = ('id', 'name', 'font_awesome_icon', 'level', 'score')
 
 
-class StatisticSerializer(serializers.ModelSerializer):
+class StatisticSerializer(TimedModelSerializer):
     class Meta:
         model = Statistic
         fields = ('correctly_swiped_taboo_cards', 'translated_words')
 
 
-class UserBaseSerializer(serializers.ModelSerializer):
+class UserBaseSerializer(TimedModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'username', 'first_name', 'last_name', 'email', 'password')
@@ -25,14 +31,14 @@ class UserBaseSerializer(serializers.ModelSerializer):
                         'last_name': {'read_only': True}}
 
 
-class LanguageMiniSerializer(serializers.ModelSerializer):
+class LanguageMiniSerializer(TimedModelSerializer):
     class Meta:
         model = Language
         fields = ('id', 'name', 'language_code')
         ordering = ('name', )
 
 
-class LanguageSerializer(serializers.ModelSerializer):
+class LanguageSerializer(TimedModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -41,18 +47,29 @@ class LanguageSerializer(serializers.ModelSerializer):
         ordering = ('name', )
 
     def get_is_subscribed(self, obj):
+        subscribed_language_ids = self.context.get("subscribed_language_ids")
+        if subscribed_language_ids is not None:
+            return obj.pk in subscribed_language_ids
+
         user = None
         request = self.context.get("request")
         if request and hasattr(request, "user"):
             user = request.user
 
-        if user in obj.users.all():
-            return True
+        if user and user.is_authenticated:
+            return obj.users.filter(pk=user.pk).exists()
         else:
             return False
 
 
-class UserAchievementSerializer(serializers.ModelSerializer):
+class LanguageListSerializer(LanguageSerializer):
+    subscriber_count = serializers.IntegerField(read_only=True)
+
+    class Meta(LanguageSerializer.Meta):
+        fields = LanguageSerializer.Meta.fields + ('subscriber_count',)
+
+
+class UserAchievementSerializer(TimedModelSerializer):
     achievements = AchievementBaseSerializer(many=True, read_only=True)
     is_friend = serializers.SerializerMethodField()
     selected_languages = LanguageSerializer(many=True, read_only=True)
@@ -66,27 +83,25 @@ class UserAchievementSerializer(serializers.ModelSerializer):
         ordering = ('username', 'first_name', 'last_name')
 
     def get_overall_score(self, obj):
-        return obj.achievements.all().aggregate(Sum('score'))
+        return {'score__sum': obj.statistics.score}
 
     def get_is_friend(self, obj):
+        following_ids = self.context.get("following_ids")
+        if following_ids is not None:
+            return obj.pk in following_ids
+
         user = None
         request = self.context.get("request")
         if request and hasattr(request, "user"):
             user = request.user
 
-        if user:
-            followings = []
-            for follow in user.following.all():
-                followings.append(follow.following)
-            if obj in followings:
-                return True
-            else:
-                return False
+        if user and user.is_authenticated:
+            return user.following.filter(following=obj).exists()
         else:
             return False
 
 
-class UserFullSerializer(serializers.ModelSerializer):
+class UserFullSerializer(TimedModelSerializer):
     achievements = AchievementBaseSerializer(many=True, read_only=True)
     selected_languages = LanguageSerializer(many=True, read_only=True)
     following = serializers.SerializerMethodField()
@@ -107,17 +122,39 @@ class UserFullSerializer(serializers.ModelSerializer):
                   'achievements', 'selected_languages', 'following')
 
     def get_overall_score(self, obj):
-        return obj.achievements.all().aggregate(Sum('score'))
+        return {'score__sum': obj.statistics.score}
 
     def get_following(self, obj):
         followings = []
-        for follow in obj.following.all():
+        for follow in obj.following.select_related('following').order_by('id'):
             followings.append(follow.following)
         serializer = UserBaseSerializer(followings, many=True)
         return serializer.data
 
-
-class TabooCardSerializer(serializers.ModelSerializer):
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        pending = counters.pending_statistics(instance.pk)
+        if pending:
+            for field, delta in pending.items():
+                if field in data:
+                    data[field] += delta
+            statistic = Statistic(swiped_taboo_cards=int(data['swiped_taboo_cards']),
+                                  correctly_swiped_taboo_cards=int(data['correctly_swiped_taboo_cards']))
+            data['taboo_efficiency'] = float(statistic.taboo_efficiency)
+        return data
+
+
+class PendingCardCountersListSerializer(TimedListSerializer):
+    def to_representation(self, data):
+        cards = list(data.all() if isinstance(data, models.Manager) else data)
+        self.child.pending_counters = counters.pending_cards([card.pk for card in cards])
+        try:
+            return super().to_representation(cards)
+        finally:
+            self.child.pending_counters = None
+
+
+class TabooCardSerializer(TimedModelSerializer):
     black_list = serializers.SerializerMethodField()
     difficulty = serializers.CharField(read_only=True)
     owner = serializers.ReadOnlyField(source='owner.username')
@@ -129,12 +166,43 @@ class TabooCardSerializer(serializers.ModelSerializer):
         fields = ('id', 'key_word', 'black_list', 'card_efficiency',
                   'difficulty', 'owner', 'language',
                   'times_shown', 'answered_correctly')
+        list_serializer_class = PendingCardCountersListSerializer
 
     def get_black_list(self, obj):
+        words = getattr(obj, 'black_list_words', None)
+        if words is not None:
+            return words
         return str(obj.black_list).split(';')
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        pending = getattr(self, 'pending_counters', None)
+        if pending is None:
+            pending = counters.pending_cards([instance.pk])
+        if instance.pk in pending:
+            shown, answered = pending[instance.pk]
+            card = TabooCard(times_shown=instance.times_shown + shown,
+                             answered_correctly=instance.answered_correctly + answered)
+            data['times_shown'] = card.times_shown
+            data['answered_correctly'] = card.answered_correctly
+            data['card_efficiency'] = float(card.card_efficiency)
+            data['difficulty'] = card.difficulty
+        return data
+
+
+class LeaderboardEntrySerializer(TimedModelSerializer):
+    rank = serializers.IntegerField(read_only=True)
+    id = serializers.IntegerField(source='user.id', read_only=True)
+    username = serializers.CharField(source='user.username', read_only=True)
+    first_name = serializers.CharField(source='user.first_name', read_only=True)
+    last_name = serializers.CharField(source='user.last_name', read_only=True)
+
+    class Meta:
+        model = Statistic
+        fields = ('rank', 'id', 'username', 'first_name', 'last_name', 'score')
+
 
-class FlashCardSerializer(serializers.ModelSerializer):
+class FlashCardSerializer(TimedModelSerializer):
     language = serializers.CharField(source='language.language_code', read_only=True)
     word = serializers.CharField(source='key_word', read_only=True)
 
@@ -143,7 +211,7 @@ class FlashCardSerializer(serializers.ModelSerializer):
         fields = ('id', 'word', 'language',)
 
 
-class RandomWordSerializer(serializers.ModelSerializer):
+class RandomWordSerializer(TimedModelSerializer):
     word = serializers.CharField(source='key_word', read_only=True)
     language = LanguageMiniSerializer(many=False, read_only=True)
 
@@ -0,0 +1,294 @@
+import logging
+import mmap
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.signals import setting_changed
+from django.db import connection, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Language, TabooCard
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'WWCS'
+VERSION = 1
+BUCKETS = tuple(choice for choice, _ in TabooCard.DIFFICULTY_CHOICES)
+
+HEADER = struct.Struct('<4sIdIIIIQQQQ')
+LANGUAGE = struct.Struct('<iIIIIII' + 'II' * len(BUCKETS))
+CARD = struct.Struct('<iHIHIHIHiiB')
+WORD = struct.Struct('<IH')
+CARD_ID = struct.Struct('<i')
+
+
+def snapshot_options():
+    return dict({'ENABLED': False,
+                 'PATH': os.path.join(settings.BASE_DIR, 'card_snapshot.bin'),
+                 'CHECK_INTERVAL': 1.0,
+                 'REBUILD_ON_CHANGE': True,
+                 'REBUILD_DELAY': 2.0},
+                **getattr(settings, 'CARD_SNAPSHOT', {}))
+
+
+class StringTable(object):
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+        self.offsets = {}
+
+    def add(self, text):
+        ref = self.offsets.get(text)
+        if ref is None:
+            encoded = (text or '').encode('utf-8')
+            ref = self.offsets[text] = (self.size, len(encoded))
+            self.chunks.append(encoded)
+            self.size += len(encoded)
+        return ref
+
+
+def build(path=None, chunk_size=2000):
+    path = path or snapshot_options()['PATH']
+    strings = StringTable()
+    languages = list(Language.objects.order_by('pk').values_list('pk', 'name', 'language_code'))
+    language_index = {pk: index for index, (pk, _, _) in enumerate(languages)}
+    bucket_index = {bucket: index for index, bucket in enumerate(BUCKETS)}
+
+    cards, words = [], []
+    ranges = {}
+    rows = (TabooCard.objects.order_by('pk')
+            .values_list('pk', 'language_id', 'key_word', 'owner__username', 'black_list',
+                         'times_shown', 'answered_correctly', 'difficulty_bucket'))
+    for (pk, language_id, key_word, owner, black_list,
+         shown, answered, bucket) in rows.iterator(chunk_size=chunk_size):
+        black_list_words = str(black_list).split(';')
+        cards.append((pk, language_index[language_id], strings.add(key_word), strings.add(owner),
+                      len(words), len(black_list_words), shown, answered, bucket_index.get(bucket, 0)))
+        words.extend(strings.add(word) for word in black_list_words)
+
+    cards.sort(key=lambda card: (card[1], card[8], card[0]))
+    for position, card in enumerate(cards):
+        language_ranges = ranges.setdefault(card[1], {})
+        start, count = language_ranges.get(card[8], (position, 0))
+        language_ranges[card[8]] = (start, count + 1)
+
+    language_records = []
+    for index, (pk, name, code) in enumerate(languages):
+        bucket_ranges = ranges.get(index, {})
+        first = min([start for start, _ in bucket_ranges.values()] or [0])
+        total = sum(count for _, count in bucket_ranges.values())
+        name_ref, code_ref = strings.add(name), strings.add(code or '')
+        flat = []
+        for bucket in range(len(BUCKETS)):
+            flat.extend(bucket_ranges.get(bucket, (0, 0)))
+        language_records.append(LANGUAGE.pack(pk, name_ref[0], name_ref[1], code_ref[0], code_ref[1],
+                                              first, total, *flat))
+
+    languages_offset = HEADER.size
+    cards_offset = languages_offset + LANGUAGE.size * len(languages)
+    words_offset = cards_offset + CARD.size * len(cards)
+    strings_offset = words_offset + WORD.size * len(words)
+    header = HEADER.pack(MAGIC, VERSION, time.time(), len(languages), len(cards), len(words), strings.size,
+                         languages_offset, cards_offset, words_offset, strings_offset)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(prefix='.card_snapshot', dir=directory)
+    try:
+        with os.fdopen(descriptor, 'wb') as output:
+            output.write(header)
+            output.write(b''.join(language_records))
+            for (pk, language, key_ref, owner_ref, words_start, words_count, shown, answered, bucket) in cards:
+                output.write(CARD.pack(pk, language, key_ref[0], key_ref[1], owner_ref[0], owner_ref[1],
+                                       words_start, words_count, shown, answered, bucket))
+            output.write(b''.join(WORD.pack(offset, length) for offset, length in words))
+            output.write(b''.join(strings.chunks))
+            output.flush()
+            os.fsync(output.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return len(cards)
+
+
+class Snapshot(object):
+    def __init__(self, path):
+        with open(path, 'rb') as source:
+            self.buffer = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.built_at, self.language_count, self.card_count, self.word_count, _,
+         self.languages_offset, self.cards_offset, self.words_offset, self.strings_offset) = \
+            HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a version %d card snapshot' % (path, VERSION))
+
+        self.languages = []
+        self.positions_by_id = {}
+        self.positions_by_code = {}
+        for index in range(self.language_count):
+            record = LANGUAGE.unpack_from(self.buffer, self.languages_offset + index * LANGUAGE.size)
+            language = Language(id=record[0], name=self.string(record[1], record[2]),
+                                language_code=self.string(record[3], record[4]) or None)
+            buckets = {BUCKETS[bucket]: (record[7 + 2 * bucket], record[8 + 2 * bucket])
+                       for bucket in range(len(BUCKETS))}
+            self.languages.append((language, record[5], record[6], buckets))
+            self.positions_by_id[language.pk] = index
+            if language.language_code:
+                self.positions_by_code.setdefault(language.language_code, index)
+
+    def string(self, offset, length):
+        start = self.strings_offset + offset
+        return self.buffer[start:start + length].decode('utf-8')
+
+    def card_id(self, position):
+        return CARD_ID.unpack_from(self.buffer, self.cards_offset + position * CARD.size)[0]
+
+    def card(self, position):
+        (pk, language, key_offset, key_length, owner_offset, owner_length, words_start, words_count,
+         shown, answered, bucket) = CARD.unpack_from(self.buffer, self.cards_offset + position * CARD.size)
+        words = [self.string(*WORD.unpack_from(self.buffer, self.words_offset + index * WORD.size))
+                 for index in range(words_start, words_start + words_count)]
+        card = TabooCard(id=pk, key_word=self.string(key_offset, key_length), black_list=';'.join(words),
+                         times_shown=shown, answered_correctly=answered, difficulty_bucket=BUCKETS[bucket])
+        card.black_list_words = words
+        card.language = self.languages[language][0]
+        card.owner = User(username=self.string(owner_offset, owner_length))
+        return card
+
+    def sample_positions(self, start, count, k, rng, exclude=frozenset()):
+        k = min(k, count)
+        if not exclude:
+            return [start + offset for offset in rng.sample(range(count), k)]
+
+        picked, seen = [], set()
+        attempts = 4 * k + 32
+        while len(picked) < k and attempts:
+            attempts -= 1
+            position = start + rng.randrange(count)
+            if position not in seen and self.card_id(position) not in exclude:
+                seen.add(position)
+                picked.append(position)
+        if len(picked) < k:
+            remaining = [position for position in range(start, start + count)
+                         if position not in seen and self.card_id(position) not in exclude]
+            picked.extend(rng.sample(remaining, min(k - len(picked), len(remaining))))
+        return picked
+
+    def language_range(self, language_id):
+        if language_id is None:
+            return 0, self.card_count
+        index = self.positions_by_id.get(language_id)
+        if index is None:
+            return 0, 0
+        _, first, total, _ = self.languages[index]
+        return first, total
+
+    def sample(self, language_id, k, seed=None, exclude=frozenset()):
+        rng = random.Random(seed) if seed is not None else random
+        start, count = self.language_range(language_id)
+        return [self.card(position) for position in self.sample_positions(start, count, k, rng, exclude)]
+
+    def sample_bucket(self, language_code, bucket, k, seed=None):
+        index = self.positions_by_code.get(language_code)
+        if index is None or bucket not in BUCKETS:
+            return []
+        rng = random.Random(seed) if seed is not None else random
+        start, count = self.languages[index][3][bucket]
+        return [self.card(position) for position in self.sample_positions(start, count, k, rng)]
+
+
+class SnapshotStore(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timer = None
+        self.configure()
+
+    def configure(self):
+        options = snapshot_options()
+        with self._lock:
+            self.enabled = options['ENABLED']
+            self.path = options['PATH']
+            self.check_interval = options['CHECK_INTERVAL']
+            self.rebuild_on_change = options['REBUILD_ON_CHANGE']
+            self.rebuild_delay = options['REBUILD_DELAY']
+            self._snapshot = None
+            self._signature = None
+            self._checked_at = 0.0
+
+    def current(self):
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return self._snapshot
+            self._checked_at = now
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                self._snapshot = self._signature = None
+                return None
+            signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if signature != self._signature:
+                try:
+                    self._snapshot = Snapshot(self.path)
+                    self._signature = signature
+                except (OSError, ValueError, struct.error):
+                    logger.exception('Could not open card snapshot %s', self.path)
+                    self._snapshot = self._signature = None
+            return self._snapshot
+
+    def rebuild(self):
+        with self._lock:
+            self._timer = None
+        try:
+            build(self.path)
+        except Exception:
+            logger.exception('Rebuilding card snapshot %s failed', self.path)
+        finally:
+            connection.close()
+        with self._lock:
+            self._checked_at = 0.0
+
+    def schedule_rebuild(self):
+        if not self.enabled or not self.rebuild_on_change:
+            return
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(self.rebuild_delay, self.rebuild)
+            self._timer.daemon = True
+            self._timer.start()
+
+
+store = SnapshotStore()
+
+
+def current():
+    return store.current()
+
+
+def rebuild_on_commit():
+    if store.enabled and store.rebuild_on_change:
+        transaction.on_commit(store.schedule_rebuild)
+
+
+@receiver(post_save, sender=TabooCard)
+@receiver(post_delete, sender=TabooCard)
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Language)
+def rebuild_after_card_change(sender, **kwargs):
+    rebuild_on_commit()
+
+
+@receiver(setting_changed)
+def reconfigure_snapshot(setting, **kwargs):
+    if setting == 'CARD_SNAPSHOT':
+        store.configure()
@@ -0,0 +1,203 @@
+import heapq
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import languages
+from .models import Achievement, ChangeLogEntry, Language, TabooCard, UserFollowing
+from .serializers import AchievementBaseSerializer, LanguageListSerializer, TabooCardSerializer
+
+KINDS = (
+    ('cards', ChangeLogEntry.CARD),
+    ('languages', ChangeLogEntry.LANGUAGE),
+    ('achievements', ChangeLogEntry.ACHIEVEMENT),
+    ('following', ChangeLogEntry.FOLLOW),
+)
+PRUNE_CHUNK_SIZE = 10000
+
+
+def sync_options():
+    return dict({'MAX_CHANGES': 1000, 'SETTLE_SECONDS': 5, 'MAX_PUSHES': 100},
+                **getattr(settings, 'SYNC', {}))
+
+
+def record_pairs(kind, pairs, deleted=False):
+    now = timezone.now()
+    ChangeLogEntry.objects.bulk_create([ChangeLogEntry(kind=kind, object_id=object_id, user_id=user_id,
+                                                       deleted=deleted, changed_at=now)
+                                        for object_id, user_id in pairs])
+
+
+def record(kind, object_ids, user_id=None, deleted=False):
+    record_pairs(kind, [(object_id, user_id) for object_id in object_ids], deleted)
+
+
+def record_awards(achievement_ids_by_user):
+    record_pairs(ChangeLogEntry.ACHIEVEMENT, [(achievement_id, user_id)
+                                              for user_id, achievement_ids in achievement_ids_by_user.items()
+                                              for achievement_id in achievement_ids])
+
+
+def current_version():
+    return ChangeLogEntry.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def settled_version(settle_seconds):
+    settled_before = timezone.now() - timedelta(seconds=settle_seconds)
+    return (ChangeLogEntry.objects.filter(changed_at__lte=settled_before)
+            .order_by('-changed_at', '-id').values_list('id', flat=True).first() or 0)
+
+
+def serialize_cards(user, ids=None):
+    cards = TabooCard.objects.filter(owner=user).select_related('language', 'owner').order_by('pk')
+    if ids is not None:
+        cards = cards.filter(pk__in=ids)
+    return TabooCardSerializer(cards, many=True).data
+
+
+def serialize_languages(user, ids=None):
+    rows = languages.languages_with_counts()
+    if ids is not None:
+        rows = rows.filter(pk__in=ids)
+    return LanguageListSerializer(rows, many=True, context={
+        'subscribed_language_ids': languages.subscribed_language_ids(user)}).data
+
+
+def serialize_achievements(user, ids=None):
+    awards = Achievement.users.through.objects.filter(user_id=user.pk, achievement=OuterRef('pk'))
+    achievements = Achievement.objects.annotate(is_awarded=Exists(awards)).order_by('pk')
+    if ids is not None:
+        achievements = achievements.filter(pk__in=ids)
+    return [dict(AchievementBaseSerializer(achievement).data, is_awarded=achievement.is_awarded)
+            for achievement in achievements]
+
+
+def serialize_following(user, ids=None):
+    edges = UserFollowing.objects.filter(user=user).order_by('following_id')
+    if ids is not None:
+        edges = edges.filter(following_id__in=ids)
+    return list(edges.values_list('following_id', flat=True))
+
+
+SERIALIZERS = {
+    'cards': serialize_cards,
+    'languages': serialize_languages,
+    'achievements': serialize_achievements,
+    'following': serialize_following,
+}
+
+
+def snapshot(user):
+    version = settled_version(sync_options()['SETTLE_SECONDS'])
+    payload = {name: {'updated': SERIALIZERS[name](user), 'deleted': []} for name, _ in KINDS}
+    return dict(payload, version=version, full=True, has_more=False)
+
+
+def changes_since(user, since):
+    options = sync_options()
+    if since <= 0 or since > current_version():
+        return snapshot(user)
+
+    limit = options['MAX_CHANGES']
+    scans = [ChangeLogEntry.objects.filter(owner, id__gt=since).order_by('id')
+             .values_list('id', 'kind', 'object_id', 'deleted')[:limit + 1]
+             for owner in (Q(user__isnull=True), Q(user=user))]
+    entries = list(islice(heapq.merge(*scans), limit + 1))
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    latest = {}
+    for _, kind, object_id, deleted in entries:
+        latest[kind, object_id] = deleted
+
+    payload = {}
+    for name, kind in KINDS:
+        changed = [object_id for (entry_kind, object_id), deleted in latest.items()
+                   if entry_kind == kind and not deleted]
+        removed = {object_id for (entry_kind, object_id), deleted in latest.items() if entry_kind == kind and deleted}
+        updated = SERIALIZERS[name](user, changed) if changed else []
+        present = {row if name == 'following' else row['id'] for row in updated}
+        removed.update(object_id for object_id in changed if object_id not in present)
+        payload[name] = {'updated': updated, 'deleted': sorted(removed)}
+
+    if has_more:
+        version = entries[-1][0]
+    else:
+        version = max(since, settled_version(options['SETTLE_SECONDS']))
+    return dict(payload, version=version, full=False, has_more=has_more)
+
+
+def prune(chunk_size=PRUNE_CHUNK_SIZE):
+    newer = ChangeLogEntry.objects.filter(kind=OuterRef('kind'), user_id=OuterRef('user_id'),
+                                          object_id=OuterRef('object_id'), id__gt=OuterRef('id'))
+    newer_global = ChangeLogEntry.objects.filter(kind=OuterRef('kind'), user__isnull=True,
+                                                 object_id=OuterRef('object_id'), id__gt=OuterRef('id'))
+    last_id = current_version()
+    pruned = 0
+    for start in range(0, last_id, chunk_size):
+        superseded = (ChangeLogEntry.objects.filter(id__gt=start, id__lte=start + chunk_size)
+                      .annotate(superseded=Exists(newer), superseded_global=Exists(newer_global))
+                      .filter(Q(user__isnull=False, superseded=True) | Q(user__isnull=True, superseded_global=True)))
+        ids = list(superseded.values_list('id', flat=True))
+        if ids:
+            ChangeLogEntry.objects.filter(id__in=ids).delete()
+            pruned += len(ids)
+    return pruned
+
+
+@receiver(post_save, sender=TabooCard)
+@receiver(post_delete, sender=TabooCard)
+def record_card_change(sender, instance=None, signal=None, **kwargs):
+    record(ChangeLogEntry.CARD, [instance.pk], instance.owner_id, deleted=signal is post_delete)
+
+
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Language)
+def record_language_change(sender, instance=None, signal=None, **kwargs):
+    record(ChangeLogEntry.LANGUAGE, [instance.pk], deleted=signal is post_delete)
+
+
+@receiver(post_save, sender=Achievement)
+@receiver(post_delete, sender=Achievement)
+def record_achievement_change(sender, instance=None, signal=None, **kwargs):
+    record(ChangeLogEntry.ACHIEVEMENT, [instance.pk], deleted=signal is post_delete)
+
+
+@receiver(post_save, sender=UserFollowing)
+@receiver(post_delete, sender=UserFollowing)
+def record_follow_change(sender, instance=None, signal=None, **kwargs):
+    record(ChangeLogEntry.FOLLOW, [instance.following_id], instance.user_id, deleted=signal is post_delete)
+
+
+def membership_pairs(sender, instance, action, reverse, pk_set, object_field):
+    if action == 'pre_clear':
+        owner_field = 'user_id' if reverse else object_field
+        instance._cleared_sync_pairs = list(sender.objects.filter(**{owner_field: instance.pk})
+                                            .values_list(object_field, 'user_id'))
+        return []
+    if action == 'post_clear':
+        return getattr(instance, '_cleared_sync_pairs', [])
+    if action not in ('post_add', 'post_remove') or not pk_set:
+        return []
+    if reverse:
+        return [(object_id, instance.pk) for object_id in pk_set]
+    return [(instance.pk, user_id) for user_id in pk_set]
+
+
+@receiver(m2m_changed, sender=Language.users.through)
+def record_subscription_change(sender, instance=None, action=None, reverse=False, pk_set=None, **kwargs):
+    pairs = membership_pairs(sender, instance, action, reverse, pk_set, 'language_id')
+    if pairs:
+        record(ChangeLogEntry.LANGUAGE, sorted({language_id for language_id, _ in pairs}))
+
+
+@receiver(m2m_changed, sender=Achievement.users.through)
+def record_award_change(sender, instance=None, action=None, reverse=False, pk_set=None, **kwargs):
+    pairs = membership_pairs(sender, instance, action, reverse, pk_set, 'achievement_id')
+    if pairs:
+        record_pairs(ChangeLogEntry.ACHIEVEMENT, pairs)
@@ -1,3 +1,1493 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError, SystemCheckError
+from django.core.wsgi import get_wsgi_application
+from django.db import OperationalError, connection, connections
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers as rest_serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase
+
+from . import (
+    achievement_queue, achievements, caching, cards_io, checks, counters, db_connections, follows, leaderboard,
+    metrics, response_cache, routers, sampling, scheduler, search, snapshot, sync)
+from .backends.sqlite3.base import DatabaseWrapper as PooledSqliteWrapper
+from .authentication import TokenCache, token_cache
+from .caching import bump_version
+from .achievements import engine
+from .admin import AchievementAdminForm
+from .conditions import Condition, ConditionError, parse
+from .middleware import InstrumentationMiddleware
+from .models import (
+    Achievement, AchievementQueueEntry, BlackListWord, CardReview, ChangeLogEntry, Language, LanguageScore,
+    NewCardCursor, ScoreBucket, Statistic, TabooCard, UserFollowing)
+from .routers import PrimaryReplicaRouter
+from .serializers import TabooCardSerializer, UserBaseSerializer
+from words_world.asgi import AsgiHandler, environ_for
+
+
+class AchievementEngineTests(TestCase):
+    def setUp(self):
+        engine.invalidate()
+        self.swiper = Achievement.objects.create(
+            name='Swiper', condition='user.statistics.swiped_taboo_cards >= 2',
+            font_awesome_icon='fa-hand', level='1', score=10)
+        self.translator = Achievement.objects.create(
+            name='Translator', condition='user.statistics.translated_words >= 1',
+            font_awesome_icon='fa-language', level='1', score=5)
+        self.user = User.objects.create_user(username='alice', password='secret')
+
+    def test_rules_are_indexed_by_statistic_fields(self):
+        rules = engine.rules_for({'swiped_taboo_cards'})
+        self.assertEqual([rule.achievement_id for rule in rules], [self.swiper.pk])
+
+    def test_statistic_save_awards_matching_achievements(self):
+        statistic = Statistic.objects.get(user=self.user)
+        statistic.swiped_taboo_cards = 2
+        statistic.save()
+        self.assertEqual(list(self.user.achievements.values_list('pk', flat=True)), [self.swiper.pk])
+
+    def test_grant_costs_constant_queries(self):
+        statistic = Statistic.objects.select_related('user').get(user=self.user)
+        statistic.swiped_taboo_cards = 2
+        statistic.translated_words = 1
+        engine.rules_for()
+        ScoreBucket.objects.create(score=15)
+        with self.assertNumQueries(11):
+            awarded = engine.grant(statistic.user)
+        self.assertEqual(len(awarded), 2)
+
+    def test_changed_condition_is_recompiled(self):
+        self.translator.condition = 'user.statistics.translated_words >= 0'
+        self.translator.save()
+        engine.grant(self.user)
+        self.assertIn(self.translator, self.user.achievements.all())
+
+    def test_rules_reload_when_another_process_changes_them(self):
+        engine.rules_for()
+        Achievement.objects.filter(pk=self.translator.pk).update(condition='user.statistics.translated_words >= 0',
+                                                                  score=7)
+        self.assertEqual(engine.grant(self.user), [])
+        bump_version(achievements.RULES)
+        self.assertEqual([(achievement.pk, achievement.score) for achievement in engine.grant(self.user)],
+                         [(self.translator.pk, 7)])
+
+    def test_awards_won_by_a_concurrent_grant_are_skipped(self):
+        self.user.achievements.add(self.swiper)
+        awarded = achievements.insert_awards(Achievement.users.through, {self.user.pk: [self.swiper, self.translator]})
+        self.assertEqual(awarded, {self.user.pk: [self.translator]})
+        self.assertEqual(self.user.achievements.count(), 2)
+
+    def test_a_process_local_api_cache_only_warns_on_deploy(self):
+        self.assertEqual([message.id for message in checks.check_shared_cache(None)], ['api.W001'])
+        file_cache = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                  'LOCATION': tempfile.gettempdir()}}
+        with override_settings(CACHES=file_cache):
+            self.assertFalse(caching.is_shared())
+        call_command('check', '--deploy', '--fail-level', 'ERROR', stdout=StringIO(), stderr=StringIO())
+
+    def test_deploy_check_lists_unparsable_conditions(self):
+        broken = Achievement.objects.create(name='Legacy', condition='user.statistics.swiped_taboo_cards.count() > 1',
+                                            font_awesome_icon='fa-x', level='1', score=1)
+        with self.assertRaisesMessage(SystemCheckError, 'api.E003') as raised:
+            call_command('check', '--deploy', '--tag', 'achievements', stdout=StringIO(), stderr=StringIO())
+        self.assertIn('Achievement %s (Legacy)' % broken.pk, str(raised.exception))
+        broken.delete()
+        call_command('check', '--deploy', '--tag', 'achievements', stdout=StringIO(), stderr=StringIO())
+
+
+@override_settings(ACHIEVEMENT_QUEUE={'BACKEND': 'database', 'COALESCE_WINDOW': 0})
+class DeferredAchievementTests(TestCase):
+    def setUp(self):
+        engine.invalidate()
+        self.swiper = Achievement.objects.create(
+            name='Swiper', condition='user.statistics.swiped_taboo_cards >= 2',
+            font_awesome_icon='fa-hand', level='1', score=10)
+        self.user = User.objects.create_user(username='bob', password='secret')
+
+    def test_saves_are_queued_and_drained_by_command(self):
+        statistic = Statistic.objects.get(user=self.user)
+        statistic.swiped_taboo_cards = 2
+        statistic.save()
+        self.assertFalse(self.user.achievements.exists())
+
+        call_command('drain_achievement_queue', stdout=StringIO())
+
+        self.assertTrue(self.user.achievements.filter(pk=self.swiper.pk).exists())
+        self.assertFalse(AchievementQueueEntry.objects.exists())
+
+    def test_looping_worker_refuses_an_in_process_backend(self):
+        with self.settings(ACHIEVEMENT_QUEUE={'BACKEND': 'sync'}):
+            with self.assertRaisesMessage(CommandError, 'no queue to drain'):
+                call_command('drain_achievement_queue', '--loop', stdout=StringIO())
+
+    def test_a_failing_user_does_not_stall_the_queue(self):
+        broken = User.objects.create_user(username='broken', password='secret')
+        Statistic.objects.filter(user__in=[self.user, broken]).update(swiped_taboo_cards=2)
+        achievement_queue.enqueue_many([self.user, broken])
+        grant_many = engine.grant_many
+
+        def failing_grant_many(users, changed_fields=None):
+            if broken in users:
+                raise OperationalError('boom')
+            return grant_many(users, changed_fields)
+
+        with mock.patch.object(engine, 'grant_many', side_effect=failing_grant_many), \
+                self.assertLogs('api.achievement_queue', 'ERROR'):
+            self.assertEqual(achievement_queue.drain(), 1)
+        self.assertTrue(self.user.achievements.filter(pk=self.swiper.pk).exists())
+        self.assertFalse(AchievementQueueEntry.objects.exists())
+
+
+class StatisticsPushTests(APITestCase):
+    def setUp(self):
+        engine.invalidate()
+        Achievement.objects.create(name='Swiper', condition='user.statistics.swiped_taboo_cards >= 100',
+                                   font_awesome_icon='fa-hand', level='1', score=10)
+        self.user = User.objects.create_user(username='carol', password='secret')
+        self.client.force_authenticate(self.user)
+        language = Language.objects.create(name='English', language_code='en')
+        self.cards = [TabooCard.objects.create(key_word='word%d' % i, black_list='a;b', owner=self.user,
+                                               language=language) for i in range(30)]
+
+    def test_push_updates_all_cards_in_constant_queries(self):
+        correct = [card.pk for card in self.cards[:20]]
+        incorrect = [card.pk for card in self.cards[20:]]
+        engine.rules_for()
+        with self.assertNumQueries(6):
+            response = self.client.put('/api/statistics/push/', {
+                'correctly_swiped_cards': correct, 'incorrectly_swiped_cards': incorrect,
+                'translated_words': 3}, format='json')
+        self.assertEqual(response.status_code, 202)
+
+        statistic = Statistic.objects.get(user=self.user)
+        self.assertEqual((statistic.swiped_taboo_cards, statistic.correctly_swiped_taboo_cards,
+                          statistic.translated_words), (30, 20, 3))
+        self.assertEqual(TabooCard.objects.filter(times_shown=1, answered_correctly=1).count(), 20)
+        self.assertEqual(TabooCard.objects.filter(times_shown=1, answered_correctly=0).count(), 10)
+
+
+@override_settings(COUNTER_BUFFER={'BACKEND': 'memory', 'FLUSH_INTERVAL': 3600, 'MAX_BUFFERED_DELTAS': 1000})
+class BufferedCountersTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='erin', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        language = Language.objects.create(name='English', language_code='en')
+        self.card = TabooCard.objects.create(key_word='word', black_list='a;b', owner=self.user, language=language)
+
+    def test_pending_deltas_are_visible_before_and_after_flush(self):
+        self.client.put('/api/statistics/push/', {
+            'correctly_swiped_cards': [self.card.pk], 'incorrectly_swiped_cards': []}, format='json')
+        self.assertEqual(TabooCard.objects.get(pk=self.card.pk).times_shown, 0)
+
+        card = self.client.get('/api/taboo/cards/').data[0]
+        self.assertEqual((card['times_shown'], card['answered_correctly']), (1, 1))
+        self.assertEqual(self.client.get('/api/users/me/').data['swiped_taboo_cards'], 1)
+
+        counters.flush()
+        self.card.refresh_from_db()
+        self.assertEqual((self.card.times_shown, self.card.answered_correctly), (1, 1))
+        self.assertEqual(Statistic.objects.get(user=self.user).swiped_taboo_cards, 1)
+        self.assertEqual(self.client.get('/api/taboo/cards/').data[0]['times_shown'], 1)
+
+
+class ConcurrentStatisticsPushTests(TransactionTestCase):
+    def test_parallel_pushes_do_not_lose_increments(self):
+        user = User.objects.create_user(username='dave', password='secret')
+        token = Token.objects.create(user=user)
+        language = Language.objects.create(name='English', language_code='en')
+        card = TabooCard.objects.create(key_word='word', black_list='a;b', owner=user, language=language)
+        pushes_per_thread, threads = 5, 4
+        errors = []
+
+        def push():
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+            try:
+                for _ in range(pushes_per_thread):
+                    response = client.put('/api/statistics/push/', {
+                        'correctly_swiped_cards': [card.pk], 'incorrectly_swiped_cards': []}, format='json')
+                    if response.status_code != 202:
+                        errors.append(response.status_code)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=push) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        total = pushes_per_thread * threads
+        statistic = Statistic.objects.get(user=user)
+        self.assertEqual((statistic.swiped_taboo_cards, statistic.correctly_swiped_taboo_cards), (total, total))
+        card.refresh_from_db()
+        self.assertEqual((card.times_shown, card.answered_correctly), (total, total))
+
+
+class RandomCardsTests(APITestCase):
+    def setUp(self):
+        sampling.sampler.invalidate()
+        self.user = User.objects.create_user(username='frank', password='secret')
+        self.client.force_authenticate(self.user)
+        self.english = Language.objects.create(name='English', language_code='en')
+        polish = Language.objects.create(name='Polish', language_code='pl')
+        self.cards = [TabooCard.objects.create(key_word='word%d' % i, black_list='a;b', owner=self.user,
+                                               language=self.english) for i in range(10)]
+        TabooCard.objects.create(key_word='slowo', black_list='a;b', owner=self.user, language=polish)
+
+    def random_ids(self, **params):
+        params = dict({'language_id': self.english.pk}, **params)
+        response = self.client.get('/api/taboo/cards/random/', params)
+        return [card['id'] for card in response.data]
+
+    def test_random_cards_are_distinct_and_from_language(self):
+        ids = self.random_ids(card_count=5)
+        self.assertEqual(len(set(ids)), 5)
+        self.assertTrue(set(ids) <= {card.pk for card in self.cards})
+
+    def test_seeded_sampling_is_repeatable(self):
+        self.assertEqual(self.random_ids(card_count=4, seed='abc'), self.random_ids(card_count=4, seed='abc'))
+
+    def test_session_mode_does_not_repeat_cards(self):
+        first = self.random_ids(card_count=6, session='s1')
+        second = self.random_ids(card_count=6, session='s1')
+        self.assertEqual(len(second), 4)
+        self.assertFalse(set(first) & set(second))
+
+    def test_malformed_parameters_are_rejected(self):
+        for params in ({'card_count': 'x'}, {'language_id': 'x'}, {'exclude': '1,abc'}):
+            response = self.client.get('/api/taboo/cards/random/', dict({'card_count': 2}, **params))
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(list(response.data), list(params))
+
+    def test_indexes_are_bounded_and_only_built_for_real_languages(self):
+        for language_id in range(1000, 1010):
+            self.assertEqual(self.random_ids(card_count=1, language_id=language_id), [])
+        self.assertEqual(len(sampling.sampler._indexes), 0)
+        self.assertEqual(sampling.sampler.sample_ids(self.english.pk, 1, bucket='BOGUS'), [])
+        self.assertEqual(len(sampling.sampler._indexes), 0)
+
+        with self.settings(CARD_SAMPLER_MAX_INDEXES=2):
+            for bucket in ('EASY', 'HARD', 'INSANE'):
+                sampling.sampler.sample_ids(self.english.pk, 1, bucket=bucket)
+            self.random_ids(card_count=1)
+        self.assertEqual(list(sampling.sampler._indexes), [(self.english.pk, 'INSANE'), self.english.pk])
+
+    def test_deleted_cards_leave_the_index(self):
+        self.random_ids(card_count=1)
+        for card in self.cards[1:]:
+            card.delete()
+        self.assertEqual(self.random_ids(card_count=5), [self.cards[0].pk])
+
+
+class FlashCardTests(APITestCase):
+    def setUp(self):
+        sampling.sampler.invalidate()
+        self.user = User.objects.create_user(username='grace', password='secret')
+        self.client.force_authenticate(self.user)
+        self.language = Language.objects.create(name='English', language_code='en')
+
+    def create_card(self, times_shown, answered_correctly):
+        return TabooCard.objects.create(key_word='word', black_list='a;b', owner=self.user, language=self.language,
+                                        times_shown=times_shown, answered_correctly=answered_correctly)
+
+    def test_difficulty_bucket_tracks_counter_updates(self):
+        card = self.create_card(4, 3)
+        self.assertEqual(card.difficulty_bucket, 'EASY')
+        self.client.put('/api/statistics/push/', {
+            'correctly_swiped_cards': [], 'incorrectly_swiped_cards': [card.pk]}, format='json')
+        card.refresh_from_db()
+        self.assertEqual((card.difficulty_bucket, card.difficulty), ('MEDIUM', 'MEDIUM'))
+
+    def test_flashcards_are_filtered_by_bucket_in_the_database(self):
+        hard = {self.create_card(4, 1).pk for _ in range(3)}
+        self.create_card(4, 4)
+        response = self.client.get('/api/flashcards/', {'language_code': 'en', 'difficulty': 'HARD', 'count': 15})
+        self.assertEqual({card['id'] for card in response.data}, hard)
+
+    def test_flashcards_are_sampled_from_a_bucket_index(self):
+        cards = [self.create_card(4, 1) for _ in range(6)]
+        for card in cards[1:5]:
+            card.delete()
+        self.create_card(4, 4)
+        params = {'language_code': 'en', 'difficulty': 'HARD', 'count': 1}
+        seen = {self.client.get('/api/flashcards/', params).data[0]['id'] for _ in range(40)}
+        self.assertEqual(seen, {cards[0].pk, cards[5].pk})
+        with self.assertNumQueries(2):
+            self.client.get('/api/flashcards/', params)
+
+    def test_unknown_difficulty_is_rejected_on_both_paths(self):
+        params = {'language_code': 'en', 'difficulty': 'TRIVIAL', 'count': 1}
+        for cards_snapshot in (None, mock.Mock()):
+            with mock.patch.object(snapshot, 'current', return_value=cards_snapshot):
+                response = self.client.get('/api/flashcards/', params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('difficulty', response.data)
+        self.assertEqual(len(sampling.sampler._indexes), 0)
+        response = self.client.get('/api/flashcards/', dict(params, difficulty='HARD', count='many'))
+        self.assertEqual(list(response.data), ['count'])
+
+
+class UserListQueriesTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='heidi', password='secret')
+        self.client.force_authenticate(self.user)
+        self.language = Language.objects.create(name='English', language_code='en')
+        self.achievement = Achievement.objects.create(name='Newcomer', condition='False',
+                                                      font_awesome_icon='fa-star', level='1', score=7)
+
+    def create_users(self, count):
+        for i in range(count):
+            user = User.objects.create_user(username='user%d-%d' % (count, i), password='secret')
+            user.selected_languages.add(self.language)
+            user.achievements.add(self.achievement)
+            UserFollowing.objects.create(user=self.user, following=user)
+
+    def test_user_list_runs_constant_number_of_queries(self):
+        self.create_users(3)
+        with self.assertNumQueries(5):
+            self.client.get('/api/users/')
+
+        self.create_users(20)
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/users/')
+
+        other = next(user for user in response.data if user['username'] == 'user20-0')
+        self.assertTrue(other['is_friend'])
+        self.assertEqual(other['overall_score'], {'score__sum': 7})
+
+        Statistic.objects.filter(user__username='user20-0').update(score=9)
+        response_cache.get_backend().clear()
+        other = next(user for user in self.client.get('/api/users/').data if user['username'] == 'user20-0')
+        self.assertEqual(other['overall_score'], {'score__sum': 9})
+        self.assertFalse(other['selected_languages'][0]['is_subscribed'])
+
+
+class LanguageListTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='ivan', password='secret')
+        self.client.force_authenticate(self.user)
+        self.english = Language.objects.create(name='English', language_code='en')
+        self.polish = Language.objects.create(name='Polish', language_code='pl')
+        for i in range(3):
+            User.objects.create_user(username='fan%d' % i, password='secret').selected_languages.add(self.polish)
+
+    def test_list_reports_subscriptions_and_counts_from_cache(self):
+        response = self.client.get('/api/languages/')
+        self.assertEqual([(row['name'], row['is_subscribed'], row['subscriber_count']) for row in response.data],
+                         [('English', False, 0), ('Polish', False, 3)])
+
+        with self.assertNumQueries(0):
+            self.client.get('/api/languages/')
+
+        self.client.post('/api/languages/%d/subscribe/' % self.english.pk)
+        response = self.client.get('/api/languages/')
+        self.assertTrue(response.data[0]['is_subscribed'])
+
+
+class PaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='judy', password='secret')
+        self.client.force_authenticate(self.user)
+        english = Language.objects.create(name='English', language_code='en')
+        polish = Language.objects.create(name='Polish', language_code='pl')
+        for language in (polish, english):
+            for key_word in ('zebra', 'apple', 'apple', 'mango'):
+                TabooCard.objects.create(key_word=key_word, black_list='a;b', owner=self.user, language=language)
+
+    def test_cards_are_paginated_by_keyset(self):
+        expected = list(TabooCard.objects.order_by('language_id', 'key_word', 'id').values_list('pk', flat=True))
+        ids, url = [], '/api/taboo/cards/?page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertLessEqual(len(response.data['results']), 3)
+            ids += [card['id'] for card in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, expected)
+
+    def test_unpaginated_list_keeps_plain_shape(self):
+        self.assertEqual(len(self.client.get('/api/taboo/cards/').data), 8)
+
+    def test_users_are_streamed_as_ndjson(self):
+        for i in range(3):
+            User.objects.create_user(username='streamed%d' % i, password='secret')
+        response = self.client.get('/api/users/', {'stream': 'ndjson'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], list(User.objects.order_by('id').values_list('pk', flat=True)))
+
+    def test_cards_are_streamed_as_json_array(self):
+        response = self.client.get('/api/taboo/cards/', {'stream': 'json'})
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content).decode())), 8)
+
+
+class BulkCardImportTests(APITestCase):
+    def setUp(self):
+        sampling.sampler.invalidate()
+        self.user = User.objects.create_user(username='kate', password='secret')
+        self.client.force_authenticate(self.user)
+        self.english = Language.objects.create(name='English', language_code='en')
+
+    def test_csv_upload_creates_cards_and_reports_bad_rows(self):
+        body = 'key_word,black_list,language\ncat,meow;pet,en\ndog,bark,xx\n,empty,en\n'
+        response = self.client.generic('POST', '/api/taboo/cards/bulk/', body, content_type='text/csv')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([error['row'] for error in response.data['errors']], [3, 4])
+        self.assertEqual(TabooCard.objects.get().black_list, 'meow;pet')
+
+    def test_ndjson_upload_resolves_languages_by_id(self):
+        body = '\n'.join(json.dumps({'key_word': 'word%d' % i, 'black_list': ['a', 'b'],
+                                     'language': self.english.pk}) for i in range(5))
+        response = self.client.generic('POST', '/api/taboo/cards/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.data, {'created': 5, 'errors': []})
+        self.assertEqual(len(self.client.get('/api/taboo/cards/random/', {
+            'language_id': self.english.pk, 'card_count': 10}).data), 5)
+
+    def test_rows_inserted_concurrently_by_the_same_owner_are_not_claimed(self):
+        bulk_create = TabooCard.objects.bulk_create
+
+        def racing_bulk_create(cards, **kwargs):
+            TabooCard.objects.create(key_word='rival', black_list='other', owner=self.user, language=self.english)
+            return bulk_create(cards, **kwargs)
+
+        rows = [(1, {'key_word': 'cat', 'black_list': 'meow', 'language': 'en'}),
+                (2, {'key_word': 'dog', 'black_list': 'bark', 'language': 'en'})]
+        with mock.patch.object(TabooCard.objects, 'bulk_create', side_effect=racing_bulk_create):
+            cards_io.import_cards(rows, self.user)
+        words = {card.key_word: sorted(card.forbidden_words.values_list('word', flat=True))
+                 for card in TabooCard.objects.all()}
+        self.assertEqual(words, {'rival': ['other'], 'cat': ['meow'], 'dog': ['bark']})
+
+    def test_export_command_streams_ndjson(self):
+        TabooCard.objects.create(key_word='cat', black_list='meow', owner=self.user, language=self.english)
+        output = StringIO()
+        call_command('export_cards', stdout=output)
+        self.assertEqual(json.loads(output.getvalue())['language'], 'en')
+
+
+class CachedTokenAuthenticationTests(APITestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user(username='leo', password='secret')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_repeated_requests_skip_the_token_lookup(self):
+        self.client.get('/api/languages/')
+        hits = token_cache.stats()['hits']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/languages/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('authtoken', queries.captured_queries[0]['sql'])
+        self.assertEqual(token_cache.stats()['hits'], hits + 1)
+
+    def test_users_are_reloaded_and_never_written_back(self):
+        self.client.get('/api/languages/')
+        language = Language.objects.create(name='English', language_code='en')
+        User.objects.filter(pk=self.user.pk).update(password='changed', is_staff=True)
+        self.assertEqual(self.client.post('/api/languages/%d/subscribe/' % language.pk).status_code, 201)
+        self.assertEqual(self.client.put('/api/users/me/', {'first_name': 'Leo'}).status_code, 200)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual((user.password, user.is_staff, user.first_name), ('changed', True, 'Leo'))
+
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    @override_settings(TOKEN_AUTH_CACHE={'MAX_SIZE': 10, 'TTL': 300, 'SHARED_CACHE': 'default'})
+    def test_deleted_tokens_are_rejected_by_every_process(self):
+        self.client.get('/api/languages/')
+        other_process = TokenCache()
+        self.assertIsNotNone(other_process.get(self.token.key))
+        self.token.delete()
+        self.assertIsNone(other_process.get(self.token.key))
+
+    def test_deleted_token_is_rejected(self):
+        self.client.get('/api/languages/')
+        self.token.delete()
+        self.assertEqual(self.client.get('/api/languages/').status_code, 401)
+
+    def test_user_changes_are_picked_up(self):
+        self.client.get('/api/languages/')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/languages/').status_code, 401)
+
+    def test_signup_token_is_cached(self):
+        response = self.client.post('/signup/', {'username': 'mia', 'password': 'secret', 'email': 'mia@x.io'})
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + response.data['token'])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/users/me/').data['username'], 'mia')
+        self.assertFalse([query for query in queries.captured_queries if 'authtoken' in query['sql']])
+
+
+class FollowGraphTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='nina', password='secret')
+        self.client.force_authenticate(self.user)
+        self.others = [User.objects.create_user(username='other%d' % i, password='secret') for i in range(30)]
+
+    def test_follow_and_unfollow_are_idempotent(self):
+        other = self.others[0]
+        self.assertEqual(self.client.post('/api/users/%d/follow/' % other.pk).status_code, 201)
+        self.assertEqual(self.client.post('/api/users/%d/follow/' % other.pk).status_code, 200)
+        self.assertEqual(UserFollowing.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(self.client.post('/api/users/%d/unfollow/' % other.pk).status_code, 204)
+        self.assertEqual(self.client.post('/api/users/%d/unfollow/' % other.pk).status_code, 204)
+        self.assertFalse(UserFollowing.objects.exists())
+
+    def test_followings_are_listed_in_one_query(self):
+        for other in self.others:
+            UserFollowing.objects.create(user=self.user, following=other)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/users/followings/')
+        self.assertEqual([user['id'] for user in response.data], [other.pk for other in self.others])
+
+    def test_followers_and_mutuals(self):
+        UserFollowing.objects.create(user=self.user, following=self.others[0])
+        UserFollowing.objects.create(user=self.others[0], following=self.user)
+        UserFollowing.objects.create(user=self.others[1], following=self.user)
+
+        followers = self.client.get('/api/users/followers/', {'page_size': 1})
+        self.assertEqual(len(followers.data['results']), 1)
+        self.assertIsNotNone(followers.data['next'])
+        mutuals = self.client.get('/api/users/mutuals/')
+        self.assertEqual([user['id'] for user in mutuals.data], [self.others[0].pk])
+
+    def test_following_ids_are_only_cached_in_a_shared_cache(self):
+        UserFollowing.objects.create(user=self.user, following=self.others[0])
+        follows.following_ids(self.user)
+        with self.assertNumQueries(1):
+            follows.following_ids(self.user)
+
+        with mock.patch.object(follows, 'is_shared', return_value=True):
+            follows.following_ids(self.user)
+            with self.assertNumQueries(0):
+                self.assertEqual(follows.following_ids(self.user), {self.others[0].pk})
+            UserFollowing.objects.create(user=self.user, following=self.others[1])
+            self.assertEqual(follows.following_ids(self.user), {self.others[0].pk, self.others[1].pk})
+
+    def test_is_friend_uses_cached_following_ids(self):
+        UserFollowing.objects.create(user=self.user, following=self.others[0])
+        response = self.client.get('/api/users/%d/' % self.others[0].pk)
+        self.assertTrue(response.data['is_friend'])
+        self.client.post('/api/users/%d/unfollow/' % self.others[0].pk)
+        self.assertFalse(self.client.get('/api/users/%d/' % self.others[0].pk).data['is_friend'])
+
+
+class LeaderboardTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        engine.invalidate()
+        self.english = Language.objects.create(name='English', language_code='en')
+        self.bronze = Achievement.objects.create(condition='user.statistics.translated_words >= 100', name='Bronze',
+                                                 font_awesome_icon='fa-star', level='1', score=5)
+        self.gold = Achievement.objects.create(condition='user.statistics.translated_words >= 3', name='Gold',
+                                               font_awesome_icon='fa-star', level='3', score=20)
+        self.users = [User.objects.create_user(username='player%d' % i, password='secret') for i in range(4)]
+        self.client.force_authenticate(self.users[0])
+
+    def score(self, user):
+        return Statistic.objects.get(user=user).score
+
+    def test_scores_follow_awarded_achievements(self):
+        self.users[1].achievements.add(self.bronze)
+        self.gold.users.add(self.users[1], self.users[2])
+        self.assertEqual(self.score(self.users[1]), 25)
+        self.assertEqual(self.score(self.users[2]), 20)
+
+        Statistic.objects.filter(user=self.users[3]).update(translated_words=5)
+        engine.grant(User.objects.get(pk=self.users[3].pk))
+        self.assertEqual(self.score(self.users[3]), 20)
+
+        self.users[1].achievements.remove(self.gold)
+        self.assertEqual(self.score(self.users[1]), 5)
+
+    def test_top_friends_and_rank(self):
+        self.gold.users.add(self.users[1], self.users[2])
+        self.bronze.users.add(self.users[2], self.users[3])
+        UserFollowing.objects.create(user=self.users[0], following=self.users[3])
+
+        top = self.client.get('/api/leaderboard/', {'limit': 3}).data
+        self.assertEqual([(row['rank'], row['id'], row['score']) for row in top],
+                         [(1, self.users[2].pk, 25), (2, self.users[1].pk, 20), (3, self.users[3].pk, 5)])
+
+        friends = self.client.get('/api/leaderboard/friends/').data
+        self.assertEqual([row['id'] for row in friends], [self.users[3].pk, self.users[0].pk])
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/leaderboard/me/')
+        self.assertEqual(response.data, {'rank': 4, 'score': 0})
+
+    def test_per_language_board(self):
+        self.english.users.add(self.users[1])
+        self.gold.users.add(self.users[1], self.users[2])
+        rows = self.client.get('/api/leaderboard/', {'language_id': self.english.pk}).data
+        self.assertEqual([(row['rank'], row['id']) for row in rows], [(1, self.users[1].pk)])
+        response = self.client.get('/api/leaderboard/', {'language_id': 'en'})
+        self.assertEqual((response.status_code, list(response.data)), (400, ['language_id']))
+
+    def test_ranks_come_from_score_buckets(self):
+        self.gold.users.add(self.users[1], self.users[2])
+        self.bronze.users.add(self.users[2])
+        User.objects.create_user(username='late', password='secret')
+        buckets = dict(ScoreBucket.objects.filter(users__gt=0).values_list('score', 'users'))
+        self.assertEqual(buckets, {0: 3, 20: 1, 25: 1})
+        self.assertEqual(leaderboard.rank_of(self.users[1]), (2, 20))
+        self.assertEqual(leaderboard.rank_of(self.users[0]), (3, 0))
+
+        self.users[3].delete()
+        self.assertEqual(ScoreBucket.objects.get(score=0).users, 2)
+
+    def test_language_board_follows_scores_and_subscriptions(self):
+        self.english.users.add(self.users[1], self.users[2])
+        self.gold.users.add(self.users[2])
+        self.bronze.users.add(self.users[1], self.users[3])
+        rows = self.client.get('/api/leaderboard/', {'language_id': self.english.pk}).data
+        self.assertEqual([(row['rank'], row['id'], row['score']) for row in rows],
+                         [(1, self.users[2].pk, 20), (2, self.users[1].pk, 5)])
+
+        self.users[2].selected_languages.remove(self.english)
+        rows = self.client.get('/api/leaderboard/', {'language_id': self.english.pk}).data
+        self.assertEqual([row['id'] for row in rows], [self.users[1].pk])
+
+    def test_deleting_an_achievement_lowers_holder_scores(self):
+        self.gold.users.add(self.users[1], self.users[2])
+        self.bronze.users.add(self.users[2])
+        self.english.users.add(self.users[2])
+        self.gold.delete()
+        self.assertEqual(self.score(self.users[1]), 0)
+        self.assertEqual(self.score(self.users[2]), 5)
+        self.assertEqual(LanguageScore.objects.get(user=self.users[2]).score, 5)
+        self.assertEqual(leaderboard.rank_of(self.users[1]), (2, 0))
+
+    def test_rebuild_repairs_drift(self):
+        self.gold.users.add(self.users[1])
+        Statistic.objects.filter(user=self.users[1]).update(score=3)
+        Statistic.objects.filter(user=self.users[2]).update(score=8)
+
+        out = StringIO()
+        call_command('rebuild_leaderboard', stdout=out)
+        self.assertIn('Repaired scores of 2 users', out.getvalue())
+        self.assertEqual(self.score(self.users[1]), 20)
+        self.assertEqual(self.score(self.users[2]), 0)
+
+        self.gold.score = 30
+        self.gold.save()
+        self.assertEqual(self.score(self.users[1]), 30)
+
+
+class ResponseCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        sampling.sampler.invalidate()
+        response_cache.get_backend().clear()
+        self.user = User.objects.create_user(username='olga', password='secret')
+        self.other = User.objects.create_user(username='piotr', password='secret')
+        self.client.force_authenticate(self.user)
+        self.english = Language.objects.create(name='English', language_code='en')
+
+    def test_matching_etag_is_answered_with_304_without_queries(self):
+        response = self.client.get('/api/languages/')
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/languages/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.client.post('/api/languages/%d/subscribe/' % self.english.pk)
+        response = self.client.get('/api/languages/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertTrue(response.data[0]['is_subscribed'])
+
+    def test_subscriptions_only_invalidate_the_subscriber(self):
+        self.client.force_authenticate(self.other)
+        self.client.get('/api/languages/')
+        self.client.force_authenticate(self.user)
+        self.client.post('/api/languages/%d/subscribe/' % self.english.pk)
+        self.english.users.add(User.objects.create_user(username='quinn', password='secret'))
+
+        self.client.force_authenticate(self.other)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/languages/')
+        self.assertFalse(response.data[0]['is_subscribed'])
+        self.client.force_authenticate(self.user)
+        self.assertTrue(self.client.get('/api/languages/').data[0]['is_subscribed'])
+
+    def test_entries_vary_by_requester(self):
+        self.client.post('/api/languages/%d/subscribe/' % self.english.pk)
+        self.assertTrue(self.client.get('/api/languages/').data[0]['is_subscribed'])
+        self.client.force_authenticate(self.other)
+        self.assertFalse(self.client.get('/api/languages/').data[0]['is_subscribed'])
+
+    def test_user_detail_is_invalidated_by_awards(self):
+        achievement = Achievement.objects.create(condition='user.statistics.translated_words >= 100', name='Star',
+                                                 font_awesome_icon='fa-star', level='1', score=5)
+        url = '/api/users/%d/' % self.other.pk
+        self.assertEqual(self.client.get(url).data['achievements'], [])
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        Statistic.objects.filter(user=self.other).update(translated_words=100)
+        engine.invalidate()
+        engine.grant(User.objects.get(pk=self.other.pk))
+        self.assertEqual([row['id'] for row in self.client.get(url).data['achievements']], [achievement.pk])
+
+    def test_achievement_list_and_seeded_flashcards(self):
+        self.assertEqual(self.client.get('/api/achievements/').data, [])
+        Achievement.objects.create(condition='False', name='Never', font_awesome_icon='fa-star', level='1', score=1)
+        self.assertEqual(len(self.client.get('/api/achievements/').data), 1)
+
+        TabooCard.objects.create(key_word='cat', black_list='a', owner=self.user, language=self.english)
+        params = {'language_code': 'en', 'difficulty': 'NOT ENOUGH STATS', 'count': 5, 'seed': 7}
+        self.assertEqual(len(self.client.get('/api/flashcards/', params).data), 1)
+        with self.assertNumQueries(0):
+            self.client.get('/api/flashcards/', params)
+        TabooCard.objects.create(key_word='dog', black_list='a', owner=self.user, language=self.english)
+        self.assertEqual(len(self.client.get('/api/flashcards/', params).data), 2)
+
+
+class InstrumentationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        response_cache.get_backend().clear()
+        metrics.registry.reset()
+        self.admin = User.objects.create_superuser(username='root', email='root@example.com', password='secret')
+        Language.objects.create(name='English', language_code='en')
+
+    def test_metrics_are_recorded_per_route(self):
+        self.client.force_authenticate(self.admin)
+        self.client.get('/api/languages/')
+        self.client.get('/api/languages/')
+
+        response = self.client.get('/api/_metrics')
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode('utf-8')
+        self.assertIn('api_requests_total{route="languages-list",method="GET"} 2', body)
+        self.assertIn('api_request_duration_seconds_bucket{route="languages-list",method="GET",le="+Inf"} 2',
+                      body)
+        self.assertIn('api_db_queries_total{route="languages-list",method="GET"} 2', body)
+        self.assertIn('api_token_cache_hits_total', body)
+        _, routes = metrics.registry.snapshot()
+        self.assertGreater(routes[('languages-list', 'GET')]['serializer_seconds'], 0)
+        self.assertGreater(routes[('languages-list', 'GET')]['response_bytes'], 0)
+
+    @override_settings(INSTRUMENTATION={'QUERY_BUDGET': 0})
+    def test_routes_over_their_query_budget_are_logged(self):
+        self.client.force_authenticate(self.admin)
+        with self.assertLogs('api.middleware', 'WARNING') as logs:
+            self.client.get('/api/languages/')
+        self.assertIn('GET languages-list ran 2 queries, over its budget of 0', logs.output[0])
+
+    def test_workers_share_metrics_through_a_directory(self):
+        self.client.force_authenticate(self.admin)
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'metrics-1-1.json'), 'w') as stream:
+                json.dump({'buckets': list(metrics.DEFAULT_LATENCY_BUCKETS), 'routes': [
+                    ['languages-list', 'GET', dict(vars(metrics.RouteMetrics(metrics.DEFAULT_LATENCY_BUCKETS)),
+                                                   requests=3)]]}, stream)
+            with self.settings(INSTRUMENTATION={'MULTIPROCESS_DIR': directory}):
+                self.client.get('/api/languages/')
+                body = self.client.get('/api/_metrics').content.decode('utf-8')
+                self.assertEqual(len(os.listdir(directory)), 2)
+        self.assertIn('api_requests_total{route="languages-list",method="GET"} 4', body)
+
+    def test_queries_of_streamed_bodies_are_counted(self):
+        def rows():
+            for language in Language.objects.all():
+                yield language.name.encode('utf-8')
+
+        request = RequestFactory().get('/api/languages/')
+        middleware = InstrumentationMiddleware(lambda request: StreamingHttpResponse(rows()))
+        response = middleware(request)
+        self.assertEqual(b''.join(response.streaming_content), b'English')
+        _, routes = metrics.registry.snapshot()
+        self.assertEqual((routes[('unmatched', 'GET')]['queries'], routes[('unmatched', 'GET')]['response_bytes']),
+                         (1, 7))
+
+    @override_settings(INSTRUMENTATION={'QUERY_BUDGET': 0})
+    def test_streamed_bodies_are_checked_against_the_budget_once_closed(self):
+        def rows():
+            for language in Language.objects.all():
+                yield language.name.encode('utf-8')
+
+        request = RequestFactory().get('/api/languages/')
+        middleware = InstrumentationMiddleware(lambda request: StreamingHttpResponse(rows()))
+        with self.assertLogs('api.middleware', 'WARNING') as logs:
+            response = middleware(request)
+            self.assertEqual(logs.output, [])
+            b''.join(response.streaming_content)
+        self.assertEqual(logs.output, ['WARNING:api.middleware:GET unmatched ran 1 queries, over its budget of 0'])
+        _, routes = metrics.registry.snapshot()
+        self.assertEqual(routes[('unmatched', 'GET')]['over_budget'], 1)
+
+    def test_drf_serializers_are_not_patched(self):
+        self.assertNotIsInstance(rest_serializers.Serializer(), metrics.TimedSerializerMixin)
+        self.assertIsInstance(TabooCardSerializer([], many=True), metrics.TimedSerializerMixin)
+        self.assertIsInstance(UserBaseSerializer([], many=True), metrics.TimedListSerializer)
+
+    def test_metrics_require_staff(self):
+        self.client.force_authenticate(User.objects.create_user(username='guest', password='secret'))
+        self.assertEqual(self.client.get('/api/_metrics').status_code, 403)
+
+
+class FlashCardSchedulerTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='quinn', password='secret')
+        self.client.force_authenticate(self.user)
+        self.english = Language.objects.create(name='English', language_code='en')
+        self.german = Language.objects.create(name='German', language_code='de')
+        self.cards = [TabooCard.objects.create(key_word='word%d' % i, black_list='a', owner=self.user,
+                                               language=self.english) for i in range(6)]
+        self.other = TabooCard.objects.create(key_word='wort', black_list='a', owner=self.user, language=self.german)
+
+    def push(self, correct=(), incorrect=()):
+        return self.client.put('/api/statistics/push/', {
+            'correctly_ans_flashcards': [card.pk for card in correct],
+            'incorrectly_ans_flashcards': [card.pk for card in incorrect]}, format='json')
+
+    def test_sm2_intervals_and_ease(self):
+        now = timezone.now()
+        first = scheduler.schedule(2.5, 0, 0, 0, True, now)
+        second = scheduler.schedule(first['ease_factor'], first['interval'], first['repetitions'], 0, True, now)
+        third = scheduler.schedule(second['ease_factor'], second['interval'], second['repetitions'], 0, True, now)
+        self.assertEqual([first['interval'], second['interval'], third['interval']], [1, 6, 15])
+        lapse = scheduler.schedule(third['ease_factor'], third['interval'], third['repetitions'], 0, False, now)
+        self.assertEqual((lapse['interval'], lapse['repetitions'], lapse['lapses']), (1, 0, 1))
+        self.assertAlmostEqual(lapse['ease_factor'], 2.18)
+        self.assertEqual(lapse['due_at'], now + timedelta(days=1))
+
+    def test_push_records_outcomes_in_bulk(self):
+        self.push(correct=self.cards[:3], incorrect=self.cards[3:4])
+        with self.assertNumQueries(6):
+            scheduler.record_reviews(self.user, {'correctly_ans_flashcards': [card.pk for card in self.cards[:4]],
+                                                 'incorrectly_ans_flashcards': [self.cards[4].pk]})
+        reviews = {review.card_id: review for review in CardReview.objects.filter(user=self.user)}
+        self.assertEqual(len(reviews), 5)
+        self.assertEqual(reviews[self.cards[0].pk].interval, 6)
+        self.assertEqual(reviews[self.cards[3].pk].repetitions, 1)
+        self.assertEqual(reviews[self.cards[4].pk].lapses, 1)
+
+    def test_due_cards_come_before_new_cards(self):
+        self.push(incorrect=self.cards[2:3], correct=self.cards[:2])
+        CardReview.objects.filter(card=self.cards[2]).update(due_at=timezone.now() - timedelta(hours=1))
+
+        response = self.client.get('/api/flashcards/due/', {'count': 3, 'language_code': 'en'})
+        self.assertEqual([card['id'] for card in response.data],
+                         [self.cards[2].pk, self.cards[3].pk, self.cards[4].pk])
+        response = self.client.get('/api/flashcards/due/', {'count': 3, 'new': '0'})
+        self.assertEqual([card['id'] for card in response.data], [self.cards[2].pk])
+
+    def test_new_cards_seek_past_a_per_user_cursor(self):
+        self.push(correct=self.cards[:4])
+        self.assertEqual(scheduler.new_cards(self.user, 1, self.english.pk), [self.cards[4]])
+        cursor = NewCardCursor.objects.get(user=self.user, language_scope=self.english.pk)
+        self.assertEqual(cursor.last_card_id, self.cards[3].pk)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(scheduler.new_cards(self.user, 5, self.english.pk), self.cards[4:])
+        self.assertEqual(len(queries), 2)
+        self.assertIn(str(self.cards[3].pk), queries.captured_queries[1]['sql'])
+
+        self.push(correct=self.cards[4:])
+        self.assertEqual(scheduler.new_cards(self.user, 5, self.english.pk), [])
+        self.assertEqual(scheduler.new_cards(self.user, 5), [self.other])
+        cursor.refresh_from_db()
+        self.assertEqual(cursor.last_card_id, self.cards[-1].pk)
+
+
+class CardSnapshotTests(APITestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cards.bin')
+        settings_override = override_settings(CARD_SNAPSHOT={
+            'ENABLED': True, 'PATH': self.path, 'CHECK_INTERVAL': 0, 'REBUILD_ON_CHANGE': False})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(username='rita', password='secret')
+        self.client.force_authenticate(self.user)
+        self.english = Language.objects.create(name='English', language_code='en')
+        self.polish = Language.objects.create(name='Polski', language_code='pl')
+        self.cards = [TabooCard.objects.create(key_word='słowo%d' % i, black_list='jeden;dwa;trzy', owner=self.user,
+                                               language=self.polish, times_shown=4, answered_correctly=i % 5)
+                      for i in range(8)]
+        self.word = TabooCard.objects.create(key_word='word', black_list='one', owner=self.user,
+                                             language=self.english)
+        snapshot.build()
+
+    def test_random_cards_match_database_serialization_without_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/taboo/cards/random/', {'card_count': 5, 'language_id': self.polish.pk})
+        self.assertEqual(len(response.data), 5)
+        by_id = {card.pk: card for card in TabooCard.objects.select_related('language', 'owner')}
+        for row in response.data:
+            self.assertEqual(row, TabooCardSerializer(by_id[row['id']]).data)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/words/random')
+        self.assertEqual(response.status_code, 200)
+
+    def test_flashcards_are_served_from_difficulty_ranges(self):
+        hard = {card.pk for card in self.cards if card.difficulty_bucket == 'HARD'}
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/flashcards/', {'language_code': 'pl', 'difficulty': 'HARD', 'count': 15})
+        self.assertEqual({row['id'] for row in response.data}, hard)
+        self.assertEqual(response.data[0]['language'], 'pl')
+
+    def test_rebuilt_snapshot_is_picked_up(self):
+        first = snapshot.current()
+        card = TabooCard.objects.create(key_word='nowe', black_list='x', owner=self.user, language=self.english)
+        snapshot.build()
+        current = snapshot.current()
+        self.assertIsNot(current, first)
+        self.assertEqual([sample.pk for sample in current.sample(self.english.pk, 5, exclude={self.word.pk})],
+                         [card.pk])
+
+
+class BlackListSearchTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='sam', password='secret')
+        self.client.force_authenticate(self.user)
+        self.language = Language.objects.create(name='Polski', language_code='pl')
+
+    def create_card(self, key_word, black_list):
+        return TabooCard.objects.create(key_word=key_word, black_list=black_list, owner=self.user,
+                                        language=self.language)
+
+    def test_words_are_normalized_and_kept_in_sync(self):
+        card = self.create_card('Zamek', ' Król ; ZAMEK;;Wieża ')
+        self.assertEqual(list(card.forbidden_words.values_list('word', 'normalized')),
+                         [('Król', 'krol'), ('ZAMEK', 'zamek'), ('Wieża', 'wieza')])
+        card.black_list = 'brama'
+        card.save()
+        self.assertEqual(list(card.forbidden_words.values_list('normalized', flat=True)), ['brama'])
+
+    def test_bulk_import_creates_words(self):
+        response = self.client.post('/api/taboo/cards/bulk/', [
+            {'key_word': 'kot', 'black_list': ['mysz', 'mleko'], 'language': 'pl'},
+            {'key_word': 'pies', 'black_list': 'kość;smycz', 'language': 'pl'},
+        ], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(set(BlackListWord.objects.values_list('card__key_word', 'normalized')),
+                         {('kot', 'mysz'), ('kot', 'mleko'), ('pies', 'kosc'), ('pies', 'smycz')})
+
+    def test_bulk_import_reports_malformed_rows(self):
+        response_cache.get_backend().clear()
+        sampling.sampler.invalidate()
+        flashcards = {'language_code': 'pl', 'difficulty': 'NOT ENOUGH STATS', 'count': 5, 'seed': 1}
+        self.assertEqual(self.client.get('/api/flashcards/', flashcards).data, [])
+        response = self.client.post('/api/taboo/cards/bulk/', [
+            {'key_word': 'kot', 'black_list': {'a': 1}, 'language': 'pl'},
+            {'key_word': 'pies', 'black_list': 'kość', 'language': ['pl']},
+            {'key_word': ['mysz'], 'black_list': 'ser', 'language': 'pl'},
+            {'key_word': 'mysz', 'black_list': ['ser', 7], 'language': 'pl'},
+        ], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([(error['row'], sorted(error['errors'])) for error in response.data['errors']],
+                         [(1, ['black_list']), (2, ['language']), (3, ['key_word'])])
+        self.assertEqual(TabooCard.objects.get(key_word='mysz').black_list, 'ser;7')
+        self.assertEqual([row['word'] for row in self.client.get('/api/flashcards/', flashcards).data], ['mysz'])
+
+    def test_search_matches_key_words_and_forbidden_words(self):
+        castle = self.create_card('Zamek', 'Król;Wieża')
+        king = self.create_card('Korona', 'król;tron')
+        self.create_card('Rzeka', 'woda;most')
+
+        def search(term):
+            return {row['id'] for row in self.client.get('/api/taboo/cards/', {'search': term}).data}
+
+        self.assertEqual(search('krol'), {castle.pk, king.pk})
+        self.assertEqual(search('Wież'), {castle.pk})
+        self.assertEqual(search('zam'), {castle.pk})
+        self.assertEqual(search('"'), set())
+        king.black_list = 'korona;tron'
+        king.save()
+        self.assertEqual(search('krol'), {castle.pk})
+
+    def test_word_index_fallback_without_full_text_support(self):
+        castle = self.create_card('Zamek', 'Król;Wieża')
+        self.create_card('Rzeka', 'woda;most')
+        cafe = self.create_card('Café', 'kawa')
+        with mock.patch.dict(search._backends, {'default': 'words'}):
+            response = self.client.get('/api/taboo/cards/', {'search': 'KRÓ'})
+            self.assertEqual([row['id'] for row in response.data], [castle.pk])
+            for term in ('cafe', 'café', 'CAF'):
+                response = self.client.get('/api/taboo/cards/', {'search': term})
+                self.assertEqual([row['id'] for row in response.data], [cafe.pk])
+
+
+class DuplicateCardTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='sam', password='secret')
+        self.client.force_authenticate(self.user)
+        self.language = Language.objects.create(name='Polski', language_code='pl')
+
+    def create_card(self, key_word, times_shown=0, answered_correctly=0, owner=None):
+        return TabooCard.objects.create(key_word=key_word, black_list='jeden;dwa', owner=owner or self.user,
+                                        language=self.language, times_shown=times_shown,
+                                        answered_correctly=answered_correctly)
+
+    def test_key_word_is_normalized_on_save(self):
+        self.assertEqual(self.create_card('  Żółw  Morski ').normalized_key_word, 'zołw morski')
+
+    def test_create_can_skip_or_update_duplicates(self):
+        card = self.create_card('Zamek')
+        data = {'key_word': 'ZAMEK', 'black_list': 'brama', 'language': self.language.pk}
+
+        response = self.client.post('/api/taboo/cards/', dict(data, on_duplicate='skip'), format='json')
+        self.assertEqual((response.status_code, response.data['id']), (200, card.pk))
+        response = self.client.post('/api/taboo/cards/', dict(data, on_duplicate='update'), format='json')
+        self.assertEqual((response.status_code, response.data['black_list']), (200, ['brama']))
+        response = self.client.post('/api/taboo/cards/', data, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(TabooCard.objects.filter(normalized_key_word='zamek').count(), 2)
+
+        other = User.objects.create_user(username='kim', password='secret')
+        self.client.force_authenticate(other)
+        response = self.client.post('/api/taboo/cards/', dict(data, on_duplicate='update'), format='json')
+        self.assertEqual(response.status_code, 409)
+
+    def test_bulk_import_can_skip_duplicates(self):
+        self.create_card('kot')
+        response = self.client.post('/api/taboo/cards/bulk/?on_duplicate=skip', [
+            {'key_word': 'Kot', 'black_list': 'mysz', 'language': 'pl'},
+            {'key_word': 'pies', 'black_list': 'kość', 'language': 'pl'},
+            {'key_word': 'PIES', 'black_list': 'smycz', 'language': 'pl'},
+        ], format='json')
+        self.assertEqual((response.data['created'], response.data['skipped']), (1, 2))
+        self.assertEqual(TabooCard.objects.get(key_word='pies').normalized_key_word, 'pies')
+
+    def test_merge_sums_counters_and_moves_reviews(self):
+        kept = self.create_card('Zamek', times_shown=4, answered_correctly=4)
+        twin = self.create_card('zamek', times_shown=6, answered_correctly=1)
+        triplet = self.create_card('ZÁMEK', times_shown=2, answered_correctly=0)
+        other = self.create_card('Rzeka', times_shown=1, answered_correctly=1)
+        reviewer = User.objects.create_user(username='kim', password='secret')
+        now = timezone.now()
+        CardReview.objects.create(user=self.user, card=kept, language=self.language, due_at=now)
+        CardReview.objects.create(user=self.user, card=twin, language=self.language, due_at=now)
+        moved = CardReview.objects.create(user=reviewer, card=triplet, language=self.language, due_at=now)
+
+        out = StringIO()
+        call_command('merge_duplicate_cards', batch_size=1, stdout=out)
+        self.assertIn('Merged 2 duplicate cards into 1 cards', out.getvalue())
+        self.assertEqual(set(TabooCard.objects.values_list('pk', flat=True)), {kept.pk, other.pk})
+        kept.refresh_from_db()
+        self.assertEqual((kept.times_shown, kept.answered_correctly, kept.difficulty_bucket), (12, 5, 'HARD'))
+        self.assertEqual(set(CardReview.objects.values_list('user_id', 'card_id')),
+                         {(self.user.pk, kept.pk), (reviewer.pk, kept.pk)})
+        moved.refresh_from_db()
+        self.assertEqual(moved.card_id, kept.pk)
+        self.assertFalse(BlackListWord.objects.filter(card_id__in=[twin.pk, triplet.pk]).exists())
+
+
+@override_settings(SYNC={'MAX_CHANGES': 1000, 'SETTLE_SECONDS': 0, 'MAX_PUSHES': 2})
+class SyncTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='sam', password='secret')
+        self.friend = User.objects.create_user(username='kim', password='secret')
+        self.client.force_authenticate(self.user)
+        self.language = Language.objects.create(name='Polski', language_code='pl')
+        self.card = TabooCard.objects.create(key_word='kot', black_list='mysz', owner=self.user,
+                                             language=self.language)
+        self.achievement = Achievement.objects.create(condition='False', name='Never', font_awesome_icon='fa-x',
+                                                      level='1', score=10)
+
+    def sync(self, since=None):
+        response = self.client.get('/api/sync', {} if since is None else {'since': since})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_first_sync_returns_everything(self):
+        UserFollowing.objects.create(user=self.user, following=self.friend)
+        data = self.sync()
+        self.assertTrue(data['full'])
+        self.assertEqual([card['id'] for card in data['cards']['updated']], [self.card.pk])
+        self.assertEqual([row['id'] for row in data['languages']['updated']], [self.language.pk])
+        self.assertEqual([(row['id'], row['is_awarded']) for row in data['achievements']['updated']],
+                         [(self.achievement.pk, False)])
+        self.assertEqual(data['following']['updated'], [self.friend.pk])
+        self.assertEqual(data['version'], ChangeLogEntry.objects.order_by('-id').first().pk)
+
+    def test_snapshot_version_excludes_unsettled_changes(self):
+        with self.settings(SYNC={'MAX_CHANGES': 1000, 'SETTLE_SECONDS': 60, 'MAX_PUSHES': 2}):
+            data = self.sync()
+        self.assertEqual(data['version'], 0)
+        other = TabooCard.objects.create(key_word='pies', black_list='kość', owner=self.user,
+                                         language=self.language)
+        version = ChangeLogEntry.objects.filter(kind=ChangeLogEntry.CARD, object_id=self.card.pk).get().pk
+        data = self.sync(version)
+        self.assertFalse(data['full'])
+        self.assertEqual([card['id'] for card in data['cards']['updated']], [other.pk])
+
+    def test_delta_sync_returns_only_changes_and_tombstones(self):
+        version = self.sync()['version']
+        other = TabooCard.objects.create(key_word='pies', black_list='kość', owner=self.friend,
+                                         language=self.language)
+        self.card.black_list = 'mleko'
+        self.card.save()
+        UserFollowing.objects.create(user=self.user, following=self.friend)
+        self.user.achievements.add(self.achievement)
+        self.client.post('/api/languages/%d/subscribe/' % self.language.pk)
+
+        data = self.sync(version)
+        self.assertFalse(data['full'])
+        self.assertEqual([card['black_list'] for card in data['cards']['updated']], [['mleko']])
+        self.assertEqual(data['following']['updated'], [self.friend.pk])
+        self.assertEqual([row['is_awarded'] for row in data['achievements']['updated']], [True])
+        self.assertEqual([row['is_subscribed'] for row in data['languages']['updated']], [True])
+
+        version = data['version']
+        card_pk = self.card.pk
+        self.card.delete()
+        other.delete()
+        UserFollowing.objects.filter(user=self.user).delete()
+        data = self.sync(version)
+        self.assertEqual((data['cards'], data['following']),
+                         ({'updated': [], 'deleted': [card_pk]}, {'updated': [], 'deleted': [self.friend.pk]}))
+        self.assertEqual(self.sync(data['version'])['cards'], {'updated': [], 'deleted': []})
+
+    def test_changes_are_paged(self):
+        version = self.sync()['version']
+        for word in ('pies', 'ryba', 'kura'):
+            TabooCard.objects.create(key_word=word, black_list='a', owner=self.user, language=self.language)
+        with self.settings(SYNC={'MAX_CHANGES': 2, 'SETTLE_SECONDS': 0, 'MAX_PUSHES': 2}):
+            first = self.sync(version)
+            second = self.sync(first['version'])
+        self.assertTrue(first['has_more'])
+        self.assertFalse(second['has_more'])
+        self.assertEqual([card['key_word'] for card in first['cards']['updated'] + second['cards']['updated']],
+                         ['pies', 'ryba', 'kura'])
+
+    def test_prune_keeps_the_latest_entry_per_object(self):
+        for word in ('pies', 'ryba'):
+            self.card.key_word = word
+            self.card.save()
+        call_command('prune_change_log', stdout=StringIO())
+        self.assertEqual(ChangeLogEntry.objects.filter(kind=ChangeLogEntry.CARD, object_id=self.card.pk).count(), 1)
+        self.assertEqual(self.sync(1)['cards']['updated'][0]['key_word'], 'ryba')
+
+    def test_offline_pushes_are_applied_together(self):
+        response = self.client.post('/api/sync', {'pushes': [
+            {'correctly_swiped_cards': [self.card.pk], 'translated_words': 2},
+            {'incorrectly_swiped_cards': [self.card.pk], 'translated_words': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 202)
+        statistic = Statistic.objects.get(user=self.user)
+        self.assertEqual((statistic.swiped_taboo_cards, statistic.correctly_swiped_taboo_cards,
+                          statistic.translated_words), (2, 1, 3))
+        self.card.refresh_from_db()
+        self.assertEqual((self.card.times_shown, self.card.answered_correctly), (2, 1))
+
+        response = self.client.post('/api/sync', {'pushes': [{}, {}, {}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class BatchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='sam', password='secret')
+        self.friend = User.objects.create_user(username='kim', password='secret')
+        self.client.force_authenticate(self.user)
+        self.language = Language.objects.create(name='Polski', language_code='pl')
+
+    def test_operations_run_in_order_with_deferred_achievements(self):
+        operations = [
+            {'method': 'PUT', 'path': '/api/statistics/push/', 'body': {'translated_words': 2}},
+            {'method': 'POST', 'path': '/api/languages/%d/subscribe/' % self.language.pk},
+            {'method': 'POST', 'path': '/api/users/%d/follow/' % self.friend.pk},
+            {'method': 'GET', 'path': '/api/users/me/'},
+        ]
+        with mock.patch.object(engine, 'grant', wraps=engine.grant) as grant, \
+                mock.patch.object(engine, 'grant_many', wraps=engine.grant_many) as grant_many:
+            response = self.client.post('/api/batch', {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['committed'])
+        self.assertEqual([result['status'] for result in response.data['results']], [202, 201, 201, 200])
+        me = response.data['results'][3]['body']
+        self.assertEqual(([language['id'] for language in me['selected_languages']],
+                          [following['id'] for following in me['following']]),
+                         ([self.language.pk], [self.friend.pk]))
+        self.assertEqual((grant.call_count, grant_many.call_count), (0, 1))
+
+    def test_atomic_batch_rolls_back_on_failure(self):
+        response = self.client.post('/api/batch', {'atomic': True, 'operations': [
+            {'method': 'PUT', 'path': '/api/statistics/push/', 'body': {'translated_words': 2}},
+            {'method': 'POST', 'path': '/api/users/0/follow/'},
+            {'method': 'GET', 'path': '/api/users/me/'},
+        ]}, format='json')
+        self.assertFalse(response.data['committed'])
+        self.assertEqual([result['status'] for result in response.data['results']], [202, 404])
+        self.assertEqual(Statistic.objects.get(user=self.user).translated_words, 0)
+
+    @override_settings(BATCH={'MAX_OPERATIONS': 2})
+    def test_limits_and_validation(self):
+        operation = {'method': 'GET', 'path': '/api/users/me/'}
+        for operations in ([operation] * 3, [{'method': 'GET', 'path': '/admin/'}], [{'method': 'TRACE',
+                                                                                      'path': '/api/users/me/'}]):
+            response = self.client.post('/api/batch', {'operations': operations}, format='json')
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/batch', {'operations': [{'path': '/api/batch'}, {'path': '/api/nope'}]},
+                                    format='json')
+        self.assertEqual([result['status'] for result in response.data['results']], [400, 404])
+
+    def test_streamed_lists_are_rejected(self):
+        response = self.client.post('/api/batch', {'operations': [
+            {'path': '/api/languages/?stream=ndjson'}, {'path': '/api/languages/'}]}, format='json')
+        self.assertEqual([result['status'] for result in response.data['results']], [400, 200])
+        self.assertIn('cannot be batched', response.data['results'][0]['body']['detail'])
+
+
+class AsgiHandlerTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='erin', password='secret')
+        self.token = Token.objects.create(user=self.user)
+        self.language = Language.objects.create(name='English', language_code='en')
+        self.handler = AsgiHandler(get_wsgi_application(), threads=2, queue_size=1)
+
+    def call(self, method, path, chunks=(b'',), query_string=b''):
+        messages = [{'type': 'http.request', 'body': chunk, 'more_body': index < len(chunks) - 1}
+                    for index, chunk in enumerate(chunks)]
+        sent = []
+
+        async def receive():
+            return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string,
+                 'headers': [(b'host', b'testserver'), (b'content-type', b'application/json'),
+                             (b'authorization', ('Token %s' % self.token.key).encode('latin-1'))]}
+        asyncio.run(self.handler(scope, receive, send))
+        return sent
+
+    def test_request_body_is_read_before_dispatch(self):
+        sent = self.call('PUT', '/api/users/me/', (b'{"first_', b'name": "Erin"}'))
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertEqual(json.loads(sent[1]['body'].decode('utf-8'))['first_name'], 'Erin')
+        self.assertEqual(User.objects.get(pk=self.user.pk).first_name, 'Erin')
+
+    def test_streaming_responses_are_sent_in_chunks(self):
+        for i in range(3):
+            TabooCard.objects.create(key_word='word %d' % i, black_list='a', owner=self.user, language=self.language)
+        with mock.patch('api.views.TabooCardViewSet.stream_chunk_size', 1):
+            sent = self.call('GET', '/api/taboo/cards/', query_string=b'stream=ndjson')
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertGreater(len(sent), 3)
+        body = b''.join(message.get('body', b'') for message in sent[1:])
+        self.assertEqual(len(body.splitlines()), 3)
+        self.assertFalse(sent[-1].get('more_body', False))
+
+    def test_disconnect_before_the_body_skips_dispatch(self):
+        self.assertEqual(self.call('POST', '/api/sync', ()), [])
+
+    def test_headers_are_mapped_like_a_wsgi_server(self):
+        environ = environ_for({'method': 'GET', 'path': '/', 'headers': [
+            (b'cookie', b'a=1'), (b'cookie', b'b=2'), (b'accept', b'text/html'), (b'accept', b'*/*'),
+            (b'x-user', b'erin'), (b'x_user', b'admin')]}, None, 0)
+        self.assertEqual((environ['HTTP_COOKIE'], environ['HTTP_ACCEPT'], environ['HTTP_X_USER']),
+                         ('a=1; b=2', 'text/html,*/*', 'erin'))
+
+
+@override_settings(DATABASE_CONNECTIONS={'REPLICA': 'replica', 'REPLICA_READS': True, 'PIN_SECONDS': 5,
+                                         'HEALTH_CHECKS': True})
+class ReplicaRoutingTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        response_cache.get_backend().clear()
+        self.user = User.objects.create_user(username='frank', password='secret')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token %s' % self.token.key)
+
+    def get_me(self):
+        with CaptureQueriesContext(connections['default']) as primary:
+            with CaptureQueriesContext(connections['replica']) as replica:
+                response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, 200)
+        return len(primary), len(replica)
+
+    def test_reads_go_to_the_replica(self):
+        primary, replica = self.get_me()
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_callers_are_pinned_to_the_primary_after_writes(self):
+        response = self.client.put('/api/users/me/', {'first_name': 'Frank'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        primary, replica = self.get_me()
+        self.assertEqual(replica, 0)
+        self.assertGreater(primary, 0)
+
+        other = User.objects.create_user(username='grace', password='secret')
+        self.client.credentials(HTTP_AUTHORIZATION='Token %s' % Token.objects.create(user=other).key)
+        primary, replica = self.get_me()
+        self.assertEqual(primary, 0)
+
+    def test_pins_are_carried_in_a_cookie(self):
+        response = self.client.put('/api/users/me/', {'first_name': 'Frank'}, format='json')
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+        cache.clear()
+        primary, replica = self.get_me()
+        self.assertEqual(replica, 0)
+
+    def test_writes_never_use_the_replica(self):
+        router = PrimaryReplicaRouter()
+        routers.begin('replica')
+        try:
+            self.assertEqual(router.db_for_read(User), 'replica')
+            self.assertEqual(router.db_for_write(User), 'default')
+            self.assertEqual(router.db_for_read(User), 'default')
+        finally:
+            self.assertTrue(routers.end())
+        self.assertFalse(router.allow_migrate('replica', 'api'))
+
+
+class ConnectionPoolTests(TestCase):
+    def wrapper(self, alias, size=1):
+        settings_dict = dict(connections['default'].settings_dict, POOL={'SIZE': size, 'TIMEOUT': 0.05})
+        wrapper = PooledSqliteWrapper(settings_dict, alias)
+        self.addCleanup(lambda: db_connections.get_pool(alias, settings_dict).close_idle())
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_connections_are_reused(self):
+        wrapper = self.wrapper('pooled-reuse')
+        wrapper.ensure_connection()
+        raw = wrapper.connection
+        wrapper.close()
+        wrapper.ensure_connection()
+        self.assertIs(wrapper.connection, raw)
+
+    def test_pool_is_bounded(self):
+        first, second = self.wrapper('pooled-bounded'), self.wrapper('pooled-bounded')
+        first.ensure_connection()
+        with self.assertRaises(OperationalError):
+            second.ensure_connection()
+        first.close()
+        second.ensure_connection()
+
+    def test_broken_connections_are_replaced(self):
+        wrapper = self.wrapper('pooled-broken')
+        wrapper.ensure_connection()
+        raw = wrapper.connection
+        wrapper.close()
+        raw.close()
+        wrapper.ensure_connection()
+        self.assertIsNot(wrapper.connection, raw)
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+
+
+class AchievementConditionTests(TestCase):
+    def setUp(self):
+        engine.invalidate()
+        self.language = Language.objects.create(name='English', language_code='en')
+        self.badge = Achievement.objects.create(name='Badge', condition='False', font_awesome_icon='fa-star',
+                                                level='1', score=1)
+        self.users = [User.objects.create_user(username='user%d' % i, password='secret') for i in range(4)]
+        for i, user in enumerate(self.users):
+            Statistic.objects.filter(user=user).update(translated_words=i * 10, ans_flashcards=i)
+        UserFollowing.objects.create(user=self.users[0], following=self.users[1])
+        UserFollowing.objects.create(user=self.users[2], following=self.users[1])
+        self.language.users.add(self.users[3])
+        self.badge.users.add(self.users[2])
+
+    def matching(self, text):
+        condition = Condition(text)
+        users = User.objects.filter(pk__in=[user.pk for user in self.users])
+        in_python = {user.pk for user in users.select_related('statistics') if condition.evaluate(user)}
+        in_sql = set(condition.filter(users).values_list('pk', flat=True))
+        self.assertEqual(in_python, in_sql)
+        return {self.users.index(user) for user in self.users if user.pk in in_sql}
+
+    def test_python_and_sql_agree(self):
+        self.assertEqual(self.matching('user.statistics.translated_words >= 20'), {2, 3})
+        self.assertEqual(self.matching('10 <= statistics.translated_words < 30'), {1, 2})
+        self.assertEqual(self.matching('statistics.translated_words - statistics.ans_flashcards * 9 == 2'), {2})
+        self.assertEqual(self.matching('followers >= 2 or languages > 0'), {1, 3})
+        self.assertEqual(self.matching('user.following.count() == 1 and not has_achievement(%d)' % self.badge.pk),
+                         {0})
+        self.assertEqual(self.matching('achievements != 0'), {2})
+        self.assertEqual(self.matching('False'), set())
+
+    def test_dependencies_are_extracted(self):
+        condition = Condition('user.statistics.swiped_taboo_cards >= 2 and followers > 1')
+        self.assertEqual(condition.statistic_fields, {'swiped_taboo_cards'})
+        self.assertEqual(condition.dependencies, {'swiped_taboo_cards', 'followers'})
+
+    def test_arbitrary_python_is_rejected(self):
+        for text in ("__import__('os').system('true')", 'user.password == 1', 'user.statistics.unknown >= 1',
+                     'statistics.score', 'statistics.score >= "1"', 'user.statistics.score >= 1 if True else 0',
+                     'statistics.score >= (1'):
+            with self.assertRaises(ConditionError):
+                parse(text)
+
+    def test_admin_form_validates_conditions(self):
+        data = {'name': 'Bad', 'font_awesome_icon': 'fa-x', 'level': '1', 'score': 1, 'condition': 'open("x")'}
+        form = AchievementAdminForm(data=data)
+        self.assertFalse(form.is_valid())
+        self.assertIn('condition', form.errors)
+        form = AchievementAdminForm(data=dict(data, condition='statistics.score >= 1'))
+        self.assertTrue(form.is_valid())
+
+    def test_backfill_awards_qualifying_users(self):
+        achievement = Achievement.objects.create(name='Linguist', font_awesome_icon='fa-language', level='2', score=7,
+                                                 condition='statistics.translated_words >= 20')
+        achievement.users.add(self.users[3])
+        scores = dict(Statistic.objects.values_list('user_id', 'score'))
+
+        out = StringIO()
+        call_command('backfill_achievement', str(achievement.pk), stdout=out)
+
+        self.assertIn('to 1 users', out.getvalue())
+        self.assertEqual(set(achievement.users.all()), {self.users[2], self.users[3]})
+        self.assertEqual(Statistic.objects.get(user=self.users[2]).score, scores[self.users[2].pk] + 7)
+        self.assertEqual(Statistic.objects.get(user=self.users[3]).score, scores[self.users[3].pk])
+        self.assertFalse(achievements.newly_qualified(achievement).exists())
+
+    def test_backfill_does_not_double_count_a_concurrent_grant(self):
+        achievement = Achievement.objects.create(name='Linguist', font_awesome_icon='fa-language', level='2', score=7,
+                                                 condition='statistics.translated_words >= 20')
+        scores = dict(Statistic.objects.values_list('user_id', 'score'))
+        insert_awards = achievements.insert_awards
+
+        def raced_insert_awards(through, awarded):
+            through.objects.create(user=self.users[2], achievement=achievement)
+            leaderboard.shift_scores([self.users[2].pk], achievement.score)
+            return insert_awards(through, awarded)
+
+        with mock.patch.object(achievements, 'insert_awards', side_effect=raced_insert_awards):
+            self.assertEqual(achievements.backfill(achievement), [self.users[3].pk])
+        self.assertEqual(set(achievement.users.all()), {self.users[2], self.users[3]})
+        for user in self.users[2:4]:
+            self.assertEqual(Statistic.objects.get(user=user).score, scores[user.pk] + 7)
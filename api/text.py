@@ -0,0 +1,14 @@
+import re
+import unicodedata
+
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', str(text or ''))
+    text = ''.join(character for character in text if not unicodedata.combining(character))
+    return WHITESPACE.sub(' ', text).strip().casefold()
+
+
+def split_black_list(black_list):
+    return [word.strip() for word in str(black_list or '').split(';') if word.strip()]
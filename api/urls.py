@@ -9,8 +9,13 @@ router.register(r'languages', views.LanguageViewSet, base_name='languages')
 router.register(r'statistics', views.StatisticsViewSet, base_name='statistics')
 router.register(r'taboo/cards', views.TabooCardViewSet, base_name='taboo_cards')
 router.register(r'flashcards', views.FlashCardViewSet, base_name='flashcards')
+router.register(r'achievements', views.AchievementViewSet)
+router.register(r'leaderboard', views.LeaderboardViewSet, base_name='leaderboard')
 
 urlpatterns = [
     url('', include(router.urls)),
-    path('words/random', views.RandomWordView.as_view()),
+    path('words/random', views.RandomWordView.as_view(), name='words-random'),
+    path('batch', views.BatchView.as_view(), name='batch'),
+    path('sync', views.SyncView.as_view(), name='sync'),
+    path('_metrics', views.MetricsView.as_view(), name='metrics'),
 ]
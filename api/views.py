@@ -1,64 +1,99 @@
-import random
+import codecs
+import io
 
 from django.contrib.auth.models import User
+from django.http import HttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, mixins
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import action
-from django.db.models import Max
 from rest_framework.generics import get_object_or_404
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from rest_framework import filters
+from rest_framework.permissions import IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet
 
-from .models import Language, UserFollowing, Statistic, TabooCard
+from . import (
+    batch, cards_io, counters, duplicates, follows, languages, leaderboard, metrics, response_cache, sampling,
+    scheduler, search, snapshot, sync)
+from .authentication import CachedTokenAuthentication, token_cache
+from .models import Achievement, Language, TabooCard
+from .pagination import StreamingListMixin
+from .parsers import RawStreamParser
+from .response_cache import cache_response
 from .serializers import (
-    UserFullSerializer, LanguageSerializer, UserAchievementSerializer,
-    UserBaseSerializer, StatisticSerializer, TabooCardSerializer, FlashCardSerializer, RandomWordSerializer)
+    AchievementBaseSerializer, UserFullSerializer, LanguageListSerializer, UserAchievementSerializer,
+    UserBaseSerializer, StatisticSerializer, TabooCardSerializer, FlashCardSerializer, RandomWordSerializer,
+    LeaderboardEntrySerializer)
 
 
-class UserViewSet(mixins.ListModelMixin,
+class UserViewSet(StreamingListMixin,
+                  mixins.ListModelMixin,
                   mixins.RetrieveModelMixin,
                   GenericViewSet):
     queryset = User.objects.all()
+    keyset_ordering = ('id',)
     serializer_class = UserAchievementSerializer
     filter_backends = (DjangoFilterBackend, filters.SearchFilter)
     filter_fields = ('id', 'username')
     search_fields = ('username', 'email')
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
 
+    def get_queryset(self):
+        return (User.objects.all()
+                .select_related('statistics')
+                .prefetch_related('achievements', 'selected_languages'))
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        user = self.request.user
+        if user.is_authenticated:
+            context['following_ids'] = follows.following_ids(user)
+            context['subscribed_language_ids'] = languages.subscribed_language_ids(user)
+        return context
+
+    @cache_response(response_cache.USERS, response_cache.ACHIEVEMENTS, response_cache.AWARDS,
+                    response_cache.LANGUAGES, response_cache.follows_of_requester,
+                    response_cache.languages_of_requester)
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
-        serializer = UserAchievementSerializer(instance, context={"request": request}, many=False)
+        serializer = self.get_serializer(instance, many=False)
         return Response(serializer.data)
 
     @action(detail=True, methods=['post'])
     def follow(self, request, *args, **kwargs):
-        user = request.user
-        new_following = self.get_object()
-        following = get_object_or_404(User, pk=new_following.pk)
-        UserFollowing.objects.create(user=user, following=following)
+        following = get_object_or_404(User, pk=kwargs['pk'])
+        _, created = follows.follow(request.user, following)
 
-        return Response(status=status.HTTP_201_CREATED)
+        return Response(status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
     @action(detail=True, methods=['post'])
     def unfollow(self, request, *args, **kwargs):
-        user = request.user
-        following = self.get_object()
-        user_following = get_object_or_404(UserFollowing, user=user, following=following)
-        user_following.delete()
+        following = get_object_or_404(User, pk=kwargs['pk'])
+        follows.unfollow(request.user, following)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def list_users(self, queryset, user_of=lambda user: user):
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = UserBaseSerializer([user_of(row) for row in page], many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = UserBaseSerializer([user_of(row) for row in queryset.order_by('id')], many=True)
+        return Response(serializer.data)
+
     @action(detail=False, methods=['get'])
     def followings(self, request, *args, **kwargs):
-        user = request.user
-        followings = []
-        for follow in user.following.all():
-            followings.append(follow.following)
-        serializer = UserBaseSerializer(followings, many=True)
-        return Response(serializer.data)
+        return self.list_users(follows.followings(request.user), lambda follow: follow.following)
+
+    @action(detail=False, methods=['get'])
+    def followers(self, request, *args, **kwargs):
+        return self.list_users(follows.followers(request.user), lambda follow: follow.user)
+
+    @action(detail=False, methods=['get'])
+    def mutuals(self, request, *args, **kwargs):
+        return self.list_users(follows.mutuals(request.user))
 
     @action(detail=False, methods=['get', 'put'])
     def me(self, request, *args, **kwargs):
@@ -78,7 +113,7 @@ class UserViewSet(mixins.ListModelMixin,
             if last_name:
                 user.last_name = last_name
 
-            user.save()
+            user.save(update_fields=['first_name', 'last_name'])
 
             serializer = UserFullSerializer(user, context={"request": request}, many=False)
             return Response(serializer.data)
@@ -86,16 +121,36 @@ class UserViewSet(mixins.ListModelMixin,
             return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
-class LanguageViewSet(mixins.ListModelMixin,
+class LanguageViewSet(StreamingListMixin,
+                      mixins.ListModelMixin,
                       mixins.RetrieveModelMixin,
                       GenericViewSet):
     queryset = Language.objects.all().order_by('name')
-    serializer_class = LanguageSerializer
-    authentication_classes = (TokenAuthentication,)
+    keyset_ordering = ('name', 'id')
+    serializer_class = LanguageListSerializer
+    authentication_classes = (CachedTokenAuthentication,)
+
+    def get_queryset(self):
+        return languages.languages_with_counts()
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['subscribed_language_ids'] = languages.subscribed_language_ids(self.request.user)
+        return context
+
+    @cache_response(response_cache.LANGUAGES, response_cache.languages_of_requester,
+                    condition=lambda request: 'stream' not in request.query_params)
     def list(self, request, *args, **kwargs):
-        serializer = LanguageSerializer(self.queryset, context={"request": request}, many=True)
-        return Response(serializer.data)
+        if (request.query_params.get(self.stream_query_param)
+                or (self.paginator is not None and self.paginator.is_requested(request))):
+            return super().list(request, *args, **kwargs)
+
+        rows = languages.cached_language_rows(
+            lambda queryset: LanguageListSerializer(queryset, context={'subscribed_language_ids': set()},
+                                                    many=True).data)
+        subscribed_language_ids = languages.subscribed_language_ids(request.user)
+        data = [dict(row, is_subscribed=row['id'] in subscribed_language_ids) for row in rows]
+        return Response(data)
 
     @action(detail=True, methods=['post'])
     def subscribe(self, request, *args, **kwargs):
@@ -103,7 +158,6 @@ class LanguageViewSet(mixins.ListModelMixin,
         language = self.get_object()
 
         user.selected_languages.add(language)
-        user.save()
 
         return Response(status=status.HTTP_201_CREATED)
 
@@ -113,32 +167,90 @@ class LanguageViewSet(mixins.ListModelMixin,
         language = self.get_object()
 
         user.selected_languages.remove(language)
-        user.save()
 
         return Response(status=status.HTTP_201_CREATED)
 
 
-class TabooCardViewSet(mixins.ListModelMixin,
+class TabooCardViewSet(StreamingListMixin,
+                       mixins.ListModelMixin,
                        mixins.CreateModelMixin,
                        GenericViewSet):
     serializer_class = TabooCardSerializer
-    authentication_classes = (TokenAuthentication,)
+    keyset_ordering = ('language_id', 'key_word', 'id')
+    authentication_classes = (CachedTokenAuthentication,)
 
     def get_queryset(self):
-        return self.request.user.cards.all().order_by('language', 'key_word',)
+        cards = self.request.user.cards.all().select_related('language', 'owner').order_by('language', 'key_word',)
+        term = self.request.query_params.get('search', None)
+        if term:
+            cards = search.search_cards(cards, term)
+        return cards
 
     @action(detail=False, methods=['get'])
     def random(self, request, *args, **kwargs):
-        count = request.query_params.get('card_count', 0)
-        language_id = request.query_params.get('language_id', 0)
-        cards = TabooCard.objects.filter(language__pk=language_id)[:int(count)]
+        errors = {}
+        try:
+            count = int(request.query_params.get('card_count', 0))
+        except ValueError:
+            errors['card_count'] = ['A valid integer is required.']
+        try:
+            language_id = int(request.query_params.get('language_id', 0))
+        except ValueError:
+            errors['language_id'] = ['A valid integer is required.']
+        try:
+            exclude = [int(pk) for pk in request.query_params.get('exclude', '').split(',') if pk]
+        except ValueError:
+            errors['exclude'] = ['Expected a comma-separated list of card ids.']
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        seed = request.query_params.get('seed', None)
+        session = request.query_params.get('session', None)
+        cards = sampling.sample_cards(request.user, language_id, count,
+                                      seed=seed, exclude=exclude, session=session)
 
         serializer = TabooCardSerializer(cards, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'], url_path='bulk', parser_classes=(JSONParser, RawStreamParser))
+    def bulk(self, request, *args, **kwargs):
+        content_type = request.content_type.split(';')[0].strip()
+        if content_type == 'application/json':
+            rows = request.data if isinstance(request.data, list) else [request.data]
+            rows = enumerate(rows, start=1)
+        else:
+            input_format = 'csv' if content_type == 'text/csv' else 'ndjson'
+            stream = request.data if hasattr(request.data, 'read') else io.BytesIO()
+            reader = codecs.getreader(request.encoding or 'utf-8')(stream)
+            rows = cards_io.read_rows(reader, input_format)
+
+        skip_duplicates = request.query_params.get('on_duplicate') == 'skip'
+        result = cards_io.import_cards(rows, request.user, skip_duplicates=skip_duplicates)
+        if result['created'] or not result['errors']:
+            return Response(result, status=status.HTTP_201_CREATED)
+        return Response(result, status=status.HTTP_400_BAD_REQUEST)
+
     def create(self, request, *args, **kwargs):
         user = request.user
         language = get_object_or_404(Language, pk=request.data.get('language', 0))
+        on_duplicate = request.data.get('on_duplicate', request.query_params.get('on_duplicate', 'create'))
+        if on_duplicate not in ('create', 'skip', 'update'):
+            return Response({'on_duplicate': ['Expected one of: create, skip, update.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if on_duplicate != 'create':
+            existing = duplicates.find_duplicate(language.pk, request.data.get('key_word'))
+            if existing is not None:
+                if on_duplicate == 'update':
+                    if existing.owner_id != user.pk:
+                        return Response({'id': existing.pk, 'detail': 'The card belongs to another user.'},
+                                        status=status.HTTP_409_CONFLICT)
+                    existing.key_word = request.data.get('key_word')
+                    existing.black_list = request.data.get('black_list')
+                    existing.save(update_fields=['key_word', 'black_list'])
+                serializer = self.get_serializer(existing)
+                return Response(serializer.data, status=status.HTTP_200_OK)
+
         card = TabooCard(owner=user, times_shown=0, answered_correctly=0,
                          key_word=request.data.get('key_word'),
                          black_list=request.data.get('black_list'),
@@ -150,71 +262,175 @@ class TabooCardViewSet(mixins.ListModelMixin,
 
 class StatisticsViewSet(GenericViewSet):
     serializer_class = StatisticSerializer
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
 
     @action(detail=False, methods=['put'])
     def push(self, request, *args, **kwargs):
-        user = request.user
-        statistic = get_object_or_404(Statistic, user=user)
+        counters.push_statistics(request.user, request.data)
+
+        return Response(status=status.HTTP_202_ACCEPTED)
 
-        correctly_swiped_cards = request.data.get('correctly_swiped_cards', [])
-        incorrectly_swiped_cards = request.data.get('incorrectly_swiped_cards', [])
-        statistic.correctly_swiped_taboo_cards += len(correctly_swiped_cards)
-        statistic.swiped_taboo_cards += len(correctly_swiped_cards) + len(incorrectly_swiped_cards)
 
-        correctly_ans_flashcards = request.data.get('correctly_ans_flashcards', [])
-        incorrectly_ans_flashcards = request.data.get('incorrectly_ans_flashcards', [])
-        statistic.correctly_ans_flashcards += len(correctly_ans_flashcards)
-        statistic.ans_flashcards += len(correctly_ans_flashcards) + len(incorrectly_ans_flashcards)
+class AchievementViewSet(mixins.ListModelMixin,
+                         mixins.RetrieveModelMixin,
+                         GenericViewSet):
+    queryset = Achievement.objects.all().order_by('id')
+    serializer_class = AchievementBaseSerializer
+    authentication_classes = (CachedTokenAuthentication,)
 
-        translated_words = request.data.get('translated_words', 0)
-        statistic.translated_words += translated_words
+    @cache_response(response_cache.ACHIEVEMENTS)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
-        statistic.save()
+    @cache_response(response_cache.ACHIEVEMENTS)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
-        cards_to_update = TabooCard.objects.filter(pk__in=correctly_swiped_cards+incorrectly_swiped_cards)
-        for card in cards_to_update:
-            card.times_shown += 1
-            if card.pk in correctly_swiped_cards:
-                card.answered_correctly += 1
-            card.save()
 
-        return Response(status=status.HTTP_202_ACCEPTED)
+class LeaderboardViewSet(GenericViewSet):
+    serializer_class = LeaderboardEntrySerializer
+    authentication_classes = (CachedTokenAuthentication,)
+
+    def list(self, request, *args, **kwargs):
+        language_id = request.query_params.get('language_id') or None
+        if language_id is not None:
+            try:
+                language_id = int(language_id)
+            except ValueError:
+                return Response({'language_id': ['A valid integer is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        entries = leaderboard.top(request.query_params.get('limit'), language_id)
+        serializer = self.get_serializer(entries, many=True)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def friends(self, request, *args, **kwargs):
+        entries = leaderboard.friends(request.user, follows.following_ids(request.user),
+                                      request.query_params.get('limit'))
+        serializer = self.get_serializer(entries, many=True)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def me(self, request, *args, **kwargs):
+        rank, score = leaderboard.rank_of(request.user)
+        if rank is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response({'rank': rank, 'score': score})
 
 
 class FlashCardViewSet(mixins.ListModelMixin,
                        GenericViewSet):
     queryset = TabooCard.objects.all()
     serializer_class = FlashCardSerializer
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
 
+    @cache_response(response_cache.CARDS, response_cache.LANGUAGES,
+                    condition=lambda request: 'seed' in request.query_params)
     def list(self, request, *args, **kwargs):
         language_code = request.query_params.get('language_code', None)
         difficulty = request.query_params.get('difficulty', None)
         count = request.query_params.get('count', None)
+        seed = request.query_params.get('seed', None)
 
         if language_code and difficulty:
-            cards = TabooCard.objects.filter(
-                language__language_code=language_code)
-            flashcards = list(filter(lambda x: x.difficulty == difficulty, cards))[:int(min([int(count), 15]))]
+            errors = {}
+            if difficulty not in dict(TabooCard.DIFFICULTY_CHOICES):
+                errors['difficulty'] = ['"%s" is not a valid choice.' % difficulty]
+            try:
+                count = min([int(count), 15])
+            except (TypeError, ValueError):
+                errors['count'] = ['A valid integer is required.']
+            if errors:
+                return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+            cards_snapshot = snapshot.current()
+            if cards_snapshot is not None:
+                flashcards = cards_snapshot.sample_bucket(language_code, difficulty, count, seed)
+                serializer = FlashCardSerializer(flashcards, many=True)
+                return Response(data=serializer.data, status=status.HTTP_200_OK)
+
+            language_id = Language.objects.filter(language_code=language_code).values_list('pk', flat=True).first()
+            flashcards = []
+            if language_id is not None:
+                flashcards = sampling.sampler.sample(language_id, count, seed=seed, bucket=difficulty)
             serializer = FlashCardSerializer(flashcards, many=True)
 
             return Response(data=serializer.data, status=status.HTTP_200_OK)
         else:
             return Response(status=status.HTTP_404_NOT_FOUND)
 
+    @action(detail=False, methods=['get'])
+    def due(self, request, *args, **kwargs):
+        language_id = request.query_params.get('language_id', None)
+        language_code = request.query_params.get('language_code', None)
+        if language_code and not language_id:
+            language_id = Language.objects.filter(language_code=language_code).values_list('pk', flat=True).first()
+            if language_id is None:
+                return Response(status=status.HTTP_404_NOT_FOUND)
+
+        cards = scheduler.due_cards(request.user, request.query_params.get('count', None), language_id,
+                                    include_new=request.query_params.get('new', '1') != '0')
+        serializer = FlashCardSerializer(cards, many=True)
+        return Response(data=serializer.data, status=status.HTTP_200_OK)
+
 
 class RandomWordView(APIView):
     serializer_class = RandomWordSerializer
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
 
     def get(self, request, *args, **kwargs):
-        max_id = TabooCard.objects.all().aggregate(max_id=Max("id"))['max_id']
-        pk = random.randint(1, max_id)
-        word = TabooCard.objects.filter(pk=pk).first()
+        words = sampling.card_source().sample(sampling.ALL_LANGUAGES, 1)
+        word = words[0] if words else None
 
         if word:
             serializer = self.serializer_class(word, many=False)
             return Response(data=serializer.data, status=status.HTTP_200_OK)
         else:
             return Response(status=status.HTTP_404_NOT_FOUND)
+
+
+class SyncView(APIView):
+    authentication_classes = (CachedTokenAuthentication,)
+
+    def get(self, request, *args, **kwargs):
+        try:
+            since = int(request.query_params.get('since', 0))
+        except ValueError:
+            return Response({'since': ['A valid integer is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(sync.changes_since(request.user, since))
+
+    def post(self, request, *args, **kwargs):
+        pushes = request.data.get('pushes') if isinstance(request.data, dict) else None
+        max_pushes = sync.sync_options()['MAX_PUSHES']
+        if not isinstance(pushes, list) or not all(isinstance(push, dict) for push in pushes):
+            return Response({'pushes': ['Expected a list of statistics pushes.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(pushes) > max_pushes:
+            return Response({'pushes': ['Ensure this list has no more than %d pushes.' % max_pushes]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        counters.push_many(request.user, pushes)
+        return Response({'applied': len(pushes)}, status=status.HTTP_202_ACCEPTED)
+
+
+class BatchView(APIView):
+    authentication_classes = (CachedTokenAuthentication,)
+
+    def post(self, request, *args, **kwargs):
+        errors = batch.validate(request.data)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response(batch.run(request, request.data['operations'], atomic=bool(request.data.get('atomic'))))
+
+
+class MetricsView(APIView):
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, *args, **kwargs):
+        stats = token_cache.stats()
+        body = metrics.render_prometheus((
+            ('api_token_cache_hits_total', 'counter', 'Token lookups answered from the cache.', stats['hits']),
+            ('api_token_cache_misses_total', 'counter', 'Token lookups that went to the database.', stats['misses']),
+            ('api_token_cache_size', 'gauge', 'Tokens held in the in-process cache.', stats['size']),
+        ))
+        return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
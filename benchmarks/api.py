@@ -0,0 +1,282 @@
+"""
+Drives the API hot paths against a synthetic dataset and reports latency percentiles,
+throughput and SQL queries per request.
+
+    python -m benchmarks.api --users 200 --cards 5000 --requests 200
+    python -m benchmarks.api --output benchmarks/baseline.json
+    python -m benchmarks.api --baseline benchmarks/baseline.json --tolerance 0.25
+
+By default the data is seeded into a throwaway test database and requests go through
+Django's test client. With --base-url the data is seeded into the configured database
+and requests go over HTTP to a running server (e.g. gunicorn words_world.wsgi), with
+queries per request read from its /api/_metrics endpoint. Exits with status 1 when a
+--baseline comparison finds a regression beyond the tolerance.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+import django
+
+HIGHER_IS_WORSE = ('p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request')
+LOWER_IS_WORSE = ('throughput',)
+
+
+def push_request(rng, data):
+    swiped = rng.sample(data['card_ids'], min(10, len(data['card_ids'])))
+    return 'PUT', '/api/statistics/push/', None, {
+        'correctly_swiped_cards': swiped[:6],
+        'incorrectly_swiped_cards': swiped[6:],
+        'correctly_ans_flashcards': [1, 2],
+        'incorrectly_ans_flashcards': [3],
+        'translated_words': rng.randint(0, 3),
+    }
+
+
+def random_cards_request(rng, data):
+    return 'GET', '/api/taboo/cards/random/', {'card_count': 10, 'language_id': rng.choice(data['language_ids'])}, None
+
+
+def flashcards_request(rng, data):
+    return 'GET', '/api/flashcards/', {'language_code': rng.choice(data['language_codes']),
+                                       'difficulty': rng.choice(('EASY', 'MEDIUM', 'HARD', 'INSANE')),
+                                       'count': 15}, None
+
+
+def users_request(rng, data):
+    return 'GET', '/api/users/', None, None
+
+
+def me_request(rng, data):
+    return 'GET', '/api/users/me/', None, None
+
+
+SCENARIOS = (
+    ('statistics-push', push_request),
+    ('taboo_cards-random', random_cards_request),
+    ('flashcards-list', flashcards_request),
+    ('user-list', users_request),
+    ('user-me', me_request),
+)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class TestClientDriver(object):
+    def __init__(self):
+        from rest_framework.test import APIClient
+
+        self.client = APIClient()
+
+    def send(self, token, method, path, params, body):
+        from django.db import connections
+        from django.test.utils import CaptureQueriesContext
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token %s' % token)
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(connection)) for connection in connections.all()]
+            started = time.perf_counter()
+            if method == 'GET':
+                response = self.client.get(path, params)
+            else:
+                response = self.client.generic(method, path, json.dumps(body), content_type='application/json')
+            elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise RuntimeError('%s %s answered %s' % (method, path, response.status_code))
+        return elapsed, sum(len(context) for context in captured)
+
+    def query_totals(self, admin_token):
+        return None
+
+
+class HttpDriver(object):
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, token, method, path, params=None, body=None):
+        url = self.base_url + path
+        if params:
+            url += '?' + urllib.parse.urlencode(params)
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(url, data=data, method=method, headers={
+            'Authorization': 'Token %s' % token, 'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request) as response:
+            return response.read()
+
+    def send(self, token, method, path, params, body):
+        started = time.perf_counter()
+        self.request(token, method, path, params, body)
+        return time.perf_counter() - started, None
+
+    def query_totals(self, admin_token):
+        totals = {}
+        for line in self.request(admin_token, 'GET', '/api/_metrics').decode('utf-8').splitlines():
+            for name in ('api_db_queries_total', 'api_requests_total'):
+                if line.startswith(name + '{'):
+                    labels, value = line[len(name) + 1:].rsplit('} ', 1)
+                    route = dict(pair.split('=', 1) for pair in labels.split(','))['route'].strip('"')
+                    totals.setdefault(route, {}).setdefault(name, 0)
+                    totals[route][name] += float(value)
+        return totals
+
+
+def run_scenario(driver, data, route, build, requests, warmup, concurrency, rng):
+    plans = [build(rng, data) for _ in range(warmup + requests)]
+    tokens = [rng.choice(data['tokens']) for _ in plans]
+    for token, plan in zip(tokens[:warmup], plans[:warmup]):
+        driver.send(token, *plan)
+
+    before = driver.query_totals(data['admin_token'])
+    latencies, queries = [], []
+    lock = threading.Lock()
+
+    def send(index):
+        elapsed, query_count = driver.send(tokens[index], *plans[index])
+        with lock:
+            latencies.append(elapsed)
+            if query_count is not None:
+                queries.append(query_count)
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(send, range(warmup, len(plans))))
+    else:
+        for index in range(warmup, len(plans)):
+            send(index)
+    wall = time.perf_counter() - started
+
+    if before is not None:
+        after = driver.query_totals(data['admin_token'])
+        served = after.get(route, {}).get('api_requests_total', 0) - before.get(route, {}).get('api_requests_total', 0)
+        executed = after.get(route, {}).get('api_db_queries_total', 0) - before.get(route, {}).get(
+            'api_db_queries_total', 0)
+        queries_per_request = executed / served if served else None
+    else:
+        queries_per_request = sum(queries) / len(queries) if queries else None
+
+    return {
+        'requests': len(latencies),
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'throughput': len(latencies) / wall,
+        'queries_per_request': queries_per_request,
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for route, metrics in sorted(results.items()):
+        expected = baseline.get('results', {}).get(route)
+        if not expected:
+            continue
+        for name in HIGHER_IS_WORSE + LOWER_IS_WORSE:
+            value, reference = metrics.get(name), expected.get(name)
+            if value is None or reference is None:
+                continue
+            if name in HIGHER_IS_WORSE and value > reference * (1 + tolerance) and value - reference > 1e-9:
+                regressions.append('%s %s: %.2f > baseline %.2f' % (route, name, value, reference))
+            elif name in LOWER_IS_WORSE and value < reference * (1 - tolerance):
+                regressions.append('%s %s: %.2f < baseline %.2f' % (route, name, value, reference))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--languages', type=int, default=5)
+    parser.add_argument('--cards', type=int, default=5000)
+    parser.add_argument('--achievements', type=int, default=20)
+    parser.add_argument('--follows', type=int, default=10, help='Follow edges per user.')
+    parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario.')
+    parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per scenario.')
+    parser.add_argument('--concurrency', type=int, default=1, help='Parallel requests (--base-url only).')
+    parser.add_argument('--scenario', action='append', choices=[route for route, _ in SCENARIOS],
+                        help='Run only these scenarios.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--base-url', help='Benchmark a running server instead of the test client.')
+    parser.add_argument('--skip-seed', action='store_true', help='Reuse data seeded by an earlier --base-url run.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', help='Compare against this JSON file and fail on regressions.')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'words_world.settings')
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_databases, setup_test_environment, teardown_databases
+
+    from benchmarks import seed
+
+    old_config = None
+    if args.base_url:
+        driver = HttpDriver(args.base_url)
+        concurrency = args.concurrency
+    else:
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        driver = TestClientDriver()
+        concurrency = 1
+
+    try:
+        if args.skip_seed:
+            data = seed.seeded()
+        else:
+            data = seed.seed(args.users, args.languages, args.cards, args.achievements, args.follows, args.seed)
+
+        config = {key: getattr(args, key) for key in ('users', 'languages', 'cards', 'achievements', 'follows',
+                                                       'requests', 'warmup', 'seed')}
+        config.update(vendor=connection.vendor, driver='http' if args.base_url else 'test-client',
+                      concurrency=concurrency)
+        print('%(driver)s on %(vendor)s, %(users)d users, %(cards)d cards, %(requests)d requests per scenario'
+              % config)
+        print('%-20s %9s %9s %9s %11s %9s' % ('route', 'p50 ms', 'p95 ms', 'p99 ms', 'req/sec', 'queries'))
+
+        results = {}
+        for route, build in SCENARIOS:
+            if args.scenario and route not in args.scenario:
+                continue
+            rng = random.Random('%s:%s' % (args.seed, route))
+            metrics = run_scenario(driver, data, route, build, args.requests, args.warmup, concurrency, rng)
+            results[route] = metrics
+            queries = metrics['queries_per_request']
+            print('%-20s %9.2f %9.2f %9.2f %11.1f %9s' % (
+                route, metrics['p50_ms'], metrics['p95_ms'], metrics['p99_ms'], metrics['throughput'],
+                '-' if queries is None else '%.1f' % queries))
+    finally:
+        if old_config is not None:
+            teardown_databases(old_config, verbosity=0)
+
+    report = {'config': config, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+            output.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print('Regressions beyond %.0f%% tolerance:' % (args.tolerance * 100))
+            for regression in regressions:
+                print('  ' + regression)
+            sys.exit(1)
+        print('No regressions beyond %.0f%% tolerance.' % (args.tolerance * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Compares real gunicorn sync workers serving words_world.wsgi with uvicorn serving
+words_world.asgi when many slow clients poll the read-heavy endpoints (random word,
+languages, flashcards, users/me).
+
+    python -m benchmarks.asgi --clients 200 --workers 8 --client-latency 50
+    python -m benchmarks.asgi --skip-seed --output benchmarks/asgi.json
+
+The data is seeded into the configured database (run migrate first), then each
+server is started as a subprocess on a local port and driven over real sockets.
+A slow client sends the first half of its request, waits --client-latency
+milliseconds and only then finishes the headers: a sync worker is held for that
+whole time, while uvicorn waits on its event loop. gunicorn runs --workers sync
+workers; uvicorn runs one process with --workers handler threads (ASGI_THREADS).
+Requires gunicorn and uvicorn to be installed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import django
+
+
+def polling_requests(data):
+    return (
+        ('/api/words/random', ''),
+        ('/api/languages/', ''),
+        ('/api/users/me/', ''),
+        ('/api/flashcards/', 'language_code=%s&difficulty=EASY&count=15' % data['language_codes'][0]),
+    )
+
+
+def summarize(latencies, wall):
+    from benchmarks.api import percentile
+
+    return {
+        'requests': len(latencies),
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'throughput': len(latencies) / wall,
+    }
+
+
+def plans_for(data, clients, requests, seed):
+    rng = random.Random(seed)
+    targets = polling_requests(data)
+    return [[(rng.choice(targets), rng.choice(data['tokens'])) for _ in range(requests)] for _ in range(clients)]
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def server_command(mode, port, workers):
+    if mode == 'wsgi':
+        # gunicorn 19 has no __main__ module, so start its console entry point directly.
+        return [sys.executable, '-c', 'from gunicorn.app.wsgiapp import run; run()',
+                'words_world.wsgi:application', '--worker-class', 'sync',
+                '--workers', str(workers), '--bind', '127.0.0.1:%d' % port, '--log-level', 'warning']
+    return [sys.executable, '-m', 'uvicorn', 'words_world.asgi:application', '--host', '127.0.0.1',
+            '--port', str(port), '--log-level', 'warning', '--no-access-log']
+
+
+def start_server(mode, port, workers, timeout=30.0):
+    environment = dict(os.environ, ASGI_THREADS=str(workers), INSTRUMENTATION_ENABLED='0')
+    process = subprocess.Popen(server_command(mode, port, workers), env=environment)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('%s server exited with status %s' % (mode, process.returncode))
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    stop_server(process)
+    raise RuntimeError('%s server did not start within %.0f seconds' % (mode, timeout))
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def exchange(port, path, query_string, token, latency):
+    target = path + ('?' + query_string if query_string else '')
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(('GET %s HTTP/1.1\r\nHost: 127.0.0.1:%d\r\n' % (target, port)).encode('latin-1'))
+        await writer.drain()
+        await asyncio.sleep(latency)
+        writer.write(('Authorization: Token %s\r\nConnection: close\r\n\r\n' % token).encode('latin-1'))
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+    finally:
+        writer.close()
+    status = int(status_line.split()[1]) if status_line else 0
+    if not 200 <= status < 400:
+        raise RuntimeError('GET %s answered %s' % (target, status or 'nothing'))
+
+
+def drive(port, plans, latency):
+    latencies = []
+
+    async def client(plan):
+        for (path, query_string), token in plan:
+            started = time.perf_counter()
+            await exchange(port, path, query_string, token, latency)
+            latencies.append(time.perf_counter() - started)
+
+    async def main():
+        await asyncio.gather(*[client(plan) for plan in plans])
+
+    started = time.perf_counter()
+    asyncio.run(main())
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def run(mode, plans, workers, latency):
+    port = free_port()
+    process = start_server(mode, port, workers)
+    try:
+        drive(port, [plan[:1] for plan in plans[:workers]], 0)
+        return drive(port, plans, latency)
+    finally:
+        stop_server(process)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--cards', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=100, help='Concurrent polling clients.')
+    parser.add_argument('--requests', type=int, default=10, help='Sequential requests per client.')
+    parser.add_argument('--workers', type=int, default=8, help='gunicorn sync workers, or uvicorn handler threads.')
+    parser.add_argument('--client-latency', type=float, default=50,
+                        help='Milliseconds each client pauses in the middle of sending its request.')
+    parser.add_argument('--mode', action='append', choices=('wsgi', 'asgi'), help='Run only these servers.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-seed', action='store_true', help='Reuse data seeded by an earlier run.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'words_world.settings')
+    django.setup()
+
+    from benchmarks import seed
+
+    if args.skip_seed:
+        data = seed.seeded()
+    else:
+        data = seed.seed(users=args.users, cards=args.cards, random_seed=args.seed)
+    plans = plans_for(data, args.clients, args.requests, args.seed)
+    latency = args.client_latency / 1000.0
+
+    print('%d clients x %d requests, %d workers, %.0f ms client latency' % (
+        args.clients, args.requests, args.workers, args.client_latency))
+    print('%-6s %9s %9s %9s %11s' % ('mode', 'p50 ms', 'p95 ms', 'p99 ms', 'req/sec'))
+    results = {}
+    for mode in args.mode or ('wsgi', 'asgi'):
+        results[mode] = metrics = run(mode, plans, args.workers, latency)
+        print('%-6s %9.2f %9.2f %9.2f %11.1f' % (
+            mode, metrics['p50_ms'], metrics['p95_ms'], metrics['p99_ms'], metrics['throughput']))
+
+    if args.output:
+        config = {key: getattr(args, key) for key in ('users', 'cards', 'clients', 'requests', 'workers',
+                                                       'client_latency', 'seed')}
+        with open(args.output, 'w') as output:
+            json.dump({'config': config, 'results': results}, output, indent=2, sort_keys=True)
+            output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
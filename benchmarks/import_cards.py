@@ -0,0 +1,55 @@
+"""
+Imports synthetic taboo cards into a throwaway test database and reports rows/sec.
+
+    python -m benchmarks.import_cards --rows 20000 --batch-size 100 500 2000
+
+The default settings benchmark SQLite; set DATABASE_URL to a Postgres server
+to benchmark Postgres instead.
+"""
+import argparse
+import os
+import time
+
+import django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[100, 500, 2000])
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'words_world.settings')
+    django.setup()
+
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test.utils import setup_databases, setup_test_environment, teardown_databases
+
+    from api import cards_io
+    from api.models import Language, TabooCard
+
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        owner = User.objects.create_user(username='benchmark', password='benchmark')
+        codes = ['l%d' % i for i in range(5)]
+        for code in codes:
+            Language.objects.create(name=code, language_code=code)
+        rows = [(line, {'key_word': 'word %d' % line, 'black_list': 'one;two;three;four;five',
+                        'language': codes[line % len(codes)]}) for line in range(1, args.rows + 1)]
+
+        print('%s, %d rows' % (connection.vendor, args.rows))
+        for batch_size in args.batch_size:
+            started = time.monotonic()
+            result = cards_io.import_cards(iter(rows), owner, batch_size)
+            elapsed = time.monotonic() - started
+            print('batch size %5d: %8.0f rows/sec (%d created in %.2fs)' % (
+                batch_size, result['created'] / elapsed, result['created'], elapsed))
+            TabooCard.objects.all().delete()
+    finally:
+        teardown_databases(old_config, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
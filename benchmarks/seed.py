@@ -0,0 +1,83 @@
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+
+from api.models import Achievement, Language, Statistic, TabooCard, UserFollowing
+from api.sampling import sampler
+
+PASSWORD = 'benchmark'
+BATCH_SIZE = 500
+
+
+def chunked_create(model, objects):
+    for start in range(0, len(objects), BATCH_SIZE):
+        model.objects.bulk_create(objects[start:start + BATCH_SIZE])
+
+
+def seed(users=200, languages=5, cards=5000, achievements=20, follows=10, random_seed=0):
+    rng = random.Random(random_seed)
+    password = make_password(PASSWORD)
+
+    with transaction.atomic():
+        chunked_create(User, [User(username='bench%d' % i, email='bench%d@example.com' % i, password=password)
+                              for i in range(users)])
+        user_ids = list(User.objects.filter(username__startswith='bench').order_by('pk').values_list('pk', flat=True))
+        chunked_create(Statistic, [Statistic(user_id=pk, swiped_taboo_cards=rng.randint(0, 500),
+                                             translated_words=rng.randint(0, 200)) for pk in user_ids])
+        chunked_create(Token, [Token(key=Token().generate_key(), user_id=pk) for pk in user_ids])
+        admin = User.objects.create_superuser(username='bench-admin', email='admin@example.com', password=PASSWORD)
+
+        chunked_create(Language, [Language(name='Language %d' % i, language_code='b%d' % i)
+                                  for i in range(languages)])
+        language_ids = list(Language.objects.filter(language_code__startswith='b').values_list('pk', flat=True))
+        through = Language.users.through
+        chunked_create(through, [through(user_id=pk, language_id=language_id)
+                                 for pk in user_ids
+                                 for language_id in rng.sample(language_ids, min(2, len(language_ids)))])
+
+        card_rows = []
+        for i in range(cards):
+            times_shown = rng.randint(0, 40)
+            card_rows.append(TabooCard(key_word='word %d' % i, black_list='one;two;three;four;five',
+                                       owner_id=rng.choice(user_ids), language_id=rng.choice(language_ids),
+                                       times_shown=times_shown, answered_correctly=rng.randint(0, times_shown),
+                                       normalized_key_word='word %d' % i))
+            card_rows[-1].difficulty_bucket = card_rows[-1].difficulty
+        chunked_create(TabooCard, card_rows)
+
+        for i in range(achievements):
+            field = rng.choice(('swiped_taboo_cards', 'translated_words'))
+            Achievement.objects.create(condition='user.statistics.%s >= %d' % (field, (i + 1) * 25),
+                                       name='Achievement %d' % i, font_awesome_icon='fa-star',
+                                       level=str(i % 4 + 1), score=(i % 4 + 1) * 10)
+
+        edges = []
+        for pk in user_ids:
+            candidates = [other for other in rng.sample(user_ids, min(follows + 1, len(user_ids))) if other != pk]
+            edges += [UserFollowing(user_id=pk, following_id=other) for other in candidates[:follows]]
+        chunked_create(UserFollowing, edges)
+
+    Token.objects.create(user=admin)
+    sampler.invalidate()
+    return seeded()
+
+
+def seeded():
+    user_ids = list(User.objects.filter(username__startswith='bench').exclude(username='bench-admin')
+                    .order_by('pk').values_list('pk', flat=True))
+    if not user_ids:
+        raise RuntimeError('No benchmark data found; run without --skip-seed first.')
+    tokens = dict(Token.objects.filter(user_id__in=user_ids).values_list('user_id', 'key'))
+    languages = list(Language.objects.filter(language_code__startswith='b').values_list('pk', 'language_code'))
+    return {
+        'user_ids': user_ids,
+        'tokens': [tokens[pk] for pk in user_ids],
+        'admin_token': Token.objects.get(user__username='bench-admin').key,
+        'language_ids': [pk for pk, _ in languages],
+        'language_codes': [code for _, code in languages],
+        'card_ids': list(TabooCard.objects.filter(language_id__in=[pk for pk, _ in languages])
+                         .values_list('pk', flat=True)),
+    }
@@ -0,0 +1,170 @@
+"""
+ASGI config for words_world project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+for servers such as uvicorn or daphne:
+
+    uvicorn words_world.asgi:application
+    gunicorn -k uvicorn.workers.UvicornWorker words_world.asgi:application
+
+Django itself stays synchronous: requests are read and responses are written
+on the event loop, and only the Django handler runs on a bounded thread pool
+(settings.ASGI['THREADS']), so slow or idle clients do not hold a thread or a
+database connection. The WSGI entry point in words_world.wsgi is unchanged.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'words_world.settings')
+
+
+def environ_for(scope, body, size):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server_name),
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1')
+        if '_' in name:
+            # Like gunicorn and runserver: a header spelled with underscores would be indistinguishable from
+            # (and could spoof) the dash-separated one once both are mapped onto the environ.
+            continue
+        name = name.upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        if name in environ:
+            value = environ[name] + ('; ' if name == 'HTTP_COOKIE' else ',') + value
+        environ[name] = value
+    environ['CONTENT_LENGTH'] = str(size)
+    return environ
+
+
+class Cancelled(Exception):
+    pass
+
+
+class AsgiHandler(object):
+    def __init__(self, wsgi_application, threads=8, spool_size=1024 * 1024, queue_size=8):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+        self.spool_size = spool_size
+        self.queue_size = queue_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError('Unsupported ASGI scope type: %s' % scope['type'])
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await asyncio.get_event_loop().run_in_executor(None, self.executor.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, receive):
+        body = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None, 0
+            size += body.write(message.get('body', b''))
+            if not message.get('more_body', False):
+                body.seek(0)
+                return body, size
+
+    async def http(self, scope, receive, send):
+        body, size = await self.read_body(receive)
+        if body is None:
+            return
+
+        loop = asyncio.get_event_loop()
+        queue = asyncio.Queue(self.queue_size)
+        cancelled = threading.Event()
+        environ = environ_for(scope, body, size)
+        handled = loop.run_in_executor(self.executor, self.handle, environ, loop, queue, cancelled)
+        try:
+            while not (handled.done() and queue.empty()):
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait((getter, handled), return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    await send(getter.result())
+                else:
+                    getter.cancel()
+        finally:
+            cancelled.set()
+            while not queue.empty():
+                queue.get_nowait()
+            try:
+                await handled
+            finally:
+                body.close()
+
+    def handle(self, environ, loop, queue, cancelled):
+        def put(message):
+            if cancelled.is_set():
+                raise Cancelled
+            asyncio.run_coroutine_threadsafe(queue.put(message), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            response.update(status=int(status.split(' ', 1)[0]),
+                            headers=[(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                     for name, value in headers])
+
+        response = {}
+        result = self.wsgi_application(environ, start_response)
+        try:
+            put({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+            if getattr(result, 'streaming', False):
+                for chunk in result:
+                    if chunk:
+                        put({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                put({'type': 'http.response.body', 'body': b''})
+            else:
+                put({'type': 'http.response.body', 'body': b''.join(result)})
+        except Cancelled:
+            pass
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+
+def get_asgi_application():
+    from django.conf import settings
+
+    wsgi_application = get_wsgi_application()
+    options = dict({'THREADS': 8, 'SPOOL_SIZE': 1024 * 1024}, **getattr(settings, 'ASGI', {}))
+    return AsgiHandler(wsgi_application, threads=options['THREADS'], spool_size=options['SPOOL_SIZE'])
+
+
+application = get_asgi_application()
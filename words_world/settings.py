@@ -27,6 +27,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.InstrumentationMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,27 +58,171 @@ TEMPLATES = [
 ]
 
 REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': (
+        'api.authentication.CachedTokenAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ),
     'DEFAULT_FILTER_BACKENDS': ('django_filters.rest_framework.DjangoFilterBackend',),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
-    )
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
 }
 
 WSGI_APPLICATION = 'words_world.wsgi.application'
 
+ACHIEVEMENT_QUEUE = {
+    'BACKEND': os.environ.get('ACHIEVEMENT_QUEUE_BACKEND', 'sync'),
+    'COALESCE_WINDOW': float(os.environ.get('ACHIEVEMENT_QUEUE_COALESCE_WINDOW', 1.0)),
+    'BATCH_SIZE': 100,
+    'WORKERS': 2,
+}
+
+COUNTER_BUFFER = {
+    'BACKEND': os.environ.get('COUNTER_BUFFER_BACKEND', 'direct'),
+    'FLUSH_INTERVAL': float(os.environ.get('COUNTER_BUFFER_FLUSH_INTERVAL', 5.0)),
+    'MAX_BUFFERED_DELTAS': int(os.environ.get('COUNTER_BUFFER_MAX_BUFFERED_DELTAS', 10000)),
+    'FLUSH_BATCH_SIZE': 500,
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    },
+}
+
+API_CACHE = 'default'
+
+LANGUAGE_LIST_CACHE_TIMEOUT = 60
+
+CARD_IMPORT_BATCH_SIZE = 500
+
+RESPONSE_CACHE = {
+    'BACKEND': os.environ.get('RESPONSE_CACHE_BACKEND', 'lru'),
+    'MAX_ENTRIES': int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1000)),
+    'TIMEOUT': 300,
+    'CACHE': 'default',
+}
+
+INSTRUMENTATION = {
+    'ENABLED': os.environ.get('INSTRUMENTATION_ENABLED', '1') == '1',
+    'QUERY_BUDGET': int(os.environ.get('INSTRUMENTATION_QUERY_BUDGET', 20)),
+    'QUERY_BUDGETS': {'batch': None},
+    # Route metrics live in each worker process. Point this at a directory shared by the workers (and emptied on
+    # deploy) so /api/_metrics sums every worker instead of reporting whichever one answered the scrape. The token
+    # cache figures are always those of the answering worker.
+    'MULTIPROCESS_DIR': os.environ.get('INSTRUMENTATION_MULTIPROCESS_DIR') or None,
+}
+
+CARD_SNAPSHOT = {
+    'ENABLED': os.environ.get('CARD_SNAPSHOT_ENABLED', '0') == '1',
+    'PATH': os.environ.get('CARD_SNAPSHOT_PATH', os.path.join(BASE_DIR, 'card_snapshot.bin')),
+    'CHECK_INTERVAL': 1.0,
+    'REBUILD_ON_CHANGE': True,
+    'REBUILD_DELAY': float(os.environ.get('CARD_SNAPSHOT_REBUILD_DELAY', 2.0)),
+}
+
+FLASHCARD_SCHEDULER = {
+    'DEFAULT_DUE_CARDS': 15,
+    'MAX_DUE_CARDS': 50,
+}
+
+SYNC = {
+    'MAX_CHANGES': 1000,
+    'SETTLE_SECONDS': 5,
+    'MAX_PUSHES': 100,
+}
+
+ASGI = {
+    'THREADS': int(os.environ.get('ASGI_THREADS', 0)) or int(os.environ.get('DB_POOL_SIZE', 0)) or 8,
+    'SPOOL_SIZE': 1024 * 1024,
+}
+
+BATCH = {
+    'MAX_OPERATIONS': 20,
+}
+
+LEADERBOARD_DEFAULT_LIMIT = 20
+
+LEADERBOARD_MAX_LIMIT = 100
+
+TOKEN_AUTH_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 300,
+    'SHARED_CACHE': os.environ.get('TOKEN_AUTH_SHARED_CACHE') or None,
+}
+
+
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 600))
+
+DB_SSL_REQUIRE = os.environ.get('DB_SSL_REQUIRE', '1') == '1'
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 0))
+
+POOLED_ENGINES = {
+    'django.db.backends.postgresql': 'api.backends.postgresql',
+    'django.db.backends.postgresql_psycopg2': 'api.backends.postgresql',
+    'django.db.backends.sqlite3': 'api.backends.sqlite3',
+}
 
 if os.environ.get('DATABASE_URL', ''):
     DATABASES = {
-        'default': dj_database_url.config()
+        'default': dj_database_url.config(conn_max_age=DB_CONN_MAX_AGE, ssl_require=DB_SSL_REQUIRE)
     }
+    if 'CI' in os.environ:
+        DATABASES['default']['TEST'] = DATABASES['default']
+    if os.environ.get('DATABASE_REPLICA_URL', ''):
+        DATABASES['replica'] = dj_database_url.parse(os.environ['DATABASE_REPLICA_URL'],
+                                                     conn_max_age=DB_CONN_MAX_AGE, ssl_require=DB_SSL_REQUIRE)
+        DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
 else:
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-        }    
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'OPTIONS': {
+                'timeout': 20,
+            },
+            'TEST': {
+                'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+            },
+        },
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'OPTIONS': {
+                'timeout': 20,
+            },
+            'TEST': {
+                'MIRROR': 'default',
+            },
+        },
     }
 
+if DB_POOL_SIZE:
+    for database in DATABASES.values():
+        database.update({
+            'ENGINE': POOLED_ENGINES.get(database['ENGINE'], database['ENGINE']),
+            'CONN_MAX_AGE': 0,
+            'POOL': {
+                'SIZE': DB_POOL_SIZE,
+                'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            },
+        })
+
+DATABASE_ROUTERS = ['api.routers.PrimaryReplicaRouter']
+
+DATABASE_CONNECTIONS = {
+    'HEALTH_CHECKS': os.environ.get('DB_HEALTH_CHECKS', '1') == '1',
+    'REPLICA': 'replica',
+    'REPLICA_READS': os.environ.get('DB_REPLICA_READS', '1' if os.environ.get('DATABASE_REPLICA_URL') else '0') == '1',
+    'PIN_SECONDS': float(os.environ.get('DB_REPLICA_PIN_SECONDS', 5)),
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -109,4 +255,4 @@ STATICFILES_DIRS = (
     os.path.join(BASE_DIR, 'static'),
 )
 
-django_heroku.settings(locals())
+django_heroku.settings(locals(), databases=False)
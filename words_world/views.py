@@ -4,6 +4,7 @@ from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from api.authentication import token_cache
 from api.serializers import UserBaseSerializer
 
 
@@ -16,5 +17,6 @@ class SignUpView(APIView):
         serializer.is_valid(raise_exception=True)
         user = User.objects.create_user(**serializer.validated_data)
         token, _ = Token.objects.get_or_create(user=user)
+        token_cache.set(token)
         return Response({'token': token.key})
 